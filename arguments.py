@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+""" Command argument parsing for faceswap Discord bot
+
+The task names for a command are compiled once into a single hash map that resolves the task
+names, any aliases given for them in the lookups, and any abbreviation of at least
+:attr:`MIN_PREFIX` characters that is the start of only one task name or alias. A command
+message is then split into mentioned users, words and task in a single pass.
+"""
+from __future__ import annotations
+import logging
+import string
+import typing as T
+
+if T.TYPE_CHECKING:
+    from discord import Message
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+MIN_PREFIX = 3
+# Punctuation that may surround a mention, without the brackets that are part of it
+_PUNCTUATION = "".join(char for char in string.punctuation if char not in "<>")
+
+
+class TaskMatcher():
+    """ Resolves a word to the task it names, by task name, alias or unique abbreviation of at
+    least min_prefix characters. Aliases for tasks that do not exist are ignored """
+    __slots__ = ("_lookup", )
+
+    def __init__(self,
+                 tasks: T.Iterable[str],
+                 aliases: T.Optional[T.Dict[str, str]] = None,
+                 min_prefix: int = MIN_PREFIX) -> None:
+        names = {task.lower(): task.lower() for task in tasks}
+        for alias, task in (aliases or {}).items():
+            if task.lower() not in names:
+                logger.warning("Ignoring alias '%s' for unknown task '%s'", alias, task)
+                continue
+            names.setdefault(alias.lower(), task.lower())
+
+        prefixes: T.Dict[str, T.Optional[str]] = {}
+        for name, task in names.items():
+            for end in range(min_prefix, len(name)):
+                prefix = name[:end]
+                prefixes[prefix] = task if prefixes.get(prefix, task) == task else None
+        self._lookup = {key: val for key, val in prefixes.items() if val is not None}
+        self._lookup.update(names)
+
+    def __len__(self) -> int:
+        return len(self._lookup)
+
+    def match(self, word: str) -> T.Optional[str]:
+        """ Return the lower case name of the task that a word refers to, or ``None`` """
+        return self._lookup.get(word.lower())
+
+
+class Arguments():
+    """ The arguments of a command message: the user and role mentions in the order they appear,
+    every other word including the command itself, and the lower case name of the first task
+    referred to after the command, or ``None`` """
+    __slots__ = ("at_users", "words", "task")
+
+    def __init__(self, at_users: T.List[str], words: T.List[str], task: T.Optional[str]) -> None:
+        self.at_users = at_users
+        self.words = words
+        self.task = task
+
+    def __repr__(self) -> str:
+        return (f"{self.__class__.__name__}(at_users={self.at_users}, words={self.words}, "
+                f"task={self.task!r})")
+
+
+def parse_arguments(message: Message, matcher: T.Optional[TaskMatcher] = None) -> Arguments:
+    """ Split a command message into its mentions, words and task. Mentions are identified from
+    the message's mention entities, so text that only looks like a mention is kept as a word. No
+    task is looked for if matcher is ``None`` """
+    mentions = {f"<@{user.id}>" for user in message.mentions}
+    mentions.update(f"<@!{user.id}>" for user in message.mentions)
+    mentions.update(f"<@&{role.id}>" for role in message.role_mentions)
+
+    at_users: T.List[str] = []
+    words: T.List[str] = []
+    task = None
+    for token in message.content.split():
+        mention = token.strip(_PUNCTUATION)
+        if mention in mentions:
+            at_users.append(mention)
+            continue
+        if task is None and matcher is not None and words:
+            task = matcher.match(token)
+        words.append(token)
+    retval = Arguments(at_users, words, task)
+    logger.debug("arguments: %s", retval)
+    return retval
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+""" Micro-benchmarks for the parsing, search and scraper paths of faceswap Discord bot
+
+Runs entirely offline. A mock lookup.json is written to a temporary folder, which the bot's
+modules are pointed at, and the FAQ scraper thread is never started. FAQ parsing and search are
+benchmarked against synthetic FAQ pages of increasing size, plus any pages saved into the
+``fixtures`` folder next to this file, for example with::
+
+    curl -o benchmarks/fixtures/faqpage.html https://faceswap.dev/forum/app.php/faqpage
+
+Results are written as JSON. Pass a previous result file with ``--compare`` to exit with an
+error if any benchmark has slowed down by more than ``--threshold``.
+
+Usage::
+
+    python benchmarks/bench.py [--sizes 50 500 5000 50000] [--output results.json]
+                               [--compare baseline.json] [--threshold 0.2] [--quick]
+"""
+from __future__ import annotations
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import timeit
+import typing as T
+
+from datetime import datetime
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+_FIXTURES = os.path.join(os.path.dirname(os.path.realpath(__file__)), "fixtures")
+_LOOKUP = {"global": {"token": "benchmark", "roles": ["Helper"]},
+           "donate": {"def": {}, "msg": "you can support us on Patreon.",
+                      "tasks": {name: {"title": name, "name": name, "icon": "", "thumbnail": ""}
+                                for name in ("patreon", "torzdf", "kvrooman", "bryanlyon")}},
+           "faqs": {"def": {}, "url": "https://faceswap.dev/forum/app.php/faqpage", "results": 5},
+           "forums": {"def": {}, "url": "https://faceswap.dev/forum/",
+                      "tasks": {f"task{idx}": idx for idx in range(20)}}}
+_WORDS = ("faceswap train training extract extraction convert model gpu cuda cudnn memory "
+          "error oom batch size mask alignments alignment preview loss tensorflow install "
+          "installer windows linux macos conda python video frames sort faces landmarks "
+          "encoder decoder dfl original villain realface dlight phaze lightweight nvidia amd "
+          "driver plugin config iterations timelapse learning rate warp").split()
+
+
+def _setup_environment(folder: str) -> None:
+    """ Point the bot's modules at a folder containing a mock lookup.json and put the bot on
+    the python path """
+    with open(os.path.join(folder, "lookup.json"), "w", encoding="utf-8") as lookup:
+        json.dump(_LOOKUP, lookup)
+    sys.argv[0] = os.path.join(folder, "bench.py")
+    sys.path.insert(0, _ROOT)
+
+
+def make_faq_page(entries: int, seed: int = 0) -> bytes:
+    """ Generate the HTML of a synthetic FAQ page with the given number of questions, in the same
+    format as the faceswap.dev FAQ page """
+    rnd = random.Random(seed)
+    vocab = list(_WORDS) + [f"term{idx}" for idx in range(max(200, entries // 5))]
+    weights = [1. / (rank + 1) for rank in range(len(vocab))]
+    sections = ["Installation", "Extracting", "Training", "Converting", "Troubleshooting"]
+    html = ["<html><body><div class='content'>"]
+    for idx, section in enumerate(sections):
+        html.append(f'<dl class="faq"><dt><strong>\t{section}</strong></dt>'
+                    f'<dd><a href="#f{idx}r0">{section}</a></dd></dl>')
+    for idx in range(entries):
+        question = " ".join(rnd.choices(vocab, weights, k=rnd.randint(5, 12)))
+        answer = " ".join(rnd.choices(vocab, weights, k=rnd.randint(30, 150)))
+        html.append(f'<dl class="faq"><dt id="f{idx % len(sections)}r{idx}"><strong>'
+                    f'{question}?</strong></dt><dd>\t{answer}.</dd></dl>')
+    html.append("</div></body></html>")
+    return "\n".join(html).encode("utf-8")
+
+
+def _measure(func: T.Callable[[], T.Any], repeat: int) -> T.Dict[str, float]:
+    """ Time the given function, returning per call timing statistics in seconds """
+    timer = timeit.Timer(func)
+    loops, _ = timer.autorange()
+    times = [elapsed / loops for elapsed in timer.repeat(repeat=repeat, number=loops)]
+    return {"loops": loops,
+            "best": min(times),
+            "median": statistics.median(times),
+            "mean": statistics.fmean(times),
+            "stdev": statistics.stdev(times) if len(times) > 1 else 0.0}
+
+
+class Suite():
+    """ Runs the benchmarks, repeating each timing repeat times, and collects the results """
+    def __init__(self, repeat: int) -> None:
+        self._repeat = repeat
+        self.results: T.List[T.Dict[str, T.Any]] = []
+
+    def run(self, benchmark: str, case: str, func: T.Callable[[], T.Any], **params: T.Any
+            ) -> None:
+        """ Time a benchmark case and store the result """
+        result = {"benchmark": benchmark, "case": case, **params, **_measure(func, self._repeat)}
+        self.results.append(result)
+        print(f"{benchmark:<22}{case:<26}{str(params.get('entries', '')):>8}"
+              f"{result['median'] * 1e6:>14.2f}us", file=sys.stderr)
+
+    def utils(self) -> None:
+        """ Benchmark the command argument helpers """
+        # pylint: disable=import-outside-toplevel
+        from types import SimpleNamespace
+        from arguments import parse_arguments
+        from responses import get_responses
+        from utils import format_message
+
+        message = SimpleNamespace(content="!forums <@12345> task12 please <@!67890> read this",
+                                  mentions=[SimpleNamespace(id=12345), SimpleNamespace(id=67890)],
+                                  role_mentions=[])
+        miss = SimpleNamespace(content="!forums nothing", mentions=[], role_mentions=[])
+        matcher = get_responses().matchers["forums"]
+        self.run("parse_arguments", "2_mentions", lambda: parse_arguments(message))
+        self.run("parse_arguments", "20_tasks", lambda: parse_arguments(message, matcher))
+        self.run("parse_arguments", "20_tasks_miss", lambda: parse_arguments(miss, matcher))
+        self.run("task_match", "exact", lambda: matcher.match("task1"))
+        self.run("format_message", "at_users",
+                 lambda: format_message("you should read the FAQs.", ["<@12345>"]))
+        self.run("format_message", "no_users",
+                 lambda: format_message("you should read the FAQs."))
+        template = get_responses().templates["donate"]
+        self.run("template_format", "at_users", lambda: template.format(["<@12345>"]))
+
+    def faqs(self, case: str, html: bytes) -> None:
+        """ Benchmark parsing and searching a FAQ page """
+        # pylint: disable=import-outside-toplevel
+        import lxml.html as LH
+        from scraper import FAQs, parse_faq_page
+
+        faqs = FAQs(snapshot_path=os.devnull)
+        faqs.set_faqs(parse_faq_page(html))
+        entries = len(faqs.entries)
+        self.run("parse_html", case, lambda: LH.fromstring(html), entries=entries)
+        self.run("parse_stream", case, lambda: parse_faq_page(html), entries=entries)
+        for name, query in (("single_term", "gpu"),
+                            ("multi_term", "cuda memory error"),
+                            ("prefix", "extr"),
+                            ("phrase", '"batch size"'),
+                            ("miss", "zzzzzz")):
+            self.run("faq_search", f"{case}:{name}",
+                     lambda q=query: faqs.search(q, limit=5), entries=entries)
+
+
+def compare(results: T.List[T.Dict[str, T.Any]], baseline_file: str, threshold: float) -> int:
+    """ Compare results against a baseline result file and return the number of benchmarks that are
+    slower than the baseline by more than threshold """
+    with open(baseline_file, "r", encoding="utf-8") as baseline:
+        previous = {(res["benchmark"], res["case"], res.get("entries")): res
+                    for res in json.load(baseline)["results"]}
+    regressions = 0
+    for result in results:
+        base = previous.get((result["benchmark"], result["case"], result.get("entries")))
+        if base is None:
+            continue
+        change = result["median"] / base["median"] - 1.0
+        if change > threshold:
+            regressions += 1
+            print(f"REGRESSION {result['benchmark']} {result['case']} "
+                  f"{result.get('entries', '')}: {change:+.1%}", file=sys.stderr)
+    return regressions
+
+
+def main() -> None:
+    """ Parse the command line and run the benchmarks """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 500, 5000, 50000],
+                        help="Numbers of FAQ entries for the synthetic pages")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing repeats per benchmark")
+    parser.add_argument("--output", help="File to write the JSON results to. Default: stdout")
+    parser.add_argument("--compare", help="Previous JSON results to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Fractional slow down that counts as a regression")
+    parser.add_argument("--quick", action="store_true",
+                        help="Single repeat and synthetic pages of up to 5000 entries")
+    args = parser.parse_args()
+    if args.quick:
+        args.repeat = 1
+        args.sizes = [size for size in args.sizes if size <= 5000]
+
+    with tempfile.TemporaryDirectory() as folder:
+        _setup_environment(folder)
+        from utils import load_lookups  # pylint: disable=import-outside-toplevel
+        logging.getLogger().setLevel(logging.WARNING)
+        load_lookups()
+
+        suite = Suite(args.repeat)
+        suite.utils()
+        for size in args.sizes:
+            suite.faqs(f"synthetic_{size}", make_faq_page(size))
+        if os.path.isdir(_FIXTURES):
+            for fname in sorted(os.listdir(_FIXTURES)):
+                if fname.endswith(".html"):
+                    with open(os.path.join(_FIXTURES, fname), "rb") as page:
+                        suite.faqs(os.path.splitext(fname)[0], page.read())
+        logging.shutdown()
+
+    output = json.dumps({"meta": {"time": datetime.now().isoformat(timespec="seconds"),
+                                  "python": platform.python_version(),
+                                  "platform": platform.platform(),
+                                  "repeat": args.repeat},
+                         "results": suite.results}, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out_file:
+            out_file.write(output)
+    else:
+        print(output)
+    if args.compare and compare(suite.results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
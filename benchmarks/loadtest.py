@@ -0,0 +1,701 @@
+#!/usr/bin/env python3
+""" End to end load test of faceswap Discord bot against a local stand-in for Discord
+
+Runs entirely offline. The bot is created exactly as in production, from a mock lookup.json in a
+temporary folder, and is pointed at a fake Discord that runs in its own thread and event loop:
+a websocket gateway that serves a synthetic guild and dispatches the scripted traffic, and a
+REST API that adds simulated latency and enforces per route rate limits, answering with 429
+responses in the same format as Discord. Extra 429s can be injected at random to exercise the
+bot's retry handling.
+
+Traffic is a mix of ``faqs``, ``donate`` and ``nobot`` commands issued by helpers, and bursts of
+AutoMod actions against new members, dispatched as a Poisson process at the configured rate.
+Every command is addressed to a different user, so that no reply is dropped as a duplicate, and
+each reply and REST call is attributed to the event that caused it. The latency of an event is
+measured from the gateway dispatch to the bot's reply being created by the REST API, so it
+includes the outbound queue, REST latency and any rate limit waits. The fake Discord shares
+the process with the bot, so very high rates measure the harness as well as the bot.
+
+A scripted run is a JSON list of phases, each with its own duration, rate and mix, for example
+a quiet period followed by a command storm::
+
+    [{"duration": 20, "rate": 2, "mix": {"faqs": 3, "donate": 1}},
+     {"duration": 10, "rate": 50, "mix": {"faqs": 5, "nobot": 1, "automod": 4}}]
+
+Results are written as JSON, with a summary table on stderr.
+
+Usage::
+
+    python benchmarks/loadtest.py [--rate 20] [--duration 30]
+                                  [--mix faqs=5,donate=1,nobot=1,automod=2] [--script run.json]
+                                  [--channels 10] [--latency 0.05] [--jitter 0.02]
+                                  [--inject-429 0.01] [--automod-burst 3] [--members 0]
+                                  [--member-cache none] [--chunk]
+                                  [--output results.json]
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import re
+import sys
+import tempfile
+import threading
+import typing as T
+
+from collections import Counter
+from datetime import datetime
+from time import monotonic, perf_counter, process_time
+
+import yarl
+
+from aiohttp import web, WSMsgType
+
+from bench import make_faq_page
+
+if T.TYPE_CHECKING:
+    from discord.ext.commands import Bot
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+_GUILD_ID = 900000000000000001
+_BOT_ID = 900000000000000002
+_RULE_ID = 900000000000000003
+_ROLE_IDS = {"Helper": 900000000000000011, "Bot Abuser": 900000000000000012}
+_JAIL_CHANNEL_ID = 900000000000000020
+_CHANNEL_BASE = 900000000000000100
+_HELPER_BASE = 910000000000000000
+_MEMBER_BASE = 920000000000000000
+_USER_BASE = 930000000000000000
+_MESSAGE_BASE = 940000000000000000
+_TIMESTAMP = "2024-01-01T00:00:00+00:00"
+_COMMANDS = ("faqs", "donate", "nobot", "automod")
+_FAQ_QUERIES = ("training", "extracting", "converting", "search gpu memory", "search cuda error",
+                "search batch size")
+_DONATEES = ("patreon", "torzdf", "kvrooman", "bryanlyon", "")
+# Discord's per route limits as (requests, seconds), with the major parameter of the route
+_ROUTE_LIMITS = {"POST /channels/{channel_id}/messages": (5, 5.),
+                 "DELETE /channels/{channel_id}/messages/{message_id}": (5, 1.),
+                 "POST /channels/{channel_id}/messages/bulk-delete": (1, 1.),
+                 "PUT /guilds/{guild_id}/members/{user_id}/roles/{role_id}": (10, 10.),
+                 "DELETE /guilds/{guild_id}/members/{user_id}/roles/{role_id}": (10, 10.)}
+_GLOBAL_LIMIT = (50, 1.)
+_MENTIONS = re.compile(r"<@!?(\d+)>")
+_LOOKUP = {"global": {"token": "loadtest", "roles": ["Helper"],
+                      "automod": {"rule_ids": [_RULE_ID]}},
+           "donate": {"def": {}, "msg": "you can support us on Patreon.",
+                      "tasks": {name: {"title": name, "name": name, "icon": "", "thumbnail": ""}
+                                for name in ("patreon", "torzdf", "kvrooman", "bryanlyon")}},
+           "faqs": {"def": {}, "url": "https://faceswap.dev/forum/app.php/faqpage", "results": 5},
+           "search": {"def": {}, "url": "https://faceswap.dev/forum/search.php"},
+           "tag": {"def": {}, "url": "https://faceswap.dev/forum/tag/"},
+           "refresh": {"def": {}},
+           "nobot": {"def": {}},
+           "iwillnotusebots": {"def": {}}}
+
+
+def _setup_environment(folder: str, cache: T.Dict[str, T.Any]) -> None:
+    """ Point the bot's modules at a folder containing a mock lookup.json, with the given cache
+    settings, and put the bot on the python path """
+    with open(os.path.join(folder, "lookup.json"), "w", encoding="utf-8") as lookup:
+        json.dump({**_LOOKUP, "global": {**_LOOKUP["global"], "cache": cache}}, lookup)
+    sys.argv[0] = os.path.join(folder, "loadtest.py")
+    sys.path.insert(0, _ROOT)
+
+
+def _user(user_id: int, name: str, bot: bool = False) -> T.Dict[str, T.Any]:
+    """ A user payload """
+    return {"id": str(user_id), "username": name, "discriminator": "0", "global_name": None,
+            "avatar": None, "bot": bot}
+
+
+def _member(user: T.Dict[str, T.Any], roles: T.Sequence[int] = ()) -> T.Dict[str, T.Any]:
+    """ A guild member payload """
+    return {"user": user, "roles": [str(role) for role in roles], "joined_at": _TIMESTAMP,
+            "deaf": False, "mute": False, "flags": 0}
+
+
+def _message(message_id: int,
+             channel_id: int,
+             author: T.Dict[str, T.Any],
+             content: str,
+             roles: T.Sequence[int] = (),
+             embeds: T.Optional[T.List[T.Dict[str, T.Any]]] = None,
+             reference: T.Optional[int] = None) -> T.Dict[str, T.Any]:
+    """ A message payload. Mentions are taken from the content """
+    retval = {"id": str(message_id), "channel_id": str(channel_id), "guild_id": str(_GUILD_ID),
+              "author": author, "member": {key: val for key, val in _member(author, roles).items()
+                                           if key != "user"},
+              "content": content, "timestamp": _TIMESTAMP, "edited_timestamp": None,
+              "tts": False, "mention_everyone": False, "mention_roles": [],
+              "mentions": [_user(int(user_id), f"user{user_id}")
+                           for user_id in _MENTIONS.findall(content)],
+              "attachments": [], "embeds": embeds or [], "pinned": False, "type": 0, "flags": 0,
+              "components": []}
+    if reference is not None:
+        retval["type"] = 19
+        retval["message_reference"] = {"message_id": str(reference),
+                                       "channel_id": str(channel_id),
+                                       "guild_id": str(_GUILD_ID)}
+    return retval
+
+
+def _json(data: T.Any, status: int = 200, headers: T.Optional[T.Dict[str, str]] = None
+          ) -> web.Response:
+    """ A JSON response with the exact content type that discord.py expects """
+    return web.Response(body=json.dumps(data).encode("utf-8"), status=status,
+                        headers={"Content-Type": "application/json", **(headers or {})})
+
+
+def _percentile(values: T.List[float], percentile: float) -> float:
+    """ Nearest rank percentile of sorted values """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(percentile / 100 * len(values)) - 1))]
+
+
+class _Event():
+    """ A scripted traffic event and the REST calls made in response to it """
+    def __init__(self, command: str, sent: float) -> None:
+        self.command = command
+        self.sent = sent
+        self.done: T.Optional[float] = None
+        self.rest: T.Counter[str] = Counter()
+
+
+class _Bucket():
+    """ A fixed window rate limit bucket, as Discord reports in its rate limit headers """
+    def __init__(self, limit: int, per: float) -> None:
+        self.limit = limit
+        self.per = per
+        self.remaining = limit
+        self.reset = monotonic() + per
+
+    def take(self) -> T.Optional[float]:
+        """ Take a request from the bucket. Returns ``None`` if allowed, otherwise the number of
+        seconds until the bucket resets """
+        now = monotonic()
+        if now >= self.reset:
+            self.remaining, self.reset = self.limit, now + self.per
+        if self.remaining <= 0:
+            return self.reset - now
+        self.remaining -= 1
+        return None
+
+
+class FakeDiscord():
+    """ A local stand-in for Discord's gateway and REST API that replays scripted traffic, with
+    simulated REST latency, injected 429s, AutoMod bursts and extra guild members """
+    def __init__(self,
+                 channels: int,
+                 latency: float,
+                 jitter: float,
+                 inject_429: float,
+                 automod_burst: int,
+                 members: int,
+                 seed: int) -> None:
+        self._channels = [_CHANNEL_BASE + idx for idx in range(channels)]
+        self._latency = latency
+        self._jitter = jitter
+        self._inject_429 = inject_429
+        self._automod_burst = automod_burst
+        self._members = members
+        self._rnd = random.Random(seed)
+        self._helpers = [_user(_HELPER_BASE + idx, f"helper{idx}") for idx in range(5)]
+        self._bot = _user(_BOT_ID, "fs_bot", bot=True)
+        self._ids = _MESSAGE_BASE
+        self._users = _USER_BASE
+        self._sequence = 0
+        self._ws: T.Optional[web.WebSocketResponse] = None
+        self._buckets: T.Dict[T.Tuple[str, str], _Bucket] = {}
+        self._messages: T.Dict[int, T.Dict[str, T.Any]] = {}
+        self._by_user: T.Dict[int, _Event] = {}
+        self._by_message: T.Dict[int, _Event] = {}
+        self.events: T.List[_Event] = []
+        self.rest: T.Counter[str] = Counter()
+        self.rate_limited: T.Counter[str] = Counter()
+        self.loop = asyncio.new_event_loop()
+        self.port = 0
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._serve, name="fake_discord", daemon=True)
+
+    # SERVER
+    def start(self) -> None:
+        """ Start the fake Discord in its own thread and wait for it to listen """
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self) -> None:
+        """ Stop the fake Discord's event loop """
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+    def _serve(self) -> None:
+        """ Run the gateway and REST API until stopped """
+        asyncio.set_event_loop(self.loop)
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_get("/", self._gateway)
+        app.router.add_get("/api/v10/users/@me", self._current_user)
+        app.router.add_get("/api/v10/oauth2/applications/@me", self._application)
+        app.router.add_get("/api/v10/gateway/bot", self._gateway_bot)
+        app.router.add_post("/api/v10/channels/{channel_id}/messages", self._create_message)
+        app.router.add_get("/api/v10/channels/{channel_id}/messages/{message_id}",
+                           self._get_message)
+        app.router.add_delete("/api/v10/channels/{channel_id}/messages/{message_id}",
+                              self._no_content)
+        app.router.add_post("/api/v10/channels/{channel_id}/messages/bulk-delete",
+                            self._no_content)
+        app.router.add_get("/api/v10/guilds/{guild_id}/members/{user_id}", self._get_member)
+        app.router.add_route("*", "/api/v10/guilds/{guild_id}/members/{user_id}/roles/{role_id}",
+                             self._no_content)
+        runner = web.AppRunner(app)
+        self.loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        self.loop.run_until_complete(site.start())
+        self.port = runner.addresses[0][1]
+        self._started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.run_until_complete(runner.cleanup())
+            self.loop.close()
+
+    def _attribute(self, request: web.Request, body: T.Any) -> T.List[_Event]:
+        """ The events that a REST request was made in response to """
+        events = []
+        info = request.match_info
+        if "user_id" in info:
+            events.append(self._by_user.get(int(info["user_id"])))
+        if "message_id" in info:
+            events.append(self._by_message.get(int(info["message_id"])))
+        if isinstance(body, dict):
+            events.extend(self._by_message.get(int(message_id))
+                          for message_id in body.get("messages", []))
+            events.extend(self._by_user.get(int(user_id))
+                          for user_id in _MENTIONS.findall(body.get("content") or ""))
+        return list({id(event): event for event in events if event is not None}.values())
+
+    def _limit(self, route: str, major: str) -> T.Tuple[T.Optional[float], T.Dict[str, str]]:
+        """ Apply the global and route rate limits to a request. Returns the seconds to retry
+        after if rate limited, and the rate limit headers """
+        retry_after = self._buckets.setdefault(("global", ""), _Bucket(*_GLOBAL_LIMIT)).take()
+        limits = _ROUTE_LIMITS.get(route)
+        if limits is None:
+            return retry_after, {}
+        bucket = self._buckets.setdefault((route, major), _Bucket(*limits))
+        if retry_after is None:
+            retry_after = bucket.take()
+        headers = {"X-RateLimit-Limit": str(bucket.limit),
+                   "X-RateLimit-Remaining": str(bucket.remaining),
+                   "X-RateLimit-Reset-After": f"{max(0., bucket.reset - monotonic()):.3f}",
+                   "X-RateLimit-Bucket": f"{abs(hash(route)):x}"}
+        return retry_after, headers
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        """ Count, attribute, delay and rate limit every REST request """
+        if not request.path.startswith("/api/"):
+            return await handler(request)
+        resource = request.match_info.route.resource
+        template = resource.canonical.removeprefix("/api/v10") if resource else request.path
+        route = f"{request.method} {template}"
+        body = await request.json() if request.can_read_body else None
+        request["body"] = body
+
+        self.rest[route] += 1
+        events = self._attribute(request, body)
+        for event in events:
+            event.rest[route] += 1
+        info = request.match_info
+        retry_after, headers = self._limit(route, info.get("channel_id", info.get("guild_id", "")))
+        scope = "user"
+        if retry_after is None and self._rnd.random() < self._inject_429:
+            retry_after, scope = round(self._rnd.uniform(0.1, 1.0), 3), "shared"
+        await asyncio.sleep(max(0., self._rnd.gauss(self._latency, self._jitter)))
+        if retry_after is not None:
+            self.rate_limited[route] += 1
+            return _json({"message": "You are being rate limited.",
+                          "retry_after": retry_after, "global": False},
+                         status=429,
+                         headers={**headers, "Via": "1.1 google",
+                                  "Retry-After": str(retry_after),
+                                  "X-RateLimit-Scope": scope})
+        response = await handler(request)
+        response.headers.update(headers)
+        if route == "POST /channels/{channel_id}/messages":
+            for event in events:
+                if event.done is None:
+                    event.done = perf_counter()
+        return response
+
+    # REST
+    async def _current_user(self, _: web.Request) -> web.Response:
+        return _json({**self._bot, "mfa_enabled": False, "flags": 0, "verified": True})
+
+    async def _application(self, _: web.Request) -> web.Response:
+        return _json({"id": str(_BOT_ID), "name": "fs_bot", "description": "", "icon": None,
+                      "bot_public": False, "bot_require_code_grant": False, "verify_key": "",
+                      "owner": self._helpers[0], "flags": 0})
+
+    async def _gateway_bot(self, _: web.Request) -> web.Response:
+        return _json({"url": f"ws://127.0.0.1:{self.port}", "shards": 1,
+                      "session_start_limit": {"total": 1000, "remaining": 1000,
+                                              "reset_after": 0, "max_concurrency": 1}})
+
+    async def _create_message(self, request: web.Request) -> web.Response:
+        body = request["body"] or {}
+        message = _message(self._next_id(), int(request.match_info["channel_id"]), self._bot,
+                           body.get("content") or "", embeds=body.get("embeds"))
+        return _json(message)
+
+    async def _get_message(self, request: web.Request) -> web.Response:
+        message = self._messages.get(int(request.match_info["message_id"]))
+        if message is None:
+            return _json({"message": "Unknown Message", "code": 10008}, status=404)
+        return _json(message)
+
+    async def _get_member(self, request: web.Request) -> web.Response:
+        user_id = int(request.match_info["user_id"])
+        return _json(_member(_user(user_id, f"user{user_id}")))
+
+    async def _no_content(self, _: web.Request) -> web.Response:
+        return web.Response(status=204)
+
+    # GATEWAY
+    def _guild(self) -> T.Dict[str, T.Any]:
+        """ The GUILD_CREATE payload. The extra members are only sent when chunked """
+        roles = [{"id": str(_GUILD_ID), "name": "@everyone", "permissions": "8", "position": 0}]
+        roles.extend({"id": str(role_id), "name": name, "permissions": "0", "position": idx + 1}
+                     for idx, (name, role_id) in enumerate(_ROLE_IDS.items()))
+        for role in roles:
+            role.update(color=0, hoist=False, managed=False, mentionable=False, flags=0)
+        channels = [{"id": str(channel_id), "type": 0, "name": f"general-{idx}", "position": idx,
+                     "permission_overwrites": [], "nsfw": False, "parent_id": None}
+                    for idx, channel_id in enumerate(self._channels)]
+        channels.append({"id": str(_JAIL_CHANNEL_ID), "type": 0, "name": "bot-jail",
+                         "position": len(channels), "permission_overwrites": [], "nsfw": False,
+                         "parent_id": None})
+        members = [_member(helper, [_ROLE_IDS["Helper"]]) for helper in self._helpers]
+        members.append(_member(self._bot))
+        return {"id": str(_GUILD_ID), "name": "Load Test", "owner_id": self._helpers[0]["id"],
+                "roles": roles, "channels": channels, "members": members,
+                "member_count": len(members) + self._members, "large": self._members > 0,
+                "unavailable": False, "features": [], "emojis": [], "stickers": [],
+                "voice_states": [], "presences": [], "threads": [], "stage_instances": [],
+                "guild_scheduled_events": [], "icon": None, "splash": None,
+                "verification_level": 0, "default_message_notifications": 0,
+                "explicit_content_filter": 0, "mfa_level": 0, "premium_tier": 0,
+                "system_channel_flags": 0, "preferred_locale": "en-US", "nsfw_level": 0,
+                "joined_at": _TIMESTAMP}
+
+    async def _send(self, payload: T.Dict[str, T.Any]) -> None:
+        """ Send a payload to the connected bot """
+        if self._ws is not None and not self._ws.closed:
+            await self._ws.send_str(json.dumps(payload))
+
+    async def dispatch(self, name: str, data: T.Dict[str, T.Any]) -> None:
+        """ Dispatch a gateway event to the bot """
+        self._sequence += 1
+        await self._send({"op": 0, "t": name, "s": self._sequence, "d": data})
+
+    async def _chunk_members(self, nonce: T.Optional[str]) -> None:
+        """ Send the extra guild members in chunks, as requested by the bot """
+        count = max(1, -(-self._members // 1000))
+        for index in range(count):
+            members = [_member(_user(_MEMBER_BASE + idx, f"member{idx}"))
+                       for idx in range(index * 1000, min(self._members, (index + 1) * 1000))]
+            await self.dispatch("GUILD_MEMBERS_CHUNK", {"guild_id": str(_GUILD_ID),
+                                                        "members": members,
+                                                        "chunk_index": index,
+                                                        "chunk_count": count,
+                                                        "nonce": nonce})
+
+    async def _gateway(self, request: web.Request) -> web.WebSocketResponse:
+        """ The gateway websocket: hello, identify, heartbeats and member chunk requests """
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self._ws = ws
+        await self._send({"op": 10, "d": {"heartbeat_interval": 41250}})
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                break
+            payload = json.loads(msg.data)
+            if payload["op"] == 1:
+                await self._send({"op": 11})
+            elif payload["op"] == 2:
+                await self.dispatch("READY",
+                                    {"v": 10, "user": self._bot, "session_id": "loadtest",
+                                     "resume_gateway_url": f"ws://127.0.0.1:{self.port}",
+                                     "guilds": [{"id": str(_GUILD_ID), "unavailable": True}],
+                                     "application": {"id": str(_BOT_ID), "flags": 0}})
+                await self.dispatch("GUILD_CREATE", self._guild())
+            elif payload["op"] == 8:
+                await self._chunk_members(payload["d"].get("nonce"))
+        return ws
+
+    # TRAFFIC
+    def _next_id(self) -> int:
+        self._ids += 1
+        return self._ids
+
+    def _new_user(self) -> int:
+        self._users += 1
+        return self._users
+
+    def _command(self,
+                 event: _Event,
+                 channel_id: int,
+                 content: str,
+                 reference: T.Optional[int] = None) -> T.Dict[str, T.Any]:
+        """ A command message from a helper, registered against its event """
+        message = _message(self._next_id(), channel_id, self._rnd.choice(self._helpers), content,
+                           roles=[_ROLE_IDS["Helper"]], reference=reference)
+        self._by_message[int(message["id"])] = event
+        return message
+
+    async def _send_event(self, command: str, channel_id: int) -> None:
+        """ Dispatch the gateway events for a single scripted event """
+        event = _Event(command, perf_counter())
+        self.events.append(event)
+        user_id = self._new_user()
+        self._by_user[user_id] = event
+        if command == "faqs":
+            await self.dispatch("MESSAGE_CREATE", self._command(
+                event, channel_id, f"!faqs <@{user_id}> {self._rnd.choice(_FAQ_QUERIES)}"))
+        elif command == "donate":
+            await self.dispatch("MESSAGE_CREATE", self._command(
+                event, channel_id, f"!donate <@{user_id}> {self._rnd.choice(_DONATEES)}"))
+        elif command == "nobot":
+            # The replied to message is not included, so the bot fetches it over REST
+            original = _message(self._next_id(), channel_id, _user(user_id, f"user{user_id}"),
+                                "/imagine a cat")
+            self._messages[int(original["id"])] = original
+            self._by_message[int(original["id"])] = event
+            await self.dispatch("MESSAGE_CREATE",
+                                self._command(event, channel_id, "!nobot",
+                                              reference=int(original["id"])))
+        else:
+            await self.dispatch("GUILD_MEMBER_ADD",
+                                {**_member(_user(user_id, f"user{user_id}")),
+                                 "guild_id": str(_GUILD_ID)})
+            for _ in range(self._automod_burst):
+                await self.dispatch("AUTO_MODERATION_ACTION_EXECUTION",
+                                    {"guild_id": str(_GUILD_ID), "rule_id": str(_RULE_ID),
+                                     "rule_trigger_type": 1, "user_id": str(user_id),
+                                     "action": {"type": 1, "metadata": {}},
+                                     "channel_id": str(channel_id),
+                                     "message_id": str(self._next_id()),
+                                     "alert_system_message_id": str(self._next_id()),
+                                     "content": "/imagine a cat", "matched_keyword": "/imagine",
+                                     "matched_content": "/imagine"})
+
+    async def replay(self, phases: T.List[T.Dict[str, T.Any]], drain: float) -> None:
+        """ Dispatch the scripted traffic phases, each a dict of "duration" in seconds, "rate" in
+        events per second and "mix" of command names to relative weights, then wait at most drain
+        seconds for the bot to finish responding """
+        for phase in phases:
+            commands, weights = zip(*phase["mix"].items())
+            end = perf_counter() + phase["duration"]
+            due = perf_counter()
+            while True:
+                due += self._rnd.expovariate(phase["rate"])
+                if due >= end:
+                    break
+                await asyncio.sleep(max(0., due - perf_counter()))
+                await self._send_event(self._rnd.choices(commands, weights)[0],
+                                       self._rnd.choice(self._channels))
+            await asyncio.sleep(max(0., end - perf_counter()))
+        end = perf_counter() + drain
+        while perf_counter() < end and any(event.done is None for event in self.events):
+            await asyncio.sleep(0.1)
+
+    def report(self) -> T.Dict[str, T.Any]:
+        """ Throughput, latency percentiles and REST call counts per command """
+        retval: T.Dict[str, T.Any] = {}
+        for command in _COMMANDS:
+            events = [event for event in self.events if event.command == command]
+            if not events:
+                continue
+            latency = sorted(event.done - event.sent for event in events
+                             if event.done is not None)
+            rest = sum((event.rest for event in events), Counter())
+            first = min(event.sent for event in events)
+            last = max((event.done for event in events if event.done is not None), default=first)
+            retval[command] = {"sent": len(events),
+                               "completed": len(latency),
+                               "throughput": len(latency) / (last - first) if last > first else 0.,
+                               "p50": _percentile(latency, 50),
+                               "p95": _percentile(latency, 95),
+                               "p99": _percentile(latency, 99),
+                               "max": latency[-1] if latency else 0.,
+                               "rest_calls": sum(rest.values()),
+                               "rest_per_event": sum(rest.values()) / len(events),
+                               "rest": dict(sorted(rest.items()))}
+        return retval
+
+
+async def _run(bot: Bot, fake: FakeDiscord, phases: T.List[T.Dict[str, T.Any]], drain: float
+               ) -> T.Dict[str, T.Any]:
+    """ Connect the bot to the fake Discord, replay the traffic once it is ready and close it.
+    Returns the seconds taken to become ready, including any member chunking, and the bot's cache
+    usage at the end of the run """
+    from memory import cache_usage  # pylint: disable=import-outside-toplevel
+    retval: T.Dict[str, T.Any] = {}
+    ready = asyncio.Event()
+    start = perf_counter()
+
+    async def on_ready() -> None:
+        ready.set()
+
+    bot.add_listener(on_ready)
+    async with bot:
+        runner = asyncio.create_task(bot.start("loadtest"), name="bot")
+        waiter = asyncio.create_task(ready.wait(), name="ready")
+        await asyncio.wait((runner, waiter), return_when=asyncio.FIRST_COMPLETED)
+        if runner.done():
+            waiter.cancel()
+            runner.result()
+            return retval
+        retval["ready_seconds"] = perf_counter() - start
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(fake.replay(phases, drain),
+                                                                   fake.loop))
+        retval["caches"] = {name: {"items": items, "bytes": size}
+                            for name, items, size in cache_usage(bot)}
+        await bot.close()
+        await runner
+    return retval
+
+
+def _parse_mix(mix: str) -> T.Dict[str, float]:
+    """ Parse a mix of the form ``faqs=5,donate=1`` """
+    retval = {}
+    for item in mix.split(","):
+        command, _, weight = item.partition("=")
+        if command not in _COMMANDS:
+            raise argparse.ArgumentTypeError(f"Unknown command '{command}'. Choose from "
+                                             f"{', '.join(_COMMANDS)}")
+        retval[command] = float(weight or 1)
+    return retval
+
+
+def format_report(report: T.Dict[str, T.Any]) -> str:
+    """ Format the per command report as text """
+    lines = [f"{'command':<10}{'sent':>7}{'done':>7}{'ev/s':>8}{'p50':>9}{'p95':>9}{'p99':>9}"
+             f"{'max':>9}{'rest/ev':>9}"]
+    for command, stats in report.items():
+        lines.append(f"{command:<10}{stats['sent']:>7}{stats['completed']:>7}"
+                     f"{stats['throughput']:>8.1f}"
+                     + "".join(f"{stats[key] * 1000:>7.0f}ms" for key in ("p50", "p95", "p99",
+                                                                          "max"))
+                     + f"{stats['rest_per_event']:>9.2f}")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    """ Parse the command line and run the load test """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rate", type=float, default=20., help="Events per second")
+    parser.add_argument("--duration", type=float, default=30., help="Seconds of traffic")
+    parser.add_argument("--mix", type=_parse_mix, default="faqs=5,donate=1,nobot=1,automod=2",
+                        help="Relative weights of the commands in the traffic")
+    parser.add_argument("--script",
+                        help="JSON file of traffic phases. Overrides --rate, --duration and --mix")
+    parser.add_argument("--channels", type=int, default=10,
+                        help="Number of channels that commands are issued in")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Mean simulated REST latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02,
+                        help="Standard deviation of the simulated REST latency in seconds")
+    parser.add_argument("--inject-429", type=float, default=0.,
+                        help="Probability of answering a REST request with a 429")
+    parser.add_argument("--automod-burst", type=int, default=3,
+                        help="AutoMod actions dispatched for each caught user")
+    parser.add_argument("--members", type=int, default=0,
+                        help="Extra guild members, sent when the bot requests member chunks")
+    parser.add_argument("--member-cache", choices=("all", "none"), default="none",
+                        help="The bot's member cache policy")
+    parser.add_argument("--chunk", action="store_true",
+                        help="Request all guild members when the bot connects")
+    parser.add_argument("--faqs", type=int, default=500,
+                        help="Number of entries on the synthetic FAQ page")
+    parser.add_argument("--drain", type=float, default=30.,
+                        help="Maximum seconds to wait for responses after the traffic ends")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--output", help="File to write the JSON results to. Default: stdout")
+    args = parser.parse_args()
+    if args.script:
+        with open(args.script, "r", encoding="utf-8") as script:
+            phases = json.load(script)
+        for phase in phases:
+            phase["mix"] = (_parse_mix(phase["mix"]) if isinstance(phase["mix"], str)
+                            else phase["mix"])
+    else:
+        phases = [{"duration": args.duration, "rate": args.rate, "mix": args.mix}]
+
+    with tempfile.TemporaryDirectory() as folder:
+        _setup_environment(folder, {"members": args.member_cache,
+                                    "chunk_guilds_at_startup": args.chunk})
+        # pylint: disable=import-outside-toplevel
+        import discord
+        from utils import load_lookups
+        logging.getLogger().setLevel(logging.WARNING)
+        load_lookups()
+        from commands import create_bot
+        from metrics import METRICS
+        from scraper import faq_cache, parse_faq_page
+
+        faq_cache.set_faqs(parse_faq_page(make_faq_page(args.faqs)))
+        faq_cache.loaded.set()
+        fake = FakeDiscord(args.channels, args.latency, args.jitter, args.inject_429,
+                           args.automod_burst, args.members, args.seed)
+        fake.start()
+        discord.http.Route.BASE = f"http://127.0.0.1:{fake.port}/api/v10"
+        discord.gateway.DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(
+            f"ws://127.0.0.1:{fake.port}/")
+
+        bot = create_bot()
+        start, cpu = perf_counter(), process_time()
+        try:
+            run = asyncio.run(_run(bot, fake, phases, args.drain))
+        finally:
+            fake.stop()
+        elapsed, cpu = perf_counter() - start, process_time() - cpu
+        logging.shutdown()
+
+    report = fake.report()
+    print(format_report(report), file=sys.stderr)
+    print(f"\n{METRICS.summary()}", file=sys.stderr)
+    completed = sum(stats["completed"] for stats in report.values())
+    output = json.dumps({"meta": {"time": datetime.now().isoformat(timespec="seconds"),
+                                  "python": platform.python_version(),
+                                  "platform": platform.platform(),
+                                  "phases": phases,
+                                  "channels": args.channels,
+                                  "latency": args.latency,
+                                  "jitter": args.jitter,
+                                  "inject_429": args.inject_429,
+                                  "automod_burst": args.automod_burst,
+                                  "members": args.members,
+                                  "member_cache": args.member_cache,
+                                  "chunk": args.chunk,
+                                  "seed": args.seed},
+                         "totals": {"sent": len(fake.events),
+                                    "completed": completed,
+                                    "elapsed": elapsed,
+                                    "cpu_seconds": cpu,
+                                    **run,
+                                    "rest_calls": dict(sorted(fake.rest.items())),
+                                    "rate_limited": dict(sorted(fake.rate_limited.items()))},
+                         "commands": report}, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out_file:
+            out_file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,34 @@
 #!/usr/bin/env python3
 """ Commands for faceswap Discord bot """
 from __future__ import annotations
-import asyncio
 import logging
-import sys
 import typing as T
 
+from time import perf_counter
+
 import discord
-from discord.ext.commands import Bot, has_any_role
-from discord import Embed, Intents
-from utils import format_message, get_def, get_roles, get_task, init_command, load_lookups
+from discord.ext.commands import AutoShardedBot, Bot, Command, has_any_role, has_permissions
+from discord import Intents, MemberCacheFlags
+from deletions import DELETIONS
+from forum import FORUM_INDEX
+from guild_cache import Debouncer, GUILD_CACHE
+from instance import get_instance
+from log_tools import set_log_context
+from memory import cache_usage, format_usage
+from metrics import InstrumentedContext, METRICS
+from outbound import BotContext, OUTBOX, Reply
+from registry import CommandRegistry
+from responses import get_responses
+from utils import (format_message, get_config, get_def, get_lookups, get_roles, init_command,
+                   log_command)
 from scraper import faq_cache
+from throttle import THROTTLE
 
 if T.TYPE_CHECKING:
     from discord.ext.commands.context import Context
     from discord.automod import AutoModAction
+    from responses import Responses
+    from slash import SlashCommands
 
 
 logger = logging.getLogger(__name__)
@@ -23,207 +37,294 @@ INTENTS = Intents.default()
 INTENTS.message_content = True
 INTENTS.members = True
 
-FS_BOT = Bot(intents=INTENTS, command_prefix=("?", "!", "/"))
 
+class _FSBotMixin():
+    """ Creates command contexts which are instrumented and send through the outbox, and starts
+    the background tasks once the bot has logged in """
+    registry: CommandRegistry
+    slash: T.Optional[SlashCommands] = None
+
+    async def get_context(self, origin, /, *, cls=BotContext):
+        return await super().get_context(origin, cls=cls)  # type: ignore[misc]
+
+    async def setup_hook(self) -> None:
+        """ Start the background tasks once the bot has logged in """
+        self.registry.start_watching()
+        DELETIONS.start(T.cast(Bot, self))
+        OUTBOX.configure(**get_config("channel_rate", {}))
+        port = get_config("metrics_port")
+        if port is not None:
+            # Each bot process on the host serves its metrics on its own port
+            await METRICS.serve(port=port + (get_instance() or 0))
+        await self.sync_slash_commands()
+
+    async def sync_slash_commands(self) -> None:
+        """ Sync the slash commands with the current lookups, if slash commands are enabled """
+        if self.slash is None:
+            return
+        try:
+            await self.slash.sync()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Failed to sync slash commands")
+
+
+class FSBot(_FSBotMixin, Bot):
+    """ The faceswap bot, connecting with a single shard """
+
+
+class ShardedFSBot(_FSBotMixin, AutoShardedBot):
+    """ The faceswap bot, connecting with multiple shards. Selected by a "shards" section in
+    the global lookups, which is passed to :class:`discord.ext.commands.AutoShardedBot` (for
+    example ``{"shard_count": 4, "shard_ids": [0, 1]}`` to run half of the shards in this
+    process, or ``{}`` to run all of the shards that Discord recommends). When several processes
+    share the lookups, "shard_ids" maps each instance id to its shards, for example
+    ``{"shard_count": 4, "shard_ids": {"0": [0, 1], "1": [2, 3]}}`` """
+
+
+JAIL_DEBOUNCE = Debouncer()
+
+_AUTOMOD = {"rule_ids": [1171530119630831689],  # InsightFace Bot AutoMod rule
+            "jail_role": "Bot Abuser",
+            "jail_channel": "bot-jail",
+            "debounce": 60}
+
+
+def get_automod_config(guild_id: T.Optional[int] = None) -> T.Dict[str, T.Any]:
+    """ Return the AutoMod jail settings for a guild from the lookups, falling back to the
+    defaults """
+    return {**_AUTOMOD, **get_config("automod", {}, guild_id=guild_id)}
+
+
+# Only the members that the bot acts on are needed, and they are fetched when they are not cached
+_CACHE = {"members": "none",
+          "chunk_guilds_at_startup": False,
+          "max_messages": 1000}
+
+
+def get_shard_config() -> T.Optional[T.Dict[str, T.Any]]:
+    """ Return the options for :class:`ShardedFSBot` from the lookups, with the shard ids of this
+    instance selected, or ``None`` to connect with a single shard """
+    shards = get_config("shards")
+    if shards is None or not isinstance(shards.get("shard_ids"), dict):
+        return shards
+    instance = get_instance()
+    if str(instance) not in shards["shard_ids"]:
+        raise ValueError(f"No shard ids in the lookups for instance: {instance}")
+    return {**shards, "shard_ids": shards["shard_ids"][str(instance)]}
+
+
+def get_cache_config() -> T.Dict[str, T.Any]:
+    """ Return the discord.py cache settings from the lookups, falling back to the defaults.
+    "members" is "all", "none" or a dict of :class:`discord.MemberCacheFlags` flags, for example
+    ``{"joined": true}`` to cache the members that join while the bot is running. The settings
+    are read when the bot is created """
+    return {**_CACHE, **get_config("cache", {})}
+
+
+async def fetch_member(guild: discord.Guild, user_id: int) -> T.Optional[discord.Member]:
+    """ Return a guild member from the member cache, fetching it from Discord if it is not
+    cached. ``None`` if the user is not a member of the guild """
+    member = guild.get_member(user_id)
+    if member is not None:
+        return member
+    try:
+        with METRICS.timer("phase_seconds", phase="fetch_member"):
+            return await guild.fetch_member(user_id)
+    except discord.NotFound:
+        return None
+
+
+async def record_command(context: InstrumentedContext) -> None:
+    """ Record the latency and outcome of every invoked command, in the metrics and in the log
+    for the log report """
+    assert context.command is not None
+    name = context.command.name
+    elapsed = perf_counter() - context.created
+    status = "error" if context.command_failed else "ok"
+    METRICS.observe("command_seconds", elapsed, command=name)
+    METRICS.increment("commands_total", command=name, status=status)
+    set_log_context(status=status, seconds=round(elapsed, 6))
+    logger.info("Command complete (status: %s, seconds: %.3f)", status, elapsed)
+
+
+def _topic_links(topics: T.List[T.Tuple[int, str]]) -> str:
+    """ Format forum topics from the forum index as a list of links """
+    url = get_config("forum_crawler", {}).get("url", "https://faceswap.dev/forum/").rstrip("/")
+    return "".join(f"\n\t`{title}`: {url}/viewtopic.php?t={topic_id}"
+                   for topic_id, title in topics)
+
+
+# REPLIES
+# The replies of the lookup driven commands, shared by the prefix and the slash commands
+NOBOT_MESSAGE = ("You appear to have landed up in the wrong Discord server. This is the Discord "
+                 "for https://faceswap.dev. With a bit more work you will almost definitely get "
+                 "better results with us than the Bot you were looking for. Perhaps you should "
+                 "stick around?")
+
+
+def donate_reply(responses: Responses,
+                 donatee: T.Optional[str],
+                 at_users: T.List[str]) -> Reply:
+    """ The donation message and embeds, for the given donation task or all of the devs """
+    content = responses.embeds
+    reply = Reply(responses.templates["donate"].format(at_users))
+    reply.add_embed(content["patreon"])
 
-# COMMANDS
+    if donatee != "patreon":
+        embeds = ([content[donatee]] if donatee
+                  else [val for key, val in content.items() if key != "patreon"])
+        # The devs are sent in a second message, so that they are not read as including Patreon
+        reply.new_message()
+        reply.add_text("Alternatively you can give a one off donation to any of our Devs below:")
+        for embed in embeds:
+            reply.add_embed(embed)
+    return reply
 
-@FS_BOT.command(name="dfl", pass_context=True, **get_def("dfl"))
-@has_any_role(*get_roles())
-async def dfl(context: Context) -> None:
-    """ Output that we don't support DFL """
-    lookup, at_users, _ = await init_command(context)
-    msg = format_message(lookup["msg"], at_users)
-    await context.send(msg)
 
+def faqs_reply(lookup: T.Dict[str, T.Any], task: T.Optional[str], at_users: T.List[str]) -> str:
+    """ Link to the given section of the FAQ page, or to the FAQ page if no section is given """
+    url = lookup["url"] if task is None else lookup["url"] + faq_cache.contents[task]
+    section = "on" if task is None else f"in the {task.title()} section of"
+    msg = f"Your question is answered {section} our FAQ page at: {url}"
+    return format_message(msg, at_users)
 
-@FS_BOT.command(name="donate", pass_context=True, **get_def("donate"))
-@has_any_role(*get_roles())
-async def donate(context: Context) -> None:
-    """ Display donation messages """
-    lookup, at_users, message = await init_command(context)
-
-    content = {}
-    for key, val in lookup["tasks"].items():
-        kwargs = {"embed": {"title": val["title"], "type": "rich"},
-                  "author": {"name": val["name"], "icon_url": val["icon"]}}
-        if "url" in val:
-            kwargs["embed"]["url"] = val["url"]
-            kwargs["author"]["url"] = val["url"]
-        embed = Embed(**kwargs["embed"])
-        embed.set_thumbnail(url=val["thumbnail"])
-        embed.set_author(**kwargs["author"])
-
-        if val.get("fields", None) is not None:
-            for field in val["fields"]:
-                embed.add_field(inline=False, **field)
-        content[key] = embed
-    logger.info("donator content: %s", content)
-
-    donatee, _ = get_task(message, list(content.keys()))
-
-    msg = format_message(lookup["msg"], at_users)
-    await context.send(msg)
-    await context.send(embed=content.pop("patreon"))
 
-    if donatee != "patreon":
-        embeds = [content[donatee]] if donatee else [content[key] for key in list(content.keys())]
-        msg = "Alternatively you can give a one off donation to any of our Devs below:"
-        await context.send(msg)
-        for embed in embeds:
-            await context.send(embed=embed)
+def faqs_search_reply(lookup: T.Dict[str, T.Any],
+                      results: T.Dict[str, str],
+                      search_term: str,
+                      at_users: T.List[str]) -> str:
+    """ Link to the FAQs that were found for a search term """
+    urls = "\n\t".join([f"`{val}`: {lookup['url'] + key}" for key, val in results.items()])
+    msg = ("Your question is answered on our FAQ page. Try one of these answers related to "
+           f"the term `{search_term}`: \n\t{urls}")
+    return format_message(msg, at_users)
 
 
-@FS_BOT.command(name="faqs", pass_context=True, **get_def("faqs"))
-@has_any_role(*get_roles())
-async def faqs(context: Context) -> None:
-    """ Link to FAQs """
-    lookup, at_users, message = await init_command(context)
+def search_reply(lookup: T.Dict[str, T.Any], words: T.List[str], at_users: T.List[str]) -> str:
+    """ The best matching forum threads for the search words, with a link to the forum's search
+    page """
+    terms = None
+    url = lookup["url"]
+    if words:
+        terms = "+".join(words)
+        set_log_context(search_term=" ".join(words))
+        url += f"?keywords={terms}"
+        topics = FORUM_INDEX.search(" ".join(words), limit=lookup.get("results", 5))
+        logger.debug("topics: %s", topics)
+        if topics:
+            msg = (f"These threads at our forum may help with `{' '.join(words)}`: "
+                   f"{_topic_links(topics)}\nFor more results try the Search page: {url}")
+            return format_message(msg, at_users)
 
-    is_task = True
-    tasks = faq_cache.contents
-    if "search" in message:
-        is_task = False
-        search_term = " ".join(message[message.index("search") + 1:])
-        logger.info("search_term: %s", search_term)
-        if not search_term:
-            is_task = True
-            task = None
-        else:
-            task = faq_cache.search(search_term)
-            logger.info("results: %s", task)
-            if len(task) > lookup["results"]:
-                logger.info("Too many results. Limiting: %s / %s",
-                            lookup["results"], len(task))
-                task = None
-            if not task:
-                is_task = True
-                task = None
-    else:
-        task, _ = get_task(message, list(tasks.keys()))
-    logger.info("final task: %s", task)
-    if is_task:
-        url = lookup["url"] if task is None else lookup["url"] + tasks[task]
-        section = "on" if task is None else f"in the {task.title()} section of"
-        msg = f"Your question is answered {section} our FAQ page at: {url}"
-        msg = format_message(msg, at_users)
+    if terms is None:
+        results = ""
     else:
-        assert task is not None
-        urls = "\n\t".join([f"`{val}`: {lookup['url'] + key}"
-                            for key, val in task.items()])
-        msg = ("Your question is answered on our FAQ page. Try one of these answers related to "
-               f"the term `{search_term}`: \n\t{urls}")
-        msg = format_message(msg, at_users)
-    await context.send(msg)
+        results = f". Here are the results for `{' '.join(terms.split('+'))}`"
+    msg = f"You should try the Search page at our forum{results}: {url}"
+    return format_message(msg, at_users)
 
 
-@FS_BOT.command(name="forums", pass_context=True, **get_def("forums"))
-@has_any_role(*get_roles())
-async def forums(context: Context) -> None:
-    """ Link to the forums """
-    lookup, at_users, message = await init_command(context)
-    task, _ = get_task(message, lookup["tasks"])
-    ext = "index.php" if task is None else f"viewforum.php?f={lookup['tasks'][task]}"
-    section = "" if task is None else f"the {task.title()} section of "
-    msg = f"You should check out {section}our Forum at: {lookup['url'] + ext}"
-    msg = format_message(msg, at_users)
-    await context.send(msg)
+def tag_reply(lookup: T.Dict[str, T.Any], m_tag: str, at_users: T.List[str]) -> str:
+    """ The most recent forum threads with the given tag, with a link to all tagged threads """
+    url = lookup["url"] + m_tag
+    topics = FORUM_INDEX.tagged(m_tag, limit=lookup.get("results", 5))
+    logger.debug("topics: %s", topics)
+    if topics:
+        msg = (f"You should try these posts tagged `{m_tag}` at our forum: "
+               f"{_topic_links(topics)}\nAll tagged posts: {url}")
+    else:
+        msg = f"You should try these posts tagged `{m_tag}` at our forum: {url}"
+    return format_message(msg, at_users)
+
 
+# COMMANDS
 
-@FS_BOT.command(name="guide", pass_context=True, **get_def("guide"))
-@has_any_role(*get_roles())
-async def guide(context: Context) -> None:
-    """ Link to guide on the forum """
-    lookup, at_users, message = await init_command(context)
-    task, _ = get_task(message, list(lookup["tasks"].keys()))
-    if not task:
+async def donate(context: BotContext) -> None:
+    """ Display donation messages """
+    responses = get_responses(getattr(context.guild, "id", None))
+    _, args = await init_command(context, responses.matchers.get("donate"))
+    if not THROTTLE.allow(context, args.task, args.at_users):
         return
-    msg = f"There's a guide for {task.title()} here: {lookup['url'] + lookup['tasks'][task]}"
-    msg = format_message(msg, at_users)
-    await context.send(msg)
+    await context.send_reply(donate_reply(responses, args.task, args.at_users))
 
 
-@FS_BOT.command(name="log", pass_context=True, **get_def("log"))
-@has_any_role(*get_roles())
-async def log(context: Context) -> None:
-    """ Request a crash report """
-    lookup, at_users, _ = await init_command(context)
-    msg = format_message(lookup["msg"], at_users)
-    await context.send(msg)
+async def faqs(context: Context) -> None:
+    """ Link to FAQs """
+    guild_id = getattr(context.guild, "id", None)
+    timeout = get_lookups(guild_id)[1]["faqs"].get("ready_timeout", 10)
+    if not await faq_cache.wait_loaded(timeout=timeout):
+        log_command(context)
+        DELETIONS.delete(context.message)
+        await context.send("The FAQs are still loading. Please try again in a moment")
+        return
+    responses = get_responses(guild_id)
+    lookup, args = await init_command(context, responses.faq_matcher(faq_cache.contents))
+    at_users, message = args.at_users, args.words
+
+    results = None
+    if "search" in message:
+        search_term = " ".join(message[message.index("search") + 1:])
+        set_log_context(search_term=search_term)
+        logger.info("search_term: %s", search_term)
+        if search_term:
+            with METRICS.timer("phase_seconds", phase="faq_search"):
+                results = faq_cache.search(search_term, limit=lookup["results"])
+            logger.debug("results: %s", results)
+        task = None
+    else:
+        task = args.task
+    logger.debug("final task: %s", results or task)
+    if not THROTTLE.allow(context, ("search", search_term) if results else task, at_users):
+        return
+    if results:
+        await context.send(faqs_search_reply(lookup, results, search_term, at_users))
+    else:
+        await context.send(faqs_reply(lookup, task, at_users))
 
 
-@FS_BOT.command(name="refresh", pass_context=True, **get_def("refresh"))
-@has_any_role(*get_roles())
 async def refresh(context: Context) -> None:
     """ Refresh the FAQ and lookup caches """
-    logger.info("command: refresh, call: %s", context.message)
-    await context.message.delete()
-    faq_cache.refresh_cache()
-    load_lookups()
-    msg = "FAQs and Lookups cache has been refreshed"
+    log_command(context)
+    DELETIONS.delete(context.message)
+    bot = T.cast(FSBot, context.bot)
+    try:
+        await bot.registry.reload()
+    except ValueError:
+        logger.exception("Invalid lookups")
+        await context.send("Lookups are invalid and have not been refreshed. See the log")
+        return
+    try:
+        await faq_cache.reload()
+    except Exception:  # pylint: disable=broad-except
+        msg = "Lookups cache has been refreshed. FAQs refresh failed, serving the previous FAQs"
+    else:
+        msg = "FAQs and Lookups cache has been refreshed"
     logger.info(msg)
     await context.send(msg)
 
 
-@FS_BOT.command(name="search", pass_context=True, **get_def("search"))
-@has_any_role(*get_roles())
 async def search(context: Context) -> None:
     """ Search the forum command """
-    lookup, at_users, message = await init_command(context)
-    terms = None
-    url = lookup["url"]
-    if len(message) > 1:
-        terms = "+".join(message[1:])
-        url += f"?keywords={terms}"
-
-    if terms is None:
-        results = ""
-    else:
-        results = f". Here are the results for `{' '.join(terms.split('+'))}`"
-    msg = f"You should try the Search page at our forum{results}: {url}"
-    msg = format_message(msg, at_users)
-    await context.send(msg)
-
-
-@FS_BOT.command(name="support", pass_context=True, **get_def("support"))
-@has_any_role(*get_roles())
-async def support(context: Context) -> None:
-    """ Support section of forum command """
-    lookup, at_users, message = await init_command(context)
-    task, _ = get_task(message, list(lookup["tasks"].keys()))
-    url = f"{lookup['url']}{'3' if task is None else lookup['tasks'][task]}"
-    section = "in" if task is None else f"in the {task.title()} section of"
-    msg = format_message(f"This question has been asked and answered {section} our Support Forum "
-                         f"at: {url}", at_users)
-    await context.send(msg)
-
-
-@FS_BOT.command(name="sysinfo", pass_context=True, **get_def("sysinfo"))
-@has_any_role(*get_roles())
-async def sysinfo(context: Context) -> None:
-    """ Output System Information """
-    lookup, at_users, _ = await init_command(context)
-    msg = format_message(lookup["msg"], at_users)
-    await context.send(msg)
+    lookup, args = await init_command(context)
+    if not THROTTLE.allow(context, " ".join(args.words[1:]).lower(), args.at_users):
+        return
+    await context.send(search_reply(lookup, args.words[1:], args.at_users))
 
 
-@FS_BOT.command(name="tag", pass_context=True, **get_def("tag"))
-@has_any_role(*get_roles())
 async def tag(context: Context) -> None:
     """ Tag search  command """
-    lookup, at_users, message = await init_command(context)
-    url = lookup["url"]
+    lookup, args = await init_command(context)
+    message = args.words
 
     if len(message) != 2:
         logger.debug("No or multiple tags provided")
         return
 
     m_tag = message[1]
-    url += m_tag
-
-    msg = f"You should try these posts tagged `{m_tag}` at our forum: {url}"
-    msg = format_message(msg, at_users)
-    await context.send(msg)
+    set_log_context(task=m_tag.lower())
+    if not THROTTLE.allow(context, m_tag.lower(), args.at_users):
+        return
+    await context.send(tag_reply(lookup, m_tag, args.at_users))
 
 
 #@FS_BOT.command(name="insightface", pass_context=True, **get_def("insightface"))
@@ -243,69 +344,98 @@ async def tag(context: Context) -> None:
 #    await sent.delete()
 
 
-@FS_BOT.command(name="nobot", pass_context=True, **get_def("nobot"))
-@has_any_role(*get_roles())
 async def nobot(context: Context) -> None:
     """ Delete the replied to user's message and notify we are not a bot """
-    command = sys._getframe(1).f_code.co_name  # pylint: disable=protected-access
-    await context.message.delete()
-    logger.info("command: %s, call: %s", command, context.message)
+    log_command(context)
+    DELETIONS.delete(context.message)
 
-    if context.message.reference is None or context.message.reference.message_id is None:
+    reference = context.message.reference
+    if reference is None or reference.message_id is None:
         logger.warning("No message replied to. Doing nothing")
         return
 
-    channel = context.channel
-    original_msg = await channel.fetch_message(context.message.reference.message_id)
-    logger.info("Original Message: %s", original_msg)
-    await original_msg.delete()
-
-    msg = ("You appear to have landed up in the wrong Discord server. This is the Discord for "
-           "https://faceswap.dev. With a bit more work you will almost definitely get better "
-           "results with us than the Bot you were looking for. Perhaps you should stick around?")
+    original_msg = reference.resolved
+    if not isinstance(original_msg, discord.Message):
+        with METRICS.timer("phase_seconds", phase="fetch_message"):
+            original_msg = await context.channel.fetch_message(reference.message_id)
+    logger.info("Original Message: %s", original_msg.id)
+    DELETIONS.delete(original_msg)
 
     user = [f"<@{original_msg.author.id}>"]
-    msg = format_message(msg, user)
+    msg = format_message(NOBOT_MESSAGE, user)
     sent = await context.send(msg)
-    await asyncio.sleep(300)
-    await sent.delete()
+    DELETIONS.delete(sent, delay=300)
 
 
-@FS_BOT.command(name="iwillnotusebots", pass_context=True, **get_def("iwillnotusebots"))
 async def iwillnotusebots(context: Context) -> None:
     """ Give user full server access back """
-    command = sys._getframe(1).f_code.co_name  # pylint: disable=protected-access
-    await context.message.delete()
-    logger.info("command: %s, call: %s", command, context.message)
-    if context.channel.name != "bot-jail":
+    log_command(context)
+    DELETIONS.delete(context.message)
+    config = get_automod_config(getattr(context.guild, "id", None))
+    if context.guild is None or context.channel.name != config["jail_channel"]:
+        return
+
+    role = GUILD_CACHE.get_role(context.guild, config["jail_role"])
+    if role is None:
+        logger.warning("Jail role '%s' does not exist", config["jail_role"])
         return
+    author = context.message.author
+    member = (author if isinstance(author, discord.Member)
+              else await fetch_member(context.guild, author.id))
+    if member is not None and member.get_role(role.id) is not None:
+        await member.remove_roles(role)
+    JAIL_DEBOUNCE.reset((context.guild.id, author.id))
 
-    role = discord.utils.get(context.guild.roles, name="Bot Abuser")
-    await context.message.author.remove_roles(role)
+
+@has_permissions(administrator=True)
+async def stats(context: BotContext) -> None:
+    """ Output the command metrics and the memory used by the caches """
+    log_command(context)
+    await context.send_reply(Reply(f"```\n{METRICS.summary()}\n```")
+                             .add_text(f"```\n{format_usage(cache_usage(context.bot))}\n```"))
 
 
 # EVENTS
-@FS_BOT.event
+@METRICS.instrument_event
 async def on_automod_action(execution: AutoModAction):
     """ On AutoMod capture of someone trying to invoke InsightFace, handle the user:
 
     - Change role to 'Bot Abuser'
     - Move user to bot-jail
     - Send message explaining how to get out of jail
+
+    A burst of triggers from the same user within the debounce window is handled once
     """
-    if execution.rule_id != 1171530119630831689:  # InsightFace Bot AutoMod rule
+    config = get_automod_config(execution.guild_id)
+    if execution.rule_id not in config["rule_ids"]:
         return
 
     if execution.alert_system_message_id is None:  # AutoMod ephemeral response
         return
 
-    if execution.member is None:
+    if execution.guild is None:
         return
 
-    role = discord.utils.get(execution.guild.roles, name="Bot Abuser")
-    channel = discord.utils.get(execution.guild.channels, name="bot-jail")
+    JAIL_DEBOUNCE.window = config["debounce"]
+    if not JAIL_DEBOUNCE.first((execution.guild_id, execution.user_id)):
+        logger.debug("Suppressing repeat AutoMod action for user %s", execution.user_id)
+        METRICS.increment("automod_suppressed_total")
+        return
+
+    role = GUILD_CACHE.get_role(execution.guild, config["jail_role"])
+    channel = GUILD_CACHE.get_channel(execution.guild, config["jail_channel"])
+    if role is None or channel is None:
+        logger.warning("Jail role '%s' or channel '%s' does not exist",
+                       config["jail_role"], config["jail_channel"])
+        return
 
-    await execution.member.add_roles(role)
+    # Members are only cached if the cache settings say so, so fetch the member if needed
+    member = execution.member or await fetch_member(execution.guild, execution.user_id)
+    if member is None:
+        logger.debug("AutoMod action for user %s who is not a member", execution.user_id)
+        return
+    if member.get_role(role.id) is None:
+        await member.add_roles(role)
 
     msg = ("You appear to have landed up in the wrong Discord server. This is the Discord for "
            "https://faceswap.dev. With a bit more work you will almost definitely get better "
@@ -317,4 +447,37 @@ async def on_automod_action(execution: AutoModAction):
 
     user = [f"<@{execution.user_id}>"]
     msg = format_message(msg, user)
-    await channel.send(msg)
+    await OUTBOX.submit(channel.id, lambda: channel.send(msg))
+
+
+def create_bot() -> Bot:
+    """ Create the bot from the loaded lookups, with the commands, the commands generated from
+    the lookups and the event handlers added, ready to be started """
+    cache = get_cache_config()
+    members = cache["members"]
+    options = {"intents": INTENTS,
+               "command_prefix": ("?", "!", "/"),
+               "member_cache_flags": (MemberCacheFlags(**members) if isinstance(members, dict)
+                                      else getattr(MemberCacheFlags, members)()),
+               "chunk_guilds_at_startup": cache["chunk_guilds_at_startup"],
+               "max_messages": cache["max_messages"]}
+    shards = get_shard_config()
+    bot: FSBot = (FSBot(**options) if shards is None else ShardedFSBot(**options, **shards))
+    roles = get_roles()
+    for callback in (donate, faqs, refresh, search, tag, nobot):
+        bot.add_command(has_any_role(*roles)(Command(callback,
+                                                     name=callback.__name__,
+                                                     **get_def(callback.__name__))))
+    bot.add_command(Command(iwillnotusebots, name="iwillnotusebots", **get_def("iwillnotusebots")))
+    bot.add_command(Command(stats,
+                            name="stats",
+                            help="Show command latency, error statistics and cache memory use"))
+    bot.after_invoke(record_command)
+    bot.add_listener(on_automod_action)
+    GUILD_CACHE.register(bot)
+
+    # Template driven commands (dfl, forums, guide, log, support, sysinfo and any lookup entry with
+    # a "kind") are generated from the lookups by the command registry
+    bot.registry = CommandRegistry(bot)
+    bot.registry.sync()
+    return bot
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+""" Scheduled message deletion for faceswap Discord bot
+
+All message deletions go through a single scheduler task. Deletions run concurrently with the
+command's reply. Deletions that fall due, or are requested while a previous batch is in flight,
+in the same channel are bulk deleted. Delayed deletions are held in a timer heap which is saved
+to disk so that they resume after a restart.
+"""
+from __future__ import annotations
+import asyncio
+import heapq
+import json
+import logging
+import os
+import typing as T
+
+from datetime import timedelta
+from time import time
+
+import discord
+
+from instance import get_data_path
+from metrics import METRICS
+
+if T.TYPE_CHECKING:
+    from discord import Message
+    from discord.ext.commands import Bot
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+_BULK_MAX = 100
+_BULK_MAX_AGE = timedelta(days=13, hours=23)
+
+
+class DeletionScheduler():
+    """ Deletes messages immediately or after a delay, from a single background task. Pending
+    deletions are saved to path, by default `pending_deletions.json` next to the lookups with the
+    instance id as a suffix """
+    def __init__(self, path: T.Optional[str] = None) -> None:
+        self._path = path
+        self._heap: T.List[T.Tuple[float, int, int, bool]] = []
+        self._wake: T.Optional[asyncio.Event] = None
+        self._task: T.Optional[asyncio.Task] = None
+        self._bot: T.Optional[Bot] = None
+        self._dirty = False
+
+    def start(self, bot: Bot) -> None:
+        """ Load any saved pending deletions and start the scheduler task with the logged in bot,
+        if not already running """
+        if self._task is not None and not self._task.done():
+            return
+        if self._path is None:
+            # Resolved on start, once the instance id is set
+            self._path = get_data_path("pending_deletions.json", per_instance=True)
+        self._bot = bot
+        self._wake = asyncio.Event()
+        self._load()
+        self._task = asyncio.create_task(self._run(), name="deletion_scheduler")
+
+    def delete(self, message: Message, delay: float = 0.) -> None:
+        """ Delete a message after delay seconds without waiting for the deletion to complete """
+        self.schedule(message.channel.id, message.id, delay)
+
+    def schedule(self, channel_id: int, message_id: int, delay: float = 0.) -> None:
+        """ Schedule a message for deletion by id after delay seconds. Delayed deletions are saved
+        to disk """
+        if self._wake is None:
+            raise RuntimeError("The deletion scheduler has not been started")
+        heapq.heappush(self._heap, (time() + delay, channel_id, message_id, delay > 0))
+        self._dirty = self._dirty or delay > 0
+        self._wake.set()
+
+    def _load(self) -> None:
+        """ Load the saved pending deletions """
+        try:
+            with open(self._path, "r", encoding="utf-8") as pending:
+                entries = [(float(due), int(channel), int(message), True)
+                           for due, channel, message in json.load(pending)]
+        except FileNotFoundError:
+            return
+        except (OSError, TypeError, ValueError):
+            logger.warning("Ignoring unreadable pending deletions: %s", self._path, exc_info=True)
+            return
+        self._heap.extend(entries)
+        heapq.heapify(self._heap)
+        logger.info("Loaded %s pending deletions", len(entries))
+
+    def _save(self, entries: T.List[T.Tuple[float, int, int]]) -> None:
+        """ Atomically save the pending deletions """
+        temp_path = f"{self._path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as pending:
+            json.dump(entries, pending)
+        os.replace(temp_path, self._path)
+
+    async def _run(self) -> None:
+        """ Delete messages as they become due """
+        assert self._wake is not None
+        while True:
+            if self._dirty:
+                await self._persist()
+            timeout = self._heap[0][0] - time() if self._heap else None
+            if timeout is None or timeout > 0:
+                self._wake.clear()
+                timer = (None if timeout is None
+                         else asyncio.get_running_loop().call_later(timeout, self._wake.set))
+                try:
+                    await self._wake.wait()
+                finally:
+                    if timer is not None:
+                        timer.cancel()
+                continue
+
+            now = time()
+            due: T.Dict[int, T.List[int]] = {}
+            while self._heap and self._heap[0][0] <= now:
+                _, channel_id, message_id, persisted = heapq.heappop(self._heap)
+                due.setdefault(channel_id, []).append(message_id)
+                self._dirty = self._dirty or persisted
+            await asyncio.gather(*(self._delete(channel_id, message_ids)
+                                   for channel_id, message_ids in due.items()))
+
+    async def _persist(self) -> None:
+        """ Save the delayed deletions off the event loop """
+        self._dirty = False
+        entries = [entry[:3] for entry in self._heap if entry[3]]
+        try:
+            await asyncio.to_thread(self._save, entries)
+        except OSError:
+            logger.warning("Unable to save pending deletions: %s", self._path, exc_info=True)
+
+    async def _delete(self, channel_id: int, message_ids: T.List[int]) -> None:
+        """ Delete the given messages from a channel, in bulk where possible """
+        assert self._bot is not None
+        cutoff = discord.utils.utcnow() - _BULK_MAX_AGE
+        recent = [idx for idx in message_ids if discord.utils.snowflake_time(idx) > cutoff]
+        batches = [recent[idx:idx + _BULK_MAX] for idx in range(0, len(recent), _BULK_MAX)]
+        batches.extend([idx] for idx in message_ids if idx not in recent)
+
+        jobs = [self._bot.http.delete_messages(channel_id, batch) if len(batch) > 1
+                else self._bot.http.delete_message(channel_id, batch[0])
+                for batch in batches]
+        with METRICS.timer("phase_seconds", phase="delete"):
+            results = await asyncio.gather(*jobs, return_exceptions=True)
+        for result in results:
+            if isinstance(result, discord.NotFound):
+                logger.debug("Message already deleted (channel: %s)", channel_id)
+            elif isinstance(result, Exception):
+                logger.warning("Failed to delete messages (channel: %s, messages: %s): %r",
+                               channel_id, message_ids, result)
+        logger.debug("Deleted messages (channel: %s, messages: %s)", channel_id, message_ids)
+
+
+DELETIONS = DeletionScheduler()
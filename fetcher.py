@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+""" HTTP fetching with timeouts, retries and conditional requests for faceswap Discord bot """
+from __future__ import annotations
+import asyncio
+import hashlib
+import logging
+import random
+import typing as T
+
+import aiohttp
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+_SinkT = T.TypeVar("_SinkT")
+
+_RETRY_STATUS = (429, 500, 502, 503, 504)
+_CHUNK_SIZE = 65536
+
+
+class FetchError(Exception):
+    """ Raised when a URL could not be fetched after all retries """
+
+
+class _Body():
+    """ Collects a response body in memory """
+    def __init__(self) -> None:
+        self._chunks: T.List[bytes] = []
+
+    def feed(self, data: bytes) -> None:
+        """ Add a chunk of the body """
+        self._chunks.append(data)
+
+    @property
+    def data(self) -> bytes:
+        """ bytes: The full body """
+        return b"".join(self._chunks)
+
+
+class Fetcher():
+    """ Fetches web pages with connect and read timeouts, retrying transient failures with
+    exponential backoff and full jitter.
+
+    The ETag, Last-Modified header and a hash of the content are stored for each URL so that repeat
+    requests are made conditionally. Pages that the server reports as not modified, or whose
+    content is identical to the last fetch, are not returned. """
+    def __init__(self,
+                 connect_timeout: float = 10.,
+                 read_timeout: float = 30.,
+                 retries: int = 4,
+                 backoff: float = 1.,
+                 max_backoff: float = 60.) -> None:
+        self._timeout = aiohttp.ClientTimeout(total=None,
+                                              connect=connect_timeout,
+                                              sock_read=read_timeout)
+        self._retries = retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._validators: T.Dict[str, T.Dict[str, str]] = {}
+
+    @property
+    def validators(self) -> T.Dict[str, T.Dict[str, str]]:
+        """ dict: The cache validators (etag, last_modified, digest) for each fetched URL """
+        return self._validators
+
+    @validators.setter
+    def validators(self, value: T.Dict[str, T.Dict[str, str]]) -> None:
+        """ Set the cache validators, for example from a previously saved state """
+        self._validators = value
+
+    def session(self) -> aiohttp.ClientSession:
+        """ Obtain a new client session with this fetcher's timeouts, to be used as an async
+        context manager """
+        return aiohttp.ClientSession(timeout=self._timeout, raise_for_status=False)
+
+    def _delay(self, attempt: int, retry_after: T.Optional[str] = None) -> float:
+        """ The number of seconds to wait before the given retry attempt """
+        delay = random.uniform(0, min(self._max_backoff, self._backoff * 2 ** attempt))
+        if retry_after is not None and retry_after.isdigit():
+            delay = max(delay, min(self._max_backoff, float(retry_after)))
+        return delay
+
+    def _headers(self, url: str) -> T.Dict[str, str]:
+        """ The conditional request headers for the given url """
+        validators = self._validators.get(url, {})
+        headers = {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+        return headers
+
+    async def _request(self,
+                       session: aiohttp.ClientSession,
+                       url: str,
+                       conditional: bool,
+                       sink: T.Callable[[], _SinkT]
+                       ) -> T.Tuple[int, T.Optional[_SinkT], T.Dict[str, str]]:
+        """ Perform a single request, feeding the body to a new sink as it is read. Returns
+        status, sink and validators, including the digest of the body """
+        headers = self._headers(url) if conditional else {}
+        async with session.get(url, headers=headers) as rsp:
+            if rsp.status == 304:
+                return rsp.status, None, {}
+            if rsp.status in _RETRY_STATUS:
+                raise _RetryableStatus(rsp.status, rsp.headers.get("Retry-After"))
+            if rsp.status >= 400:
+                raise FetchError(f"{url} returned HTTP {rsp.status}")
+            consumer = sink()
+            digest = hashlib.sha256()
+            size = 0
+            async for chunk in rsp.content.iter_chunked(_CHUNK_SIZE):
+                digest.update(chunk)
+                size += len(chunk)
+                consumer.feed(chunk)
+            validators = {"etag": rsp.headers.get("ETag", ""),
+                          "last_modified": rsp.headers.get("Last-Modified", ""),
+                          "digest": digest.hexdigest(),
+                          "size": str(size)}
+            return rsp.status, consumer, validators
+
+    async def fetch(self,
+                    url: str,
+                    session: T.Optional[aiohttp.ClientSession] = None,
+                    conditional: bool = True) -> T.Optional[bytes]:
+        """ Fetch the given URL, with a new session if one is not given. Returns ``None`` if
+        the content has not changed since the last conditional fetch. Unconditional fetches
+        always return the content and store no validators. Raises :class:`FetchError` if all
+        retries fail """
+        body = await self.stream(url, _Body, session=session, conditional=conditional)
+        return None if body is None else body.data
+
+    async def stream(self,
+                     url: str,
+                     sink: T.Callable[[], _SinkT],
+                     session: T.Optional[aiohttp.ClientSession] = None,
+                     conditional: bool = True) -> T.Optional[_SinkT]:
+        """ As :func:`fetch`, but the content is fed in chunks to a consumer as it is read rather
+        than held in memory. sink returns a new consumer with a ``feed(data: bytes)`` method for
+        each attempt, and the consumer that was fed the content is returned """
+        if session is None:
+            async with self.session() as new_session:
+                return await self.stream(url, sink, session=new_session, conditional=conditional)
+
+        for attempt in range(self._retries + 1):
+            retry_after = None
+            try:
+                status, consumer, validators = await self._request(session, url, conditional,
+                                                                   sink)
+                break
+            except _RetryableStatus as err:
+                retry_after = err.retry_after
+                reason = f"HTTP {err.status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                reason = repr(err)
+            if attempt == self._retries:
+                raise FetchError(f"Failed to fetch {url} after {attempt + 1} attempts: {reason}")
+            delay = self._delay(attempt, retry_after)
+            logger.warning("Fetch of %s failed (%s). Retrying in %.1fs", url, reason, delay)
+            await asyncio.sleep(delay)
+
+        if consumer is None:
+            logger.info("Not modified (status: %s, url: %s)", status, url)
+            return None
+
+        size = validators.pop("size")
+        unchanged = False
+        if conditional:
+            # Validators are only kept for the URLs that are fetched conditionally
+            unchanged = self._validators.get(url, {}).get("digest") == validators["digest"]
+            self._validators[url] = validators
+        if unchanged:
+            logger.info("Content unchanged (url: %s)", url)
+            return None
+        logger.info("Fetched %s bytes (status: %s, url: %s)", size, status, url)
+        return consumer
+
+
+class _RetryableStatus(Exception):
+    """ Internal exception for HTTP status codes that should be retried """
+    def __init__(self, status: int, retry_after: T.Optional[str]) -> None:
+        super().__init__(status)
+        self.status = status
+        self.retry_after = retry_after
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+""" Local full text index of the forum for faceswap Discord bot
+
+A crawler thread walks the phpBB forum listings and stores each topic's title, first page of
+posts and tags in a SQLite FTS5 index, so that the ``search`` and ``tag`` commands can reply
+with the best matching threads directly.
+
+Crawls are incremental. Topic listings are ordered by latest post, so each forum's listing is
+only read until a page contains no new or updated topics, and only those topics are fetched.
+Topics that are due to be fetched are written to a pending table before any are fetched, and
+each topic is removed from it in the same transaction that indexes it, so an interrupted crawl
+resumes where it left off. The forum url is configurable so that the crawler can be pointed at a
+local stand-in server. When several bot processes share the index, only the process holding the
+index's lock file crawls.
+"""
+from __future__ import annotations
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import typing as T
+import urllib.parse
+
+from threading import Event, Thread, local
+from time import time
+
+import lxml.html as LH
+
+from fetcher import Fetcher, FetchError
+from instance import get_data_path
+from metrics import METRICS
+from utils import try_lock_file
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS topics (topic_id INTEGER PRIMARY KEY,
+                                   forum_id INTEGER NOT NULL,
+                                   title TEXT NOT NULL,
+                                   marker TEXT NOT NULL,
+                                   crawled REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS tags (tag TEXT NOT NULL,
+                                 topic_id INTEGER NOT NULL,
+                                 PRIMARY KEY (tag, topic_id)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tags_topic ON tags (topic_id);
+CREATE TABLE IF NOT EXISTS pending (topic_id INTEGER PRIMARY KEY,
+                                    forum_id INTEGER NOT NULL,
+                                    marker TEXT NOT NULL);
+CREATE VIRTUAL TABLE IF NOT EXISTS topic_text USING fts5(title, body,
+                                                         tokenize='porter unicode61');
+"""
+_TITLE_WEIGHT = 5.
+_FORUM_ID = re.compile(r"[?&;]f=(\d+)")
+_TOPIC_ID = re.compile(r"[?&;]t=(\d+)")
+_WORDS = re.compile(r"\w+")
+
+
+class ForumIndex():
+    """ The SQLite full text index of the forum's topics, by default at `forum_index.sqlite` next
+    to the lookups """
+    def __init__(self, path: T.Optional[str] = None) -> None:
+        self.path = get_data_path("forum_index.sqlite") if path is None else path
+        self._readers = local()
+
+    def connect(self) -> sqlite3.Connection:
+        """ Open a new connection to the index for use from the calling thread only, creating the
+        index if it does not exist """
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def _reader(self) -> T.Optional[sqlite3.Connection]:
+        """ The calling thread's read only connection for queries, or ``None`` if the crawler
+        has not created the index. Read only connections never write the schema, so opening one
+        does not wait on the crawler """
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            if not os.path.isfile(self.path):
+                return None
+            uri = f"file:{urllib.parse.quote(os.path.abspath(self.path))}?mode=ro"
+            conn = self._readers.conn = sqlite3.connect(uri, uri=True)
+        return conn
+
+    def _query(self, sql: str, params: T.Tuple[T.Any, ...]) -> T.List[T.Tuple[int, str]]:
+        """ Run a query on the calling thread's reader. No results if the index has not been
+        created yet """
+        conn = self._reader()
+        if conn is None:
+            return []
+        try:
+            return conn.execute(sql, params).fetchall()
+        except sqlite3.OperationalError as err:
+            logger.debug("Forum index is not ready: %s", err)
+            return []
+
+    def search(self, query: str, limit: int = 5) -> T.List[T.Tuple[int, str]]:
+        """ Return the id and title of at most limit topics containing all of the words in the
+        query, best match first, falling back to any of the words if no topic contains them all """
+        words = [f'"{word}"' for word in _WORDS.findall(query.lower())]
+        if not words:
+            return []
+        sql = ("SELECT rowid, title FROM topic_text WHERE topic_text MATCH ? "
+               f"ORDER BY bm25(topic_text, {_TITLE_WEIGHT}, 1.0) LIMIT ?")
+        with METRICS.timer("phase_seconds", phase="forum_search"):
+            results = self._query(sql, (" ".join(words), limit))
+            if not results and len(words) > 1:
+                results = self._query(sql, (" OR ".join(words), limit))
+        return results
+
+    def tagged(self, tag: str, limit: int = 5) -> T.List[T.Tuple[int, str]]:
+        """ Return the id and title of the most recent limit topics with the given tag """
+        with METRICS.timer("phase_seconds", phase="forum_tag"):
+            return self._query(
+                "SELECT topics.topic_id, topics.title FROM tags JOIN topics USING (topic_id) "
+                "WHERE tags.tag = ? ORDER BY topics.topic_id DESC LIMIT ?",
+                (tag.lower(), limit))
+
+
+class ForumCrawler():
+    """ Incrementally crawls the forum at url into a :class:`ForumIndex` in a background thread,
+    every interval minutes with at most concurrency requests at a time """
+    def __init__(self,
+                 index: ForumIndex,
+                 url: str = "https://faceswap.dev/forum/",
+                 interval: float = 30.,
+                 concurrency: int = 4) -> None:
+        self.index = index
+        self.url = url if url.endswith("/") else f"{url}/"
+        self.interval = interval * 60
+        self.concurrency = concurrency
+        self.fetcher = Fetcher()
+        self.stop = Event()
+        self._thread: T.Optional[Thread] = None
+
+    def start(self) -> None:
+        """ Start crawling in a background thread, if not already running """
+        if self._thread is not None:
+            return
+        self._thread = Thread(target=self._run, daemon=True, name="forum_crawler")
+        self._thread.start()
+
+    def _run(self) -> None:
+        """ Crawl the forum every interval until stopped, whenever this process holds the
+        index's lock """
+        lock = None
+        while not self.stop.is_set():
+            lock = lock or try_lock_file(f"{self.index.path}.lock")
+            if lock is None:
+                logger.debug("Another process is crawling the forum")
+                self.stop.wait(self.interval)
+                continue
+            try:
+                with METRICS.timer("scraper_seconds", stage="forum_crawl"):
+                    asyncio.run(self.crawl())
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Forum crawl failed")
+            self.stop.wait(self.interval)
+
+    async def crawl(self) -> int:
+        """ Index any topics that are new or have been updated since the last crawl and return the
+        number indexed """
+        conn = self.index.connect()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        try:
+            async with self.fetcher.session() as session:
+                async def get(url: str) -> T.Optional[LH.HtmlElement]:
+                    async with semaphore:
+                        try:
+                            page = await self.fetcher.fetch(url, session=session,
+                                                            conditional=False)
+                        except FetchError as err:
+                            logger.warning("Skipping forum page: %s", err)
+                            return None
+                    return None if page is None else LH.fromstring(page)
+
+                forums = await self._forums(get)
+                await asyncio.gather(*(self._walk_forum(conn, get, forum) for forum in forums))
+                pending = conn.execute("SELECT topic_id, marker FROM pending").fetchall()
+                logger.info("Crawling forum topics (forums: %s, topics: %s)",
+                            len(forums), len(pending))
+                results = await asyncio.gather(*(self._index_topic(conn, get, topic_id, marker)
+                                                 for topic_id, marker in pending))
+        finally:
+            conn.close()
+        indexed = sum(results)
+        logger.info("Forum crawl complete (indexed: %s, failed: %s)",
+                    indexed, len(results) - indexed)
+        return indexed
+
+    async def _forums(self, get: T.Callable[[str], T.Awaitable[T.Optional[LH.HtmlElement]]]
+                      ) -> T.List[int]:
+        """ The ids of all of the forums and sub-forums linked from the forum index """
+        doc = await get(f"{self.url}index.php")
+        if doc is None:
+            raise FetchError(f"Unable to read the forum index at {self.url}")
+        forums = []
+        for href in doc.xpath("//a[contains(@class, 'forumtitle') or "
+                              "contains(@class, 'subforum')]/@href"):
+            match = _FORUM_ID.search(href)
+            if match and int(match.group(1)) not in forums:
+                forums.append(int(match.group(1)))
+        return forums
+
+    async def _walk_forum(self,
+                          conn: sqlite3.Connection,
+                          get: T.Callable[[str], T.Awaitable[T.Optional[LH.HtmlElement]]],
+                          forum_id: int) -> None:
+        """ Read a forum's topic listing, newest first, adding new and updated topics to the
+        pending table, until a page contains no new or updated topics """
+        url: T.Optional[str] = f"{self.url}viewforum.php?f={forum_id}"
+        while url is not None:
+            doc = await get(url)
+            if doc is None:
+                return
+            changed = False
+            for row in doc.xpath("//ul[contains(@class, 'topics')]/li[contains(@class, 'row')]"):
+                hrefs = row.xpath(".//a[contains(@class, 'topictitle')]/@href")
+                match = _TOPIC_ID.search(hrefs[0]) if hrefs else None
+                if match is None:
+                    continue
+                topic_id = int(match.group(1))
+                marker = "|".join([" ".join(row.xpath("string(.//dd[@class='posts'])").split())]
+                                  + row.xpath(".//dd[contains(@class, 'lastpost')]//a/@href"))
+                known = conn.execute(
+                    "SELECT marker FROM topics WHERE topic_id = ? "
+                    "UNION ALL SELECT marker FROM pending WHERE topic_id = ?",
+                    (topic_id, topic_id)).fetchall()
+                if any(val == marker for val, in known):
+                    continue
+                with conn:
+                    conn.execute("INSERT OR REPLACE INTO pending VALUES (?, ?, ?)",
+                                 (topic_id, forum_id, marker))
+                # Stickies and announcements are listed first regardless of activity
+                classes = row.get("class", "")
+                changed = changed or not ("sticky" in classes or "announce" in classes)
+            following = doc.xpath("//li[contains(@class, 'next')]/a/@href")
+            url = LH.urljoin(url, following[0]) if changed and following else None
+
+    async def _index_topic(self,
+                           conn: sqlite3.Connection,
+                           get: T.Callable[[str], T.Awaitable[T.Optional[LH.HtmlElement]]],
+                           topic_id: int,
+                           marker: str) -> bool:
+        """ Fetch the first page of a pending topic and index its title, posts and tags """
+        doc = await get(f"{self.url}viewtopic.php?t={topic_id}")
+        if doc is None:
+            return False
+        titles = doc.xpath("//h2[contains(@class, 'topic-title')]")
+        title = " ".join(titles[0].text_content().split()) if titles else f"Topic {topic_id}"
+        body = "\n".join(" ".join(post.text_content().split())
+                         for post in doc.xpath("//div[contains(@class, 'postbody')]"
+                                               "//div[@class='content']"))
+        tags = {text.strip().lower()
+                for text in doc.xpath("//a[contains(@href, 'app.php/tag/')]/text()")
+                if text.strip()}
+        forum = conn.execute("SELECT forum_id FROM pending WHERE topic_id = ?",
+                             (topic_id, )).fetchone()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO topics VALUES (?, ?, ?, ?, ?)",
+                         (topic_id, forum[0] if forum else 0, title, marker, time()))
+            conn.execute("DELETE FROM topic_text WHERE rowid = ?", (topic_id, ))
+            conn.execute("INSERT INTO topic_text (rowid, title, body) VALUES (?, ?, ?)",
+                         (topic_id, title, body))
+            conn.execute("DELETE FROM tags WHERE topic_id = ?", (topic_id, ))
+            conn.executemany("INSERT INTO tags VALUES (?, ?)",
+                             [(tag, topic_id) for tag in tags])
+            conn.execute("DELETE FROM pending WHERE topic_id = ? AND marker = ?",
+                         (topic_id, marker))
+        logger.debug("Indexed topic %s (tags: %s)", topic_id, sorted(tags))
+        return True
+
+
+FORUM_INDEX = ForumIndex()
@@ -1,27 +1,134 @@
 #!/usr/bin/env python3
-""" Discord bot for faceswap """
+""" Discord bot for faceswap
 
+Importing the bot's modules has no side effects. Start up happens here, in stages: logging is
+set up, the lookups are loaded and the bot is created with its commands. The FAQs are then loaded
+in the background while the bot connects to Discord, and the FAQ commands wait for them, so that
+a slow or failed FAQ scrape does not hold up the connection. The time taken by each stage is
+logged once the bot is ready and the FAQs are loaded.
+
+Several bot processes can run from the same folder, each started with its own ``--instance`` id
+(or ``FS_BOT_INSTANCE`` environment variable). The id selects the process's shards from the
+lookups and keeps its log, pending deletions and metrics port apart from the other processes.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
 import logging
-from time import sleep
+import os
+import typing as T
+
+from contextlib import contextmanager
+from time import perf_counter
+
+from instance import set_instance
+from log_tools import log_setup
+from metrics import METRICS
+from utils import get_config, get_token, load_lookups
 
-from commands import FS_BOT
-from scraper import faq_cache
-from utils import get_token
+if T.TYPE_CHECKING:
+    from discord.ext.commands import Bot
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
-if __name__ == "__main__":
-    while True:
-        # Wait for FAQ Cache
-        if faq_cache.loaded.is_set():
-            break
-        sleep(1)
 
-    @FS_BOT.event
+class Startup():
+    """ Records how long each stage of start up takes and logs a report once every milestone has
+    been reached """
+    def __init__(self, milestones: T.Tuple[str, ...] = ("ready", "faqs")) -> None:
+        self._start = perf_counter()
+        self._milestones = milestones
+        self._phases: T.Dict[str, float] = {}
+        self._reported = False
+
+    @contextmanager
+    def phase(self, name: str) -> T.Generator[None, None, None]:
+        """ Context manager to time a start up stage that runs before the bot connects """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, perf_counter() - start)
+
+    def mark(self, name: str) -> None:
+        """ Record the time from the start of start up to a milestone. Only the first time each
+        milestone is reached is recorded """
+        if name not in self._phases:
+            self._record(name, perf_counter() - self._start)
+        if not self._reported and all(key in self._phases for key in self._milestones):
+            self._reported = True
+            logger.info("Startup complete in %.3fs (%s)",
+                        perf_counter() - self._start,
+                        ", ".join(f"{key}: {val:.3f}s" for key, val in self._phases.items()))
+
+    def _record(self, name: str, seconds: float) -> None:
+        """ Store and log the time taken by a stage """
+        self._phases[name] = seconds
+        METRICS.observe("startup_seconds", seconds, phase=name)
+        logger.debug("Startup stage '%s' took %.3fs", name, seconds)
+
+
+async def run(bot: Bot, startup: Startup) -> None:
+    """ Connect the bot to Discord while the FAQs load, recording the connection and FAQ milestones
+    in the start up timings """
+    # pylint: disable=import-outside-toplevel
+    from scraper import faq_cache
+
+    async def on_connect() -> None:
+        startup.mark("connect")
+
+    @METRICS.instrument_event
     async def on_ready() -> None:
         """ Log facebot startup """
-        assert FS_BOT.user is not None
-        logger.info("Logged in (client_name: %s, client_id: %s",
-                    FS_BOT.user.name, FS_BOT.user.id)
+        assert bot.user is not None
+        logger.info("Logged in (client_name: %s, client_id: %s", bot.user.name, bot.user.id)
+        startup.mark("ready")
+
+    async def faqs_loaded() -> None:
+        await faq_cache.wait_loaded()
+        startup.mark("faqs")
+
+    bot.add_listener(on_connect)
+    bot.add_listener(on_ready)
+    faq_cache.start()
+    async with bot:
+        waiter = asyncio.create_task(faqs_loaded(), name="faqs_loaded")
+        try:
+            await bot.start(get_token())
+        finally:
+            waiter.cancel()
+
 
-    FS_BOT.run(get_token())
+def main() -> None:
+    """ Start up and run the bot """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--instance", type=int, default=os.environ.get("FS_BOT_INSTANCE"),
+                        help="The id of this process when several bot processes run from the "
+                             "same folder. Default: the FS_BOT_INSTANCE environment variable")
+    set_instance(parser.parse_args().instance)
+    startup = Startup()
+    with startup.phase("logging"):
+        log_setup()
+    with startup.phase("lookups"):
+        load_lookups()
+    with startup.phase("imports"):
+        # pylint: disable=import-outside-toplevel
+        from commands import create_bot
+        from forum import FORUM_INDEX, ForumCrawler
+        from slash import SlashCommands
+    with startup.phase("commands"):
+        bot = create_bot()
+        if get_config("slash_commands", True):
+            SlashCommands(bot)
+
+    crawler_config = dict(get_config("forum_crawler", {}))
+    if crawler_config.pop("enabled", True):
+        ForumCrawler(FORUM_INDEX, **crawler_config).start()
+    try:
+        asyncio.run(run(bot, startup))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+""" Indexed role and channel cache and event debouncing for faceswap Discord bot """
+from __future__ import annotations
+import logging
+import typing as T
+
+from time import monotonic
+
+if T.TYPE_CHECKING:
+    import discord
+    from discord.abc import GuildChannel
+    from discord.ext.commands import Bot
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class _GuildIndex():
+    """ Id and name lookups for a single guild's roles and channels """
+    __slots__ = ("roles", "role_names", "channels", "channel_names")
+
+    def __init__(self, guild: discord.Guild) -> None:
+        self.roles = {role.id: role for role in guild.roles}
+        self.role_names = {role.name: role for role in guild.roles}
+        self.channels = {channel.id: channel for channel in guild.channels}
+        self.channel_names = {channel.name: channel for channel in guild.channels}
+
+
+class GuildCache():
+    """ Indexes each guild's roles and channels by id and by name, kept up to date from the
+    guild update events, so that lookups by name do not scan the guild's roles or channels """
+    def __init__(self) -> None:
+        self._guilds: T.Dict[int, _GuildIndex] = {}
+
+    def _index(self, guild: discord.Guild) -> _GuildIndex:
+        """ Obtain the index for a guild, building it if it does not exist """
+        index = self._guilds.get(guild.id)
+        if index is None:
+            index = self._guilds[guild.id] = _GuildIndex(guild)
+            logger.debug("Indexed guild %s (roles: %s, channels: %s)",
+                         guild.id, len(index.roles), len(index.channels))
+        return index
+
+    def get_role(self, guild: discord.Guild, name: str) -> T.Optional[discord.Role]:
+        """ Return the guild's role with the given name, or ``None`` if it does not exist """
+        return self._index(guild).role_names.get(name)
+
+    def get_channel(self, guild: discord.Guild, name: str) -> T.Optional[GuildChannel]:
+        """ Return the guild's channel with the given name, or ``None`` if it does not exist """
+        return self._index(guild).channel_names.get(name)
+
+    def rebuild(self, guild: discord.Guild) -> None:
+        """ Rebuild the index for a guild """
+        self._guilds[guild.id] = _GuildIndex(guild)
+
+    def forget(self, guild: discord.Guild) -> None:
+        """ Remove a guild's index """
+        self._guilds.pop(guild.id, None)
+
+    def _update_role(self,
+                     role: discord.Role,
+                     before: T.Optional[discord.Role] = None,
+                     removed: bool = False) -> None:
+        """ Update a single role in its guild's index. discord.py renames the cached role in
+        place, so the old name is taken from the copy of the role from before the update """
+        index = self._guilds.get(role.guild.id)
+        if index is None:
+            return
+        index.roles.pop(role.id, None)
+        for name in {role.name, getattr(before, "name", role.name)}:
+            if getattr(index.role_names.get(name), "id", None) == role.id:
+                del index.role_names[name]
+        if not removed:
+            index.roles[role.id] = role
+            index.role_names[role.name] = role
+
+    def _update_channel(self,
+                        channel: GuildChannel,
+                        before: T.Optional[GuildChannel] = None,
+                        removed: bool = False) -> None:
+        """ Update a single channel in its guild's index. discord.py renames the cached channel
+        in place, so the old name is taken from the copy of the channel from before the
+        update """
+        index = self._guilds.get(channel.guild.id)
+        if index is None:
+            return
+        index.channels.pop(channel.id, None)
+        for name in {channel.name, getattr(before, "name", channel.name)}:
+            if getattr(index.channel_names.get(name), "id", None) == channel.id:
+                del index.channel_names[name]
+        if not removed:
+            index.channels[channel.id] = channel
+            index.channel_names[channel.name] = channel
+
+    def register(self, bot: Bot) -> None:
+        """ Add the listeners that keep the cache up to date to the bot """
+        async def on_guild_available(guild: discord.Guild) -> None:
+            self.rebuild(guild)
+
+        async def on_guild_remove(guild: discord.Guild) -> None:
+            self.forget(guild)
+
+        async def on_guild_role_create(role: discord.Role) -> None:
+            self._update_role(role)
+
+        async def on_guild_role_update(before: discord.Role, role: discord.Role) -> None:
+            self._update_role(role, before=before)
+
+        async def on_guild_role_delete(role: discord.Role) -> None:
+            self._update_role(role, removed=True)
+
+        async def on_guild_channel_create(channel: GuildChannel) -> None:
+            self._update_channel(channel)
+
+        async def on_guild_channel_update(before: GuildChannel, channel: GuildChannel) -> None:
+            self._update_channel(channel, before=before)
+
+        async def on_guild_channel_delete(channel: GuildChannel) -> None:
+            self._update_channel(channel, removed=True)
+
+        for listener in (on_guild_available, on_guild_remove,
+                         on_guild_role_create, on_guild_role_update, on_guild_role_delete,
+                         on_guild_channel_create, on_guild_channel_update,
+                         on_guild_channel_delete):
+            bot.add_listener(listener)
+
+
+class Debouncer():
+    """ Collapses bursts of events with the same key into the first event, suppressing further
+    events with that key for window seconds """
+    def __init__(self, window: float = 60.) -> None:
+        self.window = window
+        self._expiry: T.Dict[T.Hashable, float] = {}
+
+    def first(self, key: T.Hashable) -> bool:
+        """ Return ``True`` if an event is the first with the given key within the window, starting
+        a new window, or ``False`` if it should be suppressed """
+        now = monotonic()
+        if self._expiry.get(key, 0.) > now:
+            return False
+        if len(self._expiry) > 1000:
+            self._expiry = {k: v for k, v in self._expiry.items() if v > now}
+        self._expiry[key] = now + self.window
+        return True
+
+    def reset(self, key: T.Hashable) -> None:
+        """ End the window for the given key, so that the next event is handled """
+        self._expiry.pop(key, None)
+
+
+GUILD_CACHE = GuildCache()
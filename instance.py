@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+""" The id of this bot process and the paths to its files for faceswap Discord bot
+
+Several bot processes can run from the same folder, each with its own instance id. The id keeps
+the files that each process owns apart from those of the other processes. This module does not
+import any of the bot's other modules, so that all of them can use it.
+"""
+from __future__ import annotations
+import logging
+import os
+import sys
+import typing as T
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+_INSTANCE: T.Optional[int] = None
+
+
+def set_instance(instance: T.Optional[int]) -> None:
+    """ Set the id of this bot process, when several processes run from the same folder, or
+    ``None`` for a single process """
+    global _INSTANCE  # pylint: disable=global-statement
+    _INSTANCE = instance
+    logger.debug("Set instance: %s", instance)
+
+
+def get_instance() -> T.Optional[int]:
+    """ Return the id of this bot process, or ``None`` for a single process """
+    return _INSTANCE
+
+
+def get_data_path(file_name: str, per_instance: bool = False) -> str:
+    """ Return the full path to a file next to the bot's script. Files that each process must own
+    are given the instance id as a suffix, when one is set """
+    if per_instance and _INSTANCE is not None:
+        stem, ext = os.path.splitext(file_name)
+        file_name = f"{stem}.{_INSTANCE}{ext}"
+    return os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), file_name)
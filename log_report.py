@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+""" Command usage report from the logs of faceswap Discord bot
+
+Streams through the current ``fs_bot.log`` and its rotated files (``fs_bot.log.YYYY-MM-DD``,
+optionally gzipped), oldest first, and reports per command usage counts, error rates and
+latency percentiles, plus the most frequent tasks and search terms. Lines are read one at a
+time, and the task and search term counts are bounded, so memory use does not grow with the
+size of the logs.
+
+The statistics and how far each log file has been read are saved to a checkpoint file, so that
+repeated runs only read the lines logged since the previous run. Files are identified by their
+first line, so a file is recognised after it has been rotated or gzipped.
+
+Usage::
+
+    python log_report.py [fs_bot.log] [--checkpoint fs_bot.log.stats.json] [--reset]
+                         [--top 10] [--json]
+"""
+from __future__ import annotations
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import typing as T
+
+from instance import get_data_path
+from metrics import Histogram
+
+_ROTATED = re.compile(r"\.\d{4}-\d{2}-\d{2}(\.gz)?$")
+_CHECKPOINT_VERSION = 1
+
+
+class TopCounter():
+    """ Approximate counts of the most frequent keys in bounded memory. Once more than twice
+    capacity keys are held, the least frequent are discarded down to capacity, so rare keys may be
+    undercounted """
+    def __init__(self, capacity: int = 1000) -> None:
+        self.capacity = capacity
+        self.counts: T.Dict[str, int] = {}
+
+    def add(self, key: str, count: int = 1) -> None:
+        """ Count a key """
+        self.counts[key] = self.counts.get(key, 0) + count
+        if len(self.counts) > 2 * self.capacity:
+            self.counts = dict(self.most_common(self.capacity))
+
+    def most_common(self, limit: int) -> T.List[T.Tuple[str, int]]:
+        """ The most frequent keys and their counts, most frequent first """
+        return sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+
+class LogStats():
+    """ Command statistics aggregated from log entries, keeping capacity task and search term
+    keys """
+    def __init__(self, capacity: int = 1000) -> None:
+        self.calls: T.Dict[str, int] = {}
+        self.errors: T.Dict[str, int] = {}
+        self.latency: T.Dict[str, Histogram] = {}
+        self.tasks = TopCounter(capacity)
+        self.search_terms = TopCounter(capacity)
+        self.log_errors = 0
+        self.lines = 0
+
+    def add(self, entry: T.Dict[str, T.Any]) -> None:
+        """ Add a parsed log entry to the statistics """
+        self.lines += 1
+        if entry.get("level") in ("ERROR", "CRITICAL"):
+            self.log_errors += 1
+        command = entry.get("command")
+        if command is None:
+            return
+        message = entry.get("message", "")
+        if message.startswith("command: "):
+            self.calls[command] = self.calls.get(command, 0) + 1
+        elif message.startswith("Command complete") and "seconds" in entry:
+            self.latency.setdefault(command, Histogram()).observe(float(entry["seconds"]))
+            if entry.get("status") == "error":
+                self.errors[command] = self.errors.get(command, 0) + 1
+            if entry.get("task") is not None:
+                self.tasks.add(f"{command} {entry['task']}")
+            if entry.get("search_term"):
+                self.search_terms.add(f"{command} {entry['search_term'].lower()}")
+
+    def to_dict(self) -> T.Dict[str, T.Any]:
+        """ The statistics as a JSON serializable dict """
+        return {"calls": self.calls,
+                "errors": self.errors,
+                "latency": {key: {"counts": val.counts, "total": val.total, "count": val.count}
+                            for key, val in self.latency.items()},
+                "tasks": self.tasks.counts,
+                "search_terms": self.search_terms.counts,
+                "log_errors": self.log_errors,
+                "lines": self.lines}
+
+    @classmethod
+    def from_dict(cls, data: T.Dict[str, T.Any], capacity: int = 1000) -> LogStats:
+        """ Restore statistics saved with :func:`to_dict` """
+        retval = cls(capacity)
+        retval.calls = data["calls"]
+        retval.errors = data["errors"]
+        for key, val in data["latency"].items():
+            histogram = retval.latency[key] = Histogram()
+            histogram.counts, histogram.total, histogram.count = (val["counts"],
+                                                                  val["total"],
+                                                                  val["count"])
+        retval.tasks.counts = data["tasks"]
+        retval.search_terms.counts = data["search_terms"]
+        retval.log_errors = data["log_errors"]
+        retval.lines = data["lines"]
+        return retval
+
+    def report(self, top: int = 10) -> T.Dict[str, T.Any]:
+        """ The per command calls, errors, error rate and latency percentiles, with the top most
+        frequent tasks and search terms """
+        commands = {}
+        for command in sorted(set(self.calls) | set(self.latency)):
+            histogram = self.latency.get(command, Histogram())
+            completed = histogram.count
+            commands[command] = {"calls": self.calls.get(command, completed),
+                                 "errors": self.errors.get(command, 0),
+                                 "error_rate": (self.errors.get(command, 0) / completed
+                                                if completed else 0.0),
+                                 "p50": histogram.percentile(50),
+                                 "p95": histogram.percentile(95),
+                                 "p99": histogram.percentile(99)}
+        return {"lines": self.lines,
+                "log_errors": self.log_errors,
+                "commands": commands,
+                "tasks": self.tasks.most_common(top),
+                "search_terms": self.search_terms.most_common(top)}
+
+
+def log_files(path: str) -> T.List[str]:
+    """ The full paths to the rotated files of a log file in date order, followed by the current
+    log file if it exists """
+    folder, name = os.path.split(os.path.abspath(path))
+    rotated = sorted((fname for fname in os.listdir(folder)
+                      if fname.startswith(name) and _ROTATED.fullmatch(fname[len(name):])),
+                     key=lambda fname: fname[len(name):].removesuffix(".gz"))
+    retval = [os.path.join(folder, fname) for fname in rotated]
+    if os.path.isfile(path):
+        retval.append(os.path.abspath(path))
+    return retval
+
+
+def _open(path: str) -> T.BinaryIO:
+    """ Open a log file for binary reading, decompressing gzipped files """
+    if path.endswith(".gz"):
+        return T.cast(T.BinaryIO, gzip.open(path, "rb"))
+    return open(path, "rb")  # pylint: disable=consider-using-with
+
+
+def _fingerprint(log_file: T.BinaryIO) -> T.Optional[str]:
+    """ Identify a log file from its first line, read from the start of the open file. ``None``
+    if the file does not yet contain a complete line """
+    first = log_file.readline()
+    return hashlib.sha1(first).hexdigest() if first.endswith(b"\n") else None
+
+
+def fingerprint(path: str) -> T.Optional[str]:
+    """ Identify a log file from its first line, which does not change when the file is rotated or
+    gzipped. ``None`` if the file does not yet contain a complete line """
+    with _open(path) as log_file:
+        return _fingerprint(log_file)
+
+
+def read_new_entries(path: str, offsets: T.Dict[str, int]) -> T.Iterator[T.Dict[str, T.Any]]:
+    """ Yield the parsed log entries of a file that were not read by a previous run, updating the
+    bytes read for each file's fingerprint in offsets. Only complete lines are read """
+    with _open(path) as log_file:
+        key = _fingerprint(log_file)
+        if key is None:
+            return
+        offset = offsets.get(key, 0)
+        log_file.seek(offset)
+        for line in log_file:
+            if not line.endswith(b"\n"):
+                break
+            offset += len(line)
+            offsets[key] = offset
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(entry, dict):
+                yield entry
+
+
+def _format_seconds(seconds: float) -> str:
+    """ Format a latency for the text report """
+    return "inf" if seconds == float("inf") else f"{seconds * 1000:.0f}ms"
+
+
+def format_report(report: T.Dict[str, T.Any]) -> str:
+    """ Format a report from :func:`LogStats.report` as text """
+    lines = [f"{'command':<18}{'calls':>8}{'errors':>8}{'err%':>8}{'p50':>9}{'p95':>9}"
+             f"{'p99':>9}"]
+    for command, stats in report["commands"].items():
+        lines.append(f"{command:<18}{stats['calls']:>8}{stats['errors']:>8}"
+                     f"{stats['error_rate']:>8.1%}{_format_seconds(stats['p50']):>9}"
+                     f"{_format_seconds(stats['p95']):>9}{_format_seconds(stats['p99']):>9}")
+    for title, key in (("Top tasks", "tasks"), ("Top search terms", "search_terms")):
+        lines.append(f"\n{title}:")
+        lines.extend(f"{count:>8}  {name}" for name, count in report[key])
+    lines.append(f"\nlog lines: {report['lines']}, error records: {report['log_errors']}")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    """ Parse the command line, update the statistics from the logs and output the report """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("log", nargs="?", default=get_data_path("fs_bot.log"),
+                        help="The current log file. Default: fs_bot.log next to this script")
+    parser.add_argument("--checkpoint",
+                        help="File to save the statistics and read positions to. Default: the "
+                             "log file with a .stats.json suffix")
+    parser.add_argument("--reset", action="store_true",
+                        help="Ignore any existing checkpoint and read all of the logs")
+    parser.add_argument("--top", type=int, default=10,
+                        help="Number of tasks and search terms to report")
+    parser.add_argument("--json", action="store_true", help="Output the report as JSON")
+    args = parser.parse_args()
+    checkpoint = args.checkpoint or f"{args.log}.stats.json"
+
+    stats, offsets = LogStats(), {}
+    if not args.reset and os.path.isfile(checkpoint):
+        with open(checkpoint, "r", encoding="utf-8") as saved:
+            data = json.load(saved)
+        if data.get("version") == _CHECKPOINT_VERSION:
+            stats, offsets = LogStats.from_dict(data["stats"]), data["offsets"]
+
+    paths = log_files(args.log)
+    for path in paths:
+        for entry in read_new_entries(path, offsets):
+            stats.add(entry)
+    # Only keep the read positions of the files that still exist
+    present = {fingerprint(path) for path in paths}
+    offsets = {key: val for key, val in offsets.items() if key in present}
+
+    temp_path = f"{checkpoint}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as saved:
+        json.dump({"version": _CHECKPOINT_VERSION, "offsets": offsets, "stats": stats.to_dict()},
+                  saved)
+    os.replace(temp_path, checkpoint)
+
+    report = stats.report(top=args.top)
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+
+
+if __name__ == "__main__":
+    main()
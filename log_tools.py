@@ -1,16 +1,131 @@
 #!/usr/bin/env python3
-""" Logging for faceswap Discord bot """
+""" Logging for faceswap Discord bot
 
+Records are handed to a queue on the calling thread and formatted and written by a background
+listener thread, so that file I/O and log rotation never run on the event loop. The log file
+is written as JSON lines, with the context fields set by :func:`set_log_context` (for example
+the command being run) added to every record logged from the same task.
+"""
+from __future__ import annotations
+import atexit
+import contextvars
+import json
 import logging
-import os
-import sys
+import queue
+import random
+import re
+import typing as T
 
-from logging.handlers import TimedRotatingFileHandler
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+
+from instance import get_data_path
+
+_CONTEXT: contextvars.ContextVar[T.Dict[str, T.Any]] = contextvars.ContextVar("log_context",
+                                                                              default={})
+_TOKEN_PATTERN = re.compile(r"[\w-]{24,}\.[\w-]{6}\.[\w-]{27,}")
+_LISTENER: T.Optional[QueueListener] = None
+
+
+def set_log_context(**fields: T.Any) -> contextvars.Token:
+    """ Set fields to be added to every log record emitted from the current task or thread. Returns
+    a token for :func:`reset_log_context` to restore the previous fields """
+    return _CONTEXT.set({**_CONTEXT.get(), **fields})
+
+
+def reset_log_context(token: contextvars.Token) -> None:
+    """ Restore the log context fields that were in place prior to :func:`set_log_context` """
+    _CONTEXT.reset(token)
+
+
+class _ContextFilter(logging.Filter):
+    """ Adds the current log context to records and samples low level records. Runs on the
+    calling thread prior to the record being queued """
+    def __init__(self) -> None:
+        super().__init__()
+        self.sample_rates: T.Dict[str, float] = {}
+
+    def _sample_rate(self, name: str) -> float:
+        """ The sample rate for the given logger name, from the nearest configured parent """
+        while True:
+            if name in self.sample_rates:
+                return self.sample_rates[name]
+            if "." not in name:
+                return self.sample_rates.get("", 1.0)
+            name = name.rsplit(".", 1)[0]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if (self.sample_rates
+                and record.levelno < logging.WARNING
+                and random.random() >= self._sample_rate(record.name)):
+            return False
+        record.context = _CONTEXT.get()
+        return True
+
+
+class _RedactFilter(logging.Filter):
+    """ Removes secrets from records. Runs once for each record on the listener thread, before
+    the record is handed to the handlers """
+    def __init__(self) -> None:
+        super().__init__()
+        self._secrets: T.Set[str] = set()
+        self._pattern = _TOKEN_PATTERN
+
+    @property
+    def secrets(self) -> T.Set[str]:
+        """ set: Strings that should never be written to the logs """
+        return self._secrets
+
+    @secrets.setter
+    def secrets(self, value: T.Set[str]) -> None:
+        self._secrets = value
+        # A single pass, so that a secret is never found inside a replacement
+        patterns = [re.escape(secret) for secret in sorted(value, key=len, reverse=True)]
+        self._pattern = re.compile("|".join([*patterns, _TOKEN_PATTERN.pattern]))
+
+    def _redact(self, text: str) -> str:
+        """ Redact any secrets from the given text """
+        return self._pattern.sub("<redacted>", text)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.msg = self._redact(str(record.msg))
+        if record.exc_text:
+            record.exc_text = self._redact(record.exc_text)
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """ Formats log records as a single line JSON object """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {**getattr(record, "context", {}),
+                 "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+                 "level": record.levelname,
+                 "logger": record.name,
+                 "thread": record.threadName,
+                 "func": record.funcName,
+                 "message": record.getMessage()}
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _RedactingListener(QueueListener):
+    """ Queue listener that redacts each record once before passing it to the handlers """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        _REDACT_FILTER.filter(record)
+        return record
+
+
+_CONTEXT_FILTER = _ContextFilter()
+_REDACT_FILTER = _RedactFilter()
 
 
 def log_setup() -> None:
     """ initial log set up.
      Check valid log level supplied and set log level """
+    global _LISTENER  # pylint: disable=global-statement
     loglevel = logging.INFO
     numeric_level = loglevel
     if not isinstance(numeric_level, int):
@@ -19,21 +134,38 @@ def log_setup() -> None:
     logger = logging.getLogger()
     logger.setLevel(numeric_level)
 
-    log_format = logging.Formatter("%(asctime)s %(processName)-15s %(threadName)-15s "
-                                   "%(module)-15s %(funcName)-25s %(levelname)-8s %(message)s",
-                                   datefmt="%m/%d/%Y %H:%M:%S")
     stream_log_format = logging.Formatter("%(asctime)s %(levelname)-8s %(message)s",
                                           datefmt="%m/%d/%Y %H:%M:%S")
 
-    pypath = os.path.dirname(os.path.realpath(sys.argv[0]))
-    log_path = os.path.join(pypath, "fs_bot.log")
+    log_path = get_data_path("fs_bot.log", per_instance=True)
     log_file = TimedRotatingFileHandler(log_path, when="midnight", backupCount=14)
-    log_file.setFormatter(log_format)
-    logger.addHandler(log_file)
+    log_file.setFormatter(JSONFormatter())
 
     log_console = logging.StreamHandler()
     log_console.setFormatter(stream_log_format)
-    logger.addHandler(log_console)
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    log_handler = QueueHandler(log_queue)
+    log_handler.addFilter(_CONTEXT_FILTER)
+    logger.addHandler(log_handler)
+
+    _LISTENER = _RedactingListener(log_queue, log_file, log_console, respect_handler_level=True)
+    _LISTENER.start()
+    atexit.register(_LISTENER.stop)
 
     logging.debug("Log level set to: %s", loglevel)
     logging.info('Started')
+
+
+def configure_logging(config: T.Dict[str, T.Any], secrets: T.Iterable[str] = ()) -> None:
+    """ Apply logging configuration, for example from the lookups. Optional keys are "level" (the
+    root log level name), "levels" (logger name to level name) and "sample" (logger name, or "" for
+    all loggers, to the fraction of records below WARNING to keep). secrets are never written to
+    the logs """
+    _REDACT_FILTER.secrets = {secret for secret in secrets if secret}
+    if "level" in config:
+        logging.getLogger().setLevel(config["level"].upper())
+    for name, level in config.get("levels", {}).items():
+        logging.getLogger(name).setLevel(level.upper())
+    _CONTEXT_FILTER.sample_rates = {name: float(rate)
+                                    for name, rate in config.get("sample", {}).items()}
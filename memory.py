@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+""" Memory usage report of the discord caches and the FAQ cache for faceswap Discord bot
+
+Sizes are estimated by walking each cached object's attributes and containers and adding up
+:func:`sys.getsizeof`. The walk stops at other cached discord objects, so that each object is
+counted in its own cache only: a member's user is counted with the users and a message's channel
+with the channels. Objects shared between caches, such as interned strings, are counted in the
+first cache that reaches them. Caches with many items, such as the members of a large guild, are
+sized from an evenly spaced sample of their items, so that the walk does not hold up the event
+loop.
+"""
+from __future__ import annotations
+import asyncio
+import itertools
+import logging
+import math
+import os
+import sys
+import typing as T
+
+from collections import deque
+from collections.abc import Mapping
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+
+import discord
+from discord.abc import GuildChannel, PrivateChannel
+from discord.state import ConnectionState
+from discord.user import BaseUser
+
+from scraper import faq_cache
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# Objects that are counted in their own cache, or are not part of any cache, and are not walked
+# into when reached from another object
+_BOUNDARIES = (discord.Client, ConnectionState, discord.Guild, GuildChannel, PrivateChannel,
+               discord.Thread, discord.Role, discord.Member, BaseUser, discord.Message,
+               discord.Emoji, discord.GuildSticker, asyncio.AbstractEventLoop, type, ModuleType,
+               FunctionType, MethodType, BuiltinFunctionType)
+_ATOMS = (str, bytes, bytearray, int, float, complex)
+_SAMPLE = 500
+
+
+def deep_sizeof(obj: T.Any, seen: T.Optional[T.Set[int]] = None) -> int:
+    """ Estimate the memory in bytes used by an object and the objects that it references. Objects
+    whose ids are in seen are skipped, and seen is updated with the objects counted """
+    seen = set() if seen is None else seen
+    size = 0
+    pending = [obj]
+    while pending:
+        item = pending.pop()
+        if id(item) in seen or (item is not obj and isinstance(item, _BOUNDARIES)):
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, _ATOMS):
+            continue
+        if isinstance(item, Mapping):
+            pending.extend(item.keys())
+            pending.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            pending.extend(item)
+        if hasattr(item, "__dict__"):
+            pending.append(vars(item))
+        for cls in type(item).__mro__:
+            slots = cls.__dict__.get("__slots__", ())
+            for slot in (slots, ) if isinstance(slots, str) else slots:
+                if slot not in ("__dict__", "__weakref__") and hasattr(item, slot):
+                    pending.append(getattr(item, slot))
+    return size
+
+
+def _sample_sizeof(items: T.Sequence[T.Any], seen: T.Set[int], sample: int) -> int:
+    """ Estimate the total size of a cache's items from at most sample of them """
+    step = max(1, math.ceil(len(items) / sample))
+    sizes = [deep_sizeof(item, seen) for item in itertools.islice(items, 0, None, step)]
+    return round(sum(sizes) * len(items) / len(sizes)) if sizes else 0
+
+
+def cache_usage(bot: discord.Client, sample: int = _SAMPLE) -> T.List[T.Tuple[str, int, int]]:
+    """ The number of items held in each of the bot's caches and their estimated size, as tuples
+    of cache name, number of items and size in bytes. At most sample items of each cache are
+    walked """
+    guilds = bot.guilds
+    caches: T.List[T.Tuple[str, T.Sequence[T.Any]]] = [
+        ("guilds", guilds),
+        ("channels", [channel for guild in guilds for channel in (*guild.channels,
+                                                                  *guild.threads)]),
+        ("roles", [role for guild in guilds for role in guild.roles]),
+        ("members", [member for guild in guilds for member in guild.members]),
+        ("users", bot.users),
+        ("messages", bot.cached_messages),
+        ("emojis", bot.emojis),
+        ("stickers", bot.stickers)]
+    seen: T.Set[int] = set()
+    retval = [(name, len(items), _sample_sizeof(items, seen, sample)) for name, items in caches]
+    snapshot = faq_cache.snapshot
+    retval.append(("faqs", len(snapshot), deep_sizeof(snapshot, seen)))
+    logger.debug("Cache usage: %s", retval)
+    return retval
+
+
+def resident_memory() -> T.Optional[int]:
+    """ The process's current resident memory in bytes, or ``None`` if the platform does not
+    report it """
+    try:
+        with open("/proc/self/statm", "r", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, IndexError, OSError, ValueError):
+        return None
+
+
+def _format_bytes(size: float) -> str:
+    """ Format a size in bytes for the text report """
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GiB"
+
+
+def format_usage(usage: T.List[T.Tuple[str, int, int]]) -> str:
+    """ Format a report from :func:`cache_usage` as text, with the process's resident memory """
+    lines = [f"{'cache':<12}{'items':>10}{'size':>12}"]
+    lines.extend(f"{name:<12}{items:>10}{_format_bytes(size):>12}" for name, items, size in usage)
+    lines.append(f"{'total':<12}{'':>10}{_format_bytes(sum(row[2] for row in usage)):>12}")
+    rss = resident_memory()
+    if rss is not None:
+        lines.append(f"resident memory: {_format_bytes(rss)}")
+    return "\n".join(lines)
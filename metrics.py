@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+""" Latency and throughput metrics for faceswap Discord bot
+
+Metrics are held in memory as counters and fixed bucket histograms, so recording a value is a
+dictionary lookup and a bisect. They can be summarized for the ``stats`` command or rendered in
+the Prometheus text format by the optional local HTTP endpoint.
+"""
+from __future__ import annotations
+import asyncio
+import logging
+import typing as T
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock
+from time import perf_counter
+
+from discord.ext.commands import Context
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30., 60.)
+_Labels = T.Tuple[T.Tuple[str, str], ...]
+
+
+class Histogram():
+    """ A fixed bucket histogram of observed durations in seconds """
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """ Add an observation to the histogram """
+        self.counts[bisect_left(_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def percentile(self, percentile: float) -> float:
+        """ Estimate a percentile, between 0 and 100, as the upper bound of the bucket that
+        contains it. `inf` if it falls above the largest bucket """
+        if not self.count:
+            return 0.0
+        target = self.count * percentile / 100.
+        cumulative = 0
+        for bound, count in zip(_BUCKETS + (float("inf"), ), self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float("inf")
+
+
+class Metrics():
+    """ Holds the counters and histograms for the bot. Safe to record from any thread """
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._counters: T.Dict[str, T.Dict[_Labels, float]] = {}
+        self._histograms: T.Dict[str, T.Dict[_Labels, Histogram]] = {}
+
+    def increment(self, name: str, value: float = 1., **labels: str) -> None:
+        """ Increment the counter with the given name and labels by value """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """ Add an observation, in seconds, to the histogram with the given name and labels """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> T.Generator[None, None, None]:
+        """ Context manager that observes the duration of its body in the given histogram """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start, **labels)
+
+    def instrument_event(self, coro: T.Callable[..., T.Coroutine[T.Any, T.Any, T.Any]]
+                         ) -> T.Callable[..., T.Coroutine[T.Any, T.Any, T.Any]]:
+        """ Decorator to record the latency and outcome of a Discord event handler """
+        @wraps(coro)
+        async def wrapped(*args, **kwargs):
+            start = perf_counter()
+            status = "error"
+            try:
+                retval = await coro(*args, **kwargs)
+                status = "ok"
+                return retval
+            finally:
+                self.observe("event_seconds", perf_counter() - start, event=coro.__name__)
+                self.increment("events_total", event=coro.__name__, status=status)
+        return wrapped
+
+    def summary(self) -> str:
+        """ Summarize the command metrics for display in Discord, as a plain text table of calls,
+        errors and latency percentiles per command and phase """
+        lines = [f"{'name':<28}{'count':>8}{'err':>6}{'p50':>9}{'p95':>9}{'p99':>9}"]
+        with self._lock:
+            errors = {dict(key).get("command", dict(key).get("event")): val
+                      for name in ("commands_total", "events_total")
+                      for key, val in self._counters.get(name, {}).items()
+                      if dict(key).get("status") == "error"}
+            rows = sorted((", ".join(val for _, val in key), histogram)
+                          for name in ("command_seconds", "event_seconds", "phase_seconds",
+                                       "scraper_seconds")
+                          for key, histogram in self._histograms.get(name, {}).items())
+            ratelimits = sum(self._counters.get("ratelimit_waits_total", {}).values())
+            ratelimit_seconds = sum(self._counters.get("ratelimit_wait_seconds_total",
+                                                       {}).values())
+        for label, histogram in rows:
+            percentiles = "".join(f"{histogram.percentile(pct) * 1000:>7.0f}ms"
+                                  for pct in (50, 95, 99))
+            lines.append(f"{label[:27]:<28}{histogram.count:>8}"
+                         f"{int(errors.get(label, 0)):>6}{percentiles}")
+        lines.append(f"rate limited: {int(ratelimits)} times, {ratelimit_seconds:.1f}s waiting")
+        return "\n".join(lines)
+
+    def render_prometheus(self) -> str:
+        """ Render all metrics in the Prometheus text exposition format """
+        def fmt_labels(labels: _Labels, extra: str = "") -> str:
+            items = [f'{key}="{val}"' for key, val in labels] + ([extra] if extra else [])
+            return "{" + ",".join(items) + "}" if items else ""
+
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE fsbot_{name} counter")
+                lines.extend(f"fsbot_{name}{fmt_labels(key)} {val}"
+                             for key, val in series.items())
+            for name, hists in sorted(self._histograms.items()):
+                lines.append(f"# TYPE fsbot_{name} histogram")
+                for key, histogram in hists.items():
+                    cumulative = 0
+                    for bound, count in zip(_BUCKETS + (float("inf"), ), histogram.counts):
+                        cumulative += count
+                        upper = "+Inf" if bound == float("inf") else repr(bound)
+                        labels = fmt_labels(key, f'le="{upper}"')
+                        lines.append(f"fsbot_{name}_bucket{labels} {cumulative}")
+                    lines.append(f"fsbot_{name}_sum{fmt_labels(key)} {histogram.total}")
+                    lines.append(f"fsbot_{name}_count{fmt_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 9108) -> asyncio.AbstractServer:
+        """ Start a minimal HTTP server on the given host and port that returns the metrics in the
+        Prometheus text format for any GET request """
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            try:
+                request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+                if request.startswith(b"GET "):
+                    body = self.render_prometheus().encode()
+                    head = ("HTTP/1.1 200 OK\r\n"
+                            "Content-Type: text/plain; version=0.0.4\r\n")
+                else:
+                    body = b""
+                    head = "HTTP/1.1 405 Method Not Allowed\r\n"
+                writer.write(f"{head}Content-Length: {len(body)}\r\n"
+                             "Connection: close\r\n\r\n".encode() + body)
+                await writer.drain()
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                    asyncio.TimeoutError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        server = await asyncio.start_server(handle, host, port)
+        logger.info("Serving metrics at http://%s:%s/metrics", host, port)
+        return server
+
+
+class _RateLimitFilter(logging.Filter):
+    """ Counts the rate limit waits that discord.py logs when a request receives a 429 """
+    def __init__(self, metrics: Metrics) -> None:
+        super().__init__()
+        self._metrics = metrics
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if isinstance(record.msg, str) and "rate limit" in record.msg and record.args:
+            retry_after = record.args[-1]
+            if isinstance(retry_after, float):
+                scope = "global" if record.msg.startswith("Global") else "route"
+                self._metrics.increment("ratelimit_waits_total", scope=scope)
+                self._metrics.increment("ratelimit_wait_seconds_total", retry_after, scope=scope)
+        return True
+
+
+class InstrumentedContext(Context):
+    """ Command context that records when it was created and times every message sent through
+    it """
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.created = perf_counter()
+
+    async def send(self, *args, **kwargs):  # pylint: disable=arguments-differ
+        with METRICS.timer("phase_seconds", phase="send"):
+            return await super().send(*args, **kwargs)
+
+
+METRICS = Metrics()
+logging.getLogger("discord.http").addFilter(_RateLimitFilter(METRICS))
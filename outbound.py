@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+""" Outbound message handling for faceswap Discord bot
+
+Replies made up of several pieces of text and embeds are packed into as few messages as Discord
+allows. Every message is sent through a per channel queue that paces sends to stay within the
+channel's message rate limit, rather than relying on hitting 429 responses.
+"""
+from __future__ import annotations
+import asyncio
+import contextvars
+import logging
+import typing as T
+
+from time import monotonic
+
+from metrics import InstrumentedContext, METRICS
+
+if T.TYPE_CHECKING:
+    from discord import Embed, Message
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+MAX_CONTENT = 2000
+MAX_EMBEDS = 10
+
+
+class Reply():
+    """ Collects the text and embeds of a reply so they can be sent in as few messages as
+    possible """
+    def __init__(self, text: T.Optional[str] = None) -> None:
+        self._parts: T.List[T.Tuple[T.List[str], T.List[Embed]]] = [([], [])]
+        if text:
+            self.add_text(text)
+
+    def add_text(self, text: str) -> Reply:
+        """ Add a paragraph of text to the reply """
+        self._parts[-1][0].append(text)
+        return self
+
+    def add_embed(self, embed: Embed) -> Reply:
+        """ Add an embed to the reply """
+        self._parts[-1][1].append(embed)
+        return self
+
+    def new_message(self) -> Reply:
+        """ Start a new message, so that the text and embeds added after it are sent after the
+        text and embeds added before it """
+        self._parts.append(([], []))
+        return self
+
+    def messages(self) -> T.List[T.Dict[str, T.Any]]:
+        """ Pack the reply into the keyword arguments for each message to send. Text paragraphs are
+        joined into the message content up to Discord's character limit, and embeds are attached up
+        to Discord's per message limit """
+        return [kwargs for texts, embeds in self._parts for kwargs in self._pack(texts, embeds)]
+
+    @staticmethod
+    def _pack(texts: T.List[str], embeds: T.List[Embed]) -> T.List[T.Dict[str, T.Any]]:
+        """ Pack the text and embeds of a single message into as few messages as possible """
+        contents: T.List[str] = []
+        for text in texts:
+            if contents and len(contents[-1]) + len(text) + 2 <= MAX_CONTENT:
+                contents[-1] = f"{contents[-1]}\n\n{text}"
+            else:
+                contents.extend(text[idx:idx + MAX_CONTENT]
+                                for idx in range(0, max(len(text), 1), MAX_CONTENT))
+        batches = [embeds[idx:idx + MAX_EMBEDS] for idx in range(0, len(embeds), MAX_EMBEDS)]
+        retval = []
+        for idx in range(max(len(contents), len(batches))):
+            kwargs: T.Dict[str, T.Any] = {}
+            if idx < len(contents):
+                kwargs["content"] = contents[idx]
+            if idx < len(batches):
+                kwargs["embeds"] = batches[idx]
+            retval.append(kwargs)
+        return retval
+
+
+class _ChannelQueue():
+    """ Sends a single channel's messages in order, paced by a token bucket """
+    def __init__(self, outbox: Outbox, channel_id: int) -> None:
+        self._outbox = outbox
+        self._channel_id = channel_id
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._tokens = float(outbox.burst)
+        self._updated = monotonic()
+        # The queue outlives the command that created it, so it must not inherit that command's
+        # log context
+        self.task = contextvars.Context().run(asyncio.create_task,
+                                              self._run(),
+                                              name=f"outbox_{channel_id}")
+
+    def put(self, job: T.Callable[[], T.Awaitable[T.Any]], future: asyncio.Future) -> None:
+        """ Queue a send job """
+        self._queue.put_nowait((job, future))
+
+    async def _acquire(self) -> None:
+        """ Wait until the channel's rate limit allows another message """
+        while True:
+            now = monotonic()
+            self._tokens = min(float(self._outbox.burst),
+                               self._tokens + (now - self._updated) * self._outbox.rate)
+            self._updated = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return
+            wait = (1.0 - self._tokens) / self._outbox.rate
+            METRICS.increment("outbox_waits_total")
+            METRICS.increment("outbox_wait_seconds_total", wait)
+            await asyncio.sleep(wait)
+
+    async def _run(self) -> None:
+        """ Send queued messages until the queue has been idle for the outbox's idle time """
+        while True:
+            try:
+                job, future = await asyncio.wait_for(self._queue.get(), self._outbox.idle)
+            except asyncio.TimeoutError:
+                if self._queue.empty():
+                    self._outbox.remove(self._channel_id, self)
+                    return
+                continue
+            if future.cancelled():
+                continue
+            await self._acquire()
+            try:
+                result = await job()
+            except Exception as err:  # pylint: disable=broad-except
+                if not future.done():
+                    future.set_exception(err)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+
+class Outbox():
+    """ Per channel send queues that pace messages to Discord's per channel rate limit of messages
+    per seconds. Empty channel queues are removed after idle seconds """
+    def __init__(self, messages: int = 5, per: float = 5., idle: float = 60.) -> None:
+        self.burst = messages
+        self.rate = messages / per
+        self.idle = idle
+        self._queues: T.Dict[int, _ChannelQueue] = {}
+
+    def configure(self, messages: int = 5, per: float = 5.) -> None:
+        """ Update the rate limit, for example from the lookups """
+        self.burst = messages
+        self.rate = messages / per
+
+    def remove(self, channel_id: int, queue: _ChannelQueue) -> None:
+        """ Remove an idle channel queue """
+        if self._queues.get(channel_id) is queue:
+            del self._queues[channel_id]
+
+    async def submit(self, channel_id: int, job: T.Callable[[], T.Awaitable[T.Any]]) -> T.Any:
+        """ Queue a send job, a function returning the awaitable that performs the send, for the
+        given channel and return its result once it completes """
+        queue = self._queues.get(channel_id)
+        if queue is None or queue.task.done():
+            queue = self._queues[channel_id] = _ChannelQueue(self, channel_id)
+        future = asyncio.get_running_loop().create_future()
+        queue.put(job, future)
+        return await future
+
+
+OUTBOX = Outbox()
+
+
+class BotContext(InstrumentedContext):
+    """ Command context that sends through the channel's outbox queue """
+    async def send(self, *args, **kwargs):  # pylint: disable=arguments-differ
+        return await OUTBOX.submit(self.channel.id,
+                                   lambda: super(BotContext, self).send(*args, **kwargs))
+
+    async def send_reply(self, reply: Reply) -> T.List[Message]:
+        """ Send a reply in as few messages as possible, returning the sent messages """
+        return [await self.send(**kwargs) for kwargs in reply.messages()]
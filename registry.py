@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+""" Registry of the commands generated from the lookups for faceswap Discord bot """
+from __future__ import annotations
+import asyncio
+import logging
+import os
+import typing as T
+
+from discord.ext.commands import Command, has_any_role
+
+from responses import get_responses, validate_lookups
+from throttle import THROTTLE
+from utils import get_lookup_path, get_roles, init_command, load_lookups
+
+if T.TYPE_CHECKING:
+    from discord.ext.commands import Bot
+    from discord.ext.commands.context import Context
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+async def _generated(context: Context) -> None:
+    """ Reply with the compiled response for the invoked command and requested task """
+    assert context.command is not None
+    responses = get_responses(getattr(context.guild, "id", None))
+    name = context.command.name
+    _, args = await init_command(context, responses.matchers.get(name))
+    template = responses.commands[name].get(args.task)
+    if template is None or not THROTTLE.allow(context, args.task, args.at_users):
+        return
+    await context.send(template.format(args.at_users))
+
+
+class CommandRegistry():
+    """ Generates the template driven commands from the lookups and keeps the bot's command table
+    in sync with them when the lookups are reloaded. The lookups file is checked for changes every
+    watch_interval seconds """
+    def __init__(self, bot: Bot, watch_interval: float = 10.) -> None:
+        self._bot = bot
+        self._watch_interval = watch_interval
+        self._generated: T.Dict[str, T.Dict[str, T.Any]] = {}
+        self._stat: T.Optional[T.Tuple[int, int]] = None
+        self._task: T.Optional[asyncio.Task] = None
+
+    def sync(self) -> None:
+        """ Add, replace or remove the generated commands on the bot to match the currently
+        loaded lookups. Commands whose definition has not changed are left in place """
+        schemas = get_responses().schemas
+        roles = get_roles()
+        for name in set(self._generated) - set(schemas):
+            logger.info("Removing generated command: %s", name)
+            self._bot.remove_command(name)
+            del self._generated[name]
+
+        for name, schema in schemas.items():
+            definition = {"def": schema.get("def", {}), "roles": roles}
+            if self._generated.get(name) == definition:
+                continue
+            existing = self._bot.get_command(name)
+            if existing is not None and name not in self._generated:
+                logger.warning("Not generating '%s' as it is already a command", name)
+                continue
+            self._bot.remove_command(name)
+            callback = has_any_role(*roles)(_make_callback())
+            self._bot.add_command(Command(callback, name=name, **definition["def"]))
+            self._generated[name] = definition
+            logger.info("%s generated command: %s",
+                        "Added" if existing is None else "Replaced", name)
+
+    async def reload(self) -> None:
+        """ Reload and validate the lookups and sync the generated prefix and slash commands.
+        Raises ValueError if the new lookups are not valid, in which case the existing lookups and
+        commands are kept """
+        self._stat = self._file_stat()
+        load_lookups(validate=validate_lookups)
+        self.sync()
+        sync_slash_commands = getattr(self._bot, "sync_slash_commands", None)
+        if sync_slash_commands is not None:
+            await sync_slash_commands()
+
+    @staticmethod
+    def _file_stat() -> T.Optional[T.Tuple[int, int]]:
+        """ The modified time and size of the lookups file """
+        try:
+            stat = os.stat(get_lookup_path())
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def start_watching(self) -> None:
+        """ Start watching the lookups file for changes in a background task, if not already
+        running """
+        if self._task is not None and not self._task.done():
+            return
+        if self._stat is None:
+            self._stat = self._file_stat()
+        self._task = asyncio.create_task(self._watch(), name="lookups_watcher")
+
+    async def _watch(self) -> None:
+        """ Reload the lookups whenever the lookups file changes """
+        while True:
+            await asyncio.sleep(self._watch_interval)
+            stat = self._file_stat()
+            if stat is None or stat == self._stat:
+                continue
+            logger.info("Lookups file changed. Reloading")
+            try:
+                await self.reload()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Failed to reload lookups. Keeping existing lookups")
+
+
+def _make_callback() -> T.Callable[[Context], T.Coroutine[T.Any, T.Any, None]]:
+    """ A new callback for a generated command, so that each command holds its own checks """
+    async def generated(context: Context) -> None:
+        """ Reply with the response for this command from the lookups """
+        await _generated(context)
+    return generated
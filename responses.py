@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+""" Pre-compiled responses for the lookup driven commands of the faceswap Discord bot """
+from __future__ import annotations
+import logging
+import typing as T
+
+from discord import Embed
+
+from arguments import TaskMatcher
+from utils import get_lookups, merge_lookups
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+_RESPONSES: T.Optional[Responses] = None
+_GUILD_RESPONSES: T.Dict[int, Responses] = {}
+
+# Default schemas for the commands that are generated from the lookups. Any lookup entry that
+# contains a "kind" key is also generated, and keys in a lookup entry override these defaults.
+#   kind "message": reply with the lookup's "msg"
+#   kind "link": reply with a link to the url for the requested task. "link" and "message" are
+#   used when a task is given, "default_link" and "default_message" when it is not. A
+#   "default_link" of ``None`` does not reply without a task. Available placeholders are {url},
+#   {value} (the lookup value for the task), {task} (the title cased task) and {link}
+# Any lookup entry may contain "aliases", mapping alternative names to one of its task names. For
+# "faqs" the task names are the sections of the FAQ page.
+SCHEMAS: T.Dict[str, T.Dict[str, T.Any]] = {
+    "dfl": {"kind": "message"},
+    "log": {"kind": "message"},
+    "sysinfo": {"kind": "message"},
+    "forums": {"kind": "link",
+               "link": "{url}viewforum.php?f={value}",
+               "message": "You should check out the {task} section of our Forum at: {link}",
+               "default_link": "{url}index.php",
+               "default_message": "You should check out our Forum at: {link}"},
+    "guide": {"kind": "link",
+              "link": "{url}{value}",
+              "message": "There's a guide for {task} here: {link}",
+              "default_link": None},
+    "support": {"kind": "link",
+                "link": "{url}{value}",
+                "message": ("This question has been asked and answered in the {task} section "
+                            "of our Support Forum at: {link}"),
+                "default_link": "{url}3",
+                "default_message": ("This question has been asked and answered in our Support "
+                                    "Forum at: {link}")}}
+
+
+def get_schemas(lookup: T.Dict[str, T.Dict[str, T.Any]]) -> T.Dict[str, T.Dict[str, T.Any]]:
+    """ Return each command to be generated from the given lookups, mapped to its default schema
+    updated with the lookup entry """
+    return {command: {**SCHEMAS.get(command, {}), **val}
+            for command, val in lookup.items()
+            if isinstance(val, dict) and (command in SCHEMAS or "kind" in val)}
+
+
+def _compile_command(schema: T.Dict[str, T.Any]) -> T.Dict[T.Optional[str], T.Optional[Template]]:
+    """ Compile a generated command's schema into the template to send for each lower case task
+    name, with ``None`` for no task given """
+    if schema["kind"] == "message":
+        return {None: Template(schema["msg"])}
+
+    url = schema["url"]
+    retval: T.Dict[T.Optional[str], T.Optional[Template]] = {}
+    for task, value in schema["tasks"].items():
+        link = schema["link"].format(url=url, value=value)
+        retval[task.lower()] = Template(schema["message"].format(url=url,
+                                                                 value=value,
+                                                                 task=task.title(),
+                                                                 link=link))
+    default = schema.get("default_link")
+    if default is None:
+        retval[None] = None
+    else:
+        link = default.format(url=url)
+        retval[None] = Template(schema["default_message"].format(url=url, link=link))
+    return retval
+
+
+def validate_lookups(lookup: T.Dict[str, T.Any]) -> None:
+    """ Validate lookups prior to loading them, by compiling all of their responses, both as they
+    are and with each guild's overlay applied. Raises ``ValueError`` if they are not valid """
+    guilds = lookup.get("guilds", {})
+    if not isinstance(guilds, dict) or not all(isinstance(val, dict) for val in guilds.values()):
+        raise ValueError("Invalid lookups: guilds must be a dict of guild id to overlay dict")
+    _validate(lookup)
+    for guild_id, overlay in guilds.items():
+        try:
+            _validate(merge_lookups(lookup, overlay))
+        except ValueError as err:
+            raise ValueError(f"guild {guild_id}: {err}") from err
+
+
+def _validate(lookup: T.Dict[str, T.Any]) -> None:
+    """ Validate a single set of lookups """
+    try:
+        assert isinstance(lookup["global"]["token"], str), "global token must be a string"
+        assert isinstance(lookup["global"]["roles"], list), "global roles must be a list"
+        cache = lookup["global"].get("cache", {})
+        assert isinstance(cache, dict), "global cache must be a dict"
+        members = cache.get("members", "none")
+        assert members in ("all", "none") or isinstance(members, dict), \
+            "global cache members must be 'all', 'none' or a dict of member cache flags"
+        assert cache.get("max_messages") is None or cache["max_messages"] >= 0, \
+            "global cache max_messages must be null or a non-negative integer"
+        for command, schema in get_schemas(lookup).items():
+            assert schema["kind"] in ("message", "link"), f"{command}: unknown kind"
+            assert isinstance(schema.get("def", {}), dict), f"{command}: def must be a dict"
+        for command, val in lookup.items():
+            if not isinstance(val, dict):
+                continue
+            aliases = val.get("aliases", {})
+            assert isinstance(aliases, dict), f"{command}: aliases must be a dict"
+            throttle = val.get("throttle", {})
+            assert isinstance(throttle, dict), f"{command}: throttle must be a dict"
+            for bucket in ("channel", "user"):
+                setting = throttle.get(bucket)
+                if setting is not None:
+                    assert setting["rate"] > 0 and setting["per"] > 0, \
+                        f"{command}: throttle {bucket} rate and per must be positive"
+            if command == "faqs":
+                continue
+            tasks = {task.lower() for task in val.get("tasks", {})}
+            unknown = [alias for alias, task in aliases.items() if task.lower() not in tasks]
+            assert not unknown, f"{command}: aliases for unknown tasks: {unknown}"
+        Responses(0, lookup)
+    except (AssertionError, AttributeError, IndexError, KeyError, TypeError, ValueError) as err:
+        raise ValueError(f"Invalid lookups: {err!r}") from err
+
+
+class Template():
+    """ A message pre-formatted both for sending as is and for addressing to users, so that only
+    the at users prefix needs to be filled in at call time. Output is identical to
+    :func:`utils.format_message` """
+    __slots__ = ("_plain", "_addressed")
+
+    def __init__(self, message: str) -> None:
+        first, rest = message[:1], message[1:]
+        self._plain = first.upper() + rest
+        self._addressed = first.lower() + rest
+
+    def format(self, at_users: T.Optional[T.List[str]] = None) -> str:
+        """ Format the message with or without at_users """
+        if at_users:
+            return f"Hey {', '.join(at_users)}, {self._addressed}"
+        return self._plain
+
+
+class Responses():
+    """ The responses compiled from a single generation of the lookups """
+    def __init__(self, generation: int, lookup: T.Dict[str, T.Dict[str, T.Any]]) -> None:
+        self.generation = generation
+        self.templates = {command: Template(val["msg"])
+                          for command, val in lookup.items() if isinstance(val.get("msg"), str)}
+        self.matchers = {command: TaskMatcher(val["tasks"], val.get("aliases"))
+                         for command, val in lookup.items() if isinstance(val.get("tasks"), dict)}
+        self._faq_aliases = lookup.get("faqs", {}).get("aliases")
+        self._faq_matcher: T.Tuple[T.Optional[T.Dict[str, str]], T.Optional[TaskMatcher]] = (
+            None, None)
+        self.embeds = self._compile_embeds(lookup.get("donate", {}).get("tasks", {}))
+        self.schemas = get_schemas(lookup)
+        self.commands = {command: _compile_command(schema)
+                         for command, schema in self.schemas.items()}
+        logger.debug("Compiled responses (generation: %s, templates: %s, tasks: %s, "
+                     "commands: %s)", generation, list(self.templates), list(self.matchers),
+                     list(self.commands))
+
+    def faq_matcher(self, contents: T.Dict[str, str]) -> TaskMatcher:
+        """ Obtain the task matcher for the sections of the FAQ page. The matcher is compiled once
+        for each set of FAQ contents that the scraper publishes """
+        cached, matcher = self._faq_matcher
+        if cached is not contents or matcher is None:
+            matcher = TaskMatcher(contents, self._faq_aliases)
+            self._faq_matcher = (contents, matcher)
+        return matcher
+
+    @staticmethod
+    def _compile_embeds(donators: T.Dict[str, T.Dict[str, T.Any]]) -> T.Dict[str, Embed]:
+        """ Build the donation embeds, keyed by lower case task name """
+        content = {}
+        for key, val in donators.items():
+            kwargs = {"embed": {"title": val["title"], "type": "rich"},
+                      "author": {"name": val["name"], "icon_url": val["icon"]}}
+            if "url" in val:
+                kwargs["embed"]["url"] = val["url"]
+                kwargs["author"]["url"] = val["url"]
+            embed = Embed(**kwargs["embed"])
+            embed.set_thumbnail(url=val["thumbnail"])
+            embed.set_author(**kwargs["author"])
+
+            if val.get("fields", None) is not None:
+                for field in val["fields"]:
+                    embed.add_field(inline=False, **field)
+            content[key.lower()] = embed
+        return content
+
+
+def get_responses(guild_id: T.Optional[int] = None) -> Responses:
+    """ Obtain the responses for the currently loaded lookups, or for the given guild if it has an
+    overlay in the lookups. Responses are compiled once per call to :func:`utils.load_lookups` and
+    replaced in a single assignment """
+    global _RESPONSES  # pylint: disable=global-statement
+    generation, lookup = get_lookups(guild_id)
+    is_global = lookup is get_lookups()[1]
+    responses = _RESPONSES if is_global else _GUILD_RESPONSES.get(T.cast(int, guild_id))
+    if responses is None or responses.generation != generation:
+        responses = Responses(generation, lookup)
+        if is_global:
+            _RESPONSES = responses
+        else:
+            _GUILD_RESPONSES[T.cast(int, guild_id)] = responses
+        logger.info("Compiled responses for lookups generation %s (guild: %s)",
+                    generation, None if is_global else guild_id)
+    return responses
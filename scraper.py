@@ -1,114 +1,396 @@
 #!/usr/bin/env python3
 """ FAQ scraper for faceswap Discord bot """
 
+import asyncio
 import logging
-import urllib.request
+import os
+import pickle
+import sys
 
 from threading import Thread, Lock, Event
-from time import sleep
+from types import MappingProxyType
 
 import lxml.html as LH
 
+from lxml import etree
+
+from fetcher import Fetcher
+from instance import get_data_path
+from metrics import METRICS
+from search_index import SearchIndex
+from utils import try_lock_file
+
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+_SNAPSHOT_VERSION = 2
+
+
+class _Frozen():
+    """ Base for objects whose attributes can only be set on creation """
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+
+class FAQEntry(_Frozen):
+    """ A single question and answer from the FAQ page """
+    __slots__ = ("tag", "question", "answer")
+
+    def __init__(self, tag, question, answer):
+        object.__setattr__(self, "tag", sys.intern(tag))
+        object.__setattr__(self, "question", question)
+        object.__setattr__(self, "answer", answer)
+
+    def __reduce__(self):
+        return (self.__class__, (self.tag, self.question, self.answer))
+
+
+class FAQSnapshot(_Frozen):
+    """ The FAQs parsed from a single scrape. Snapshots are never modified, so a new snapshot is
+        published by replacing the reference to the old one and can be read without a lock
+
+        contents maps the section names to the link to the section, entries maps the FAQ
+        anchor tags to their :class:`FAQEntry` and index is the finalized search index over the
+        entries """
+    __slots__ = ("contents", "entries", "index")
+
+    def __init__(self, contents=None, entries=None, index=None):
+        if index is None:
+            index = SearchIndex()
+            index.finalize()
+        object.__setattr__(self, "contents",
+                           MappingProxyType({sys.intern(key): val
+                                             for key, val in (contents or {}).items()}))
+        object.__setattr__(self, "entries", MappingProxyType(dict(entries or {})))
+        object.__setattr__(self, "index", index)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self.contents), dict(self.entries), self.index))
+
+    def search(self, search_term, limit=None):
+        """ Search the FAQs for a term and return the tags with the questions, best match
+            first. Returns at most limit results if limit is not None """
+        entries = self.entries
+        return {key: entries[key].question
+                for key, _ in self.index.search(search_term, limit=limit)}
+
+
+class FAQParser():
+    """ Parses the FAQ page incrementally as its bytes are fed in, collecting the contents and
+        entries. Each FAQ list is processed as soon as it has been read and is then discarded,
+        so the document tree is never held in memory. The search index is only built on
+        :func:`close`, so a page that turns out to be unchanged costs no indexing """
+    def __init__(self):
+        self._parser = etree.HTMLPullParser(events=("end", ), tag="dl")
+        self._parser.set_element_class_lookup(LH.HtmlElementClassLookup())
+        self.contents = {}
+        self.entries = {}
+
+    def feed(self, data):
+        """ Parse the next chunk of the page """
+        self._parser.feed(data)
+        self._read_events()
+
+    def close(self):
+        """ Finish parsing the page and return the parsed :class:`FAQSnapshot` """
+        self._parser.close()
+        self._read_events()
+        index = SearchIndex.from_documents({tag: (entry.question, entry.answer)
+                                            for tag, entry in self.entries.items()})
+        logger.info("Parsed FAQs (sections: %s, faqs: %s)", len(self.contents), len(self.entries))
+        return FAQSnapshot(self.contents, self.entries, index)
+
+    def _read_events(self):
+        """ Process and discard each list that has been fully read """
+        for _, item in self._parser.read_events():
+            if item.get("class") == "faq" and len(item):
+                self._add(item)
+            item.clear(keep_tail=True)
+            parent = item.getparent()
+            if parent is not None:
+                while item.getprevious() is not None:
+                    del parent[0]
+
+    def _add(self, item):
+        """ Add a FAQ list to the contents if it is a section heading with a link to the
+            first item in the section, otherwise to the entries """
+        children = item.getchildren()
+        if not children[0].items():
+            heading = children[0].text_content().replace("\t",
+                                                         "").lower().replace("ation",
+                                                                             "").replace("ing", "")
+            link = list(children[1].iterlinks())[0][2]
+            self.contents[heading] = link
+            return
+        tag = f"#{children[0].items()[0][1]}"
+        if tag in self.entries:
+            logger.debug("Skipping duplicate FAQ: %s", tag)
+            return
+        faq = [child.text_content().replace("\t", "") for child in children]
+        entry = FAQEntry(tag, faq[0], "\n".join(faq[1:]))
+        self.entries[entry.tag] = entry
+
+
+def parse_faq_page(html, chunk_size=65536):
+    """ Parse a complete FAQ page, returning its :class:`FAQSnapshot` """
+    parser = FAQParser()
+    for idx in range(0, len(html), chunk_size):
+        parser.feed(html[idx:idx + chunk_size])
+    return parser.close()
 
 
 class FAQs():
-    """ Scrapes the FAQ section every given hours and stores data in dictionaries """
-    def __init__(self, scrape_interval=24):
-        self.url = "https://faceswap.dev/forum/app.php/faqpage"
+    """ Scrapes the FAQ section every given hours and publishes the result as a snapshot
+
+        When several bot processes share a snapshot path, only the process holding the
+        snapshot's lock file scrapes. The other processes follow, loading each snapshot that
+        the scraping process saves, and take over scraping if that process exits """
+    def __init__(self, scrape_interval=24, retry_interval=15,
+                 url="https://faceswap.dev/forum/app.php/faqpage", snapshot_path=None,
+                 follow_interval=30):
+        self.url = url
+        self.snapshot_path = (get_data_path("faq_cache.pickle") if snapshot_path is None
+                              else snapshot_path)
         self.loaded = Event()
         self.refresh = Event()
-        self.interval = scrape_interval * 86400
+        self.interval = scrape_interval * 3600
+        self.retry_interval = retry_interval * 60
+        self.follow_interval = follow_interval
+        self.fetcher = Fetcher()
         self.lock = Lock()
-        self._contents = {}
-        self._search_dict = {}
-        thread = Thread(target=self.get_faqs, daemon=True, args=(self.loaded, self.refresh))
-        thread.start()
+        self._snapshot = FAQSnapshot()
+        self._waiters = []
+        self._loaded_waiters = []
+        self._thread = None
+        self._leader_lock = None
+
+    def start(self):
+        """ Load any saved snapshot and start scraping, or following the scraping process, in
+            a background thread. Returns immediately, :attr:`loaded` is set once the first FAQs
+            are available """
+        if self._thread is not None:
+            return
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def is_leader(self):
+        """ bool: True if this process scrapes the FAQs, False if it follows the snapshots
+            saved by another process """
+        return self._leader_lock is not None
+
+    def _run(self):
+        """ Load any saved snapshot, follow the snapshots until this process takes the lock,
+            then scrape """
+        with METRICS.timer("scraper_seconds", stage="load_snapshot"):
+            self.load_snapshot()
+        self._leader_lock = try_lock_file(f"{self.snapshot_path}.lock")
+        if self._leader_lock is None:
+            logger.info("Following FAQ snapshots saved by another process: %s",
+                        self.snapshot_path)
+            self.follow_snapshots(self.refresh)
+        logger.info("Scraping FAQs")
+        self.get_faqs(self.loaded, self.refresh)
+
+    def _snapshot_stat(self):
+        """ The modified time and size of the snapshot file, or None if it does not exist """
+        try:
+            stat = os.stat(self.snapshot_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def follow_snapshots(self, refresh_event):
+        """ Load the snapshot whenever the scraping process replaces it. Checks every
+            self.follow_interval seconds or immediately when refresh_event is set, and returns
+            once this process has taken the lock """
+        stat = self._snapshot_stat()
+        while True:
+            refresh_event.wait(self.follow_interval)
+            with self.lock:
+                refresh_event.clear()
+                waiters, self._waiters = self._waiters, []
+            current = self._snapshot_stat()
+            if current is not None and current != stat:
+                stat = current
+                self.load_snapshot()
+            self._notify(waiters)
+            self._leader_lock = try_lock_file(f"{self.snapshot_path}.lock")
+            if self._leader_lock is not None:
+                return
+
+    @property
+    def snapshot(self):
+        """ :class:`FAQSnapshot`: The current FAQs """
+        return self._snapshot
 
     @property
     def contents(self):
-        """ Return contents dict, locked """
-        with self.lock:
-            return self._contents
+        """ Return the current contents mapping """
+        return self._snapshot.contents
 
     @property
-    def search_dict(self):
-        """ Return search dict, locked """
-        with self.lock:
-            return self._search_dict
+    def entries(self):
+        """ Return the current mapping of FAQ tag to :class:`FAQEntry` """
+        return self._snapshot.entries
 
     def get_faqs(self, loaded_event, refresh_event):
         """ Gets the faq web contents and parses it into the dictionaries
-            runs in a background thread and runs automatically every self.interval seconds
+            runs in a background thread and runs automatically every self.interval seconds or
+            immediately when refresh_event is set. Failed scrapes are retried every
+            self.retry_interval seconds
         """
         while True:
-            html = self.scrape_website()
-            doc = LH.fromstring(html)
-            self.set_contents(doc)
-            self.set_search_dict(doc)
-            refresh_event.clear()
-            loaded_event.set()
-            for _ in range(self.interval):
-                if refresh_event.is_set():
-                    break
-                sleep(60)
+            with self.lock:
+                refresh_event.clear()
+                waiters, self._waiters = self._waiters, []
+            try:
+                self.update()
+            except Exception as err:  # pylint: disable=broad-except
+                logger.exception("Failed to update FAQs")
+                self._notify(waiters, err)
+                refresh_event.wait(self.retry_interval)
+                continue
+            if loaded_event is self.loaded:
+                self._set_loaded()
+            else:
+                loaded_event.set()
+            self._notify(waiters)
+            refresh_event.wait(self.interval)
+
+    def update(self):
+        """ Scrape the website and swap in the parsed FAQs if they have changed. The page is
+            parsed as it is downloaded, so fetch and parse are timed together """
+        with METRICS.timer("scraper_seconds", stage="fetch_parse"):
+            parser = self.scrape_website()
+        if parser is None:
+            logger.info("FAQs unchanged")
+            return
+        self.set_faqs(parser.close())
+        self.save_snapshot()
+
+    def set_faqs(self, snapshot):
+        """ Publish the given :class:`FAQSnapshot` with a single reference swap """
+        self._snapshot = snapshot
+        logger.info("Set FAQs (sections: %s, faqs: %s)", len(snapshot.contents), len(snapshot))
+
+    def load_snapshot(self):
+        """ Load the last saved FAQs from disk so they can be served before the first scrape
+            completes. Missing, corrupt or out of date snapshots are ignored """
+        try:
+            with open(self.snapshot_path, "rb") as snapshot_file:
+                snapshot = pickle.load(snapshot_file)
+            if snapshot.get("version") != _SNAPSHOT_VERSION or snapshot.get("url") != self.url:
+                logger.info("Ignoring out of date FAQ snapshot: %s", self.snapshot_path)
+                return
+            faqs = snapshot["snapshot"]
+            validators = snapshot["validators"]
+        except FileNotFoundError:
+            logger.info("No FAQ snapshot found: %s", self.snapshot_path)
+            return
+        except Exception:  # pylint: disable=broad-except
+            logger.warning("Ignoring unreadable FAQ snapshot: %s", self.snapshot_path,
+                           exc_info=True)
+            return
+        self._snapshot = faqs
+        self.fetcher.validators = validators
+        self._set_loaded()
+        logger.info("Loaded FAQ snapshot: %s (faqs: %s)", self.snapshot_path, len(faqs))
+
+    def save_snapshot(self):
+        """ Atomically write the current FAQs to disk for a fast restart """
+        snapshot = {"version": _SNAPSHOT_VERSION,
+                    "url": self.url,
+                    "snapshot": self._snapshot,
+                    "validators": {self.url: self.fetcher.validators.get(self.url, {})}}
+        temp_path = f"{self.snapshot_path}.tmp"
+        try:
+            with open(temp_path, "wb") as snapshot_file:
+                pickle.dump(snapshot, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.snapshot_path)
+        except OSError:
+            logger.warning("Unable to save FAQ snapshot: %s", self.snapshot_path, exc_info=True)
+            return
+        logger.info("Saved FAQ snapshot: %s", self.snapshot_path)
+
+    def _set_loaded(self):
+        """ Set :attr:`loaded` and wake any coroutines awaiting :func:`wait_loaded` """
+        with self.lock:
+            self.loaded.set()
+            waiters, self._loaded_waiters = self._loaded_waiters, []
+        self._notify(waiters)
+
+    @staticmethod
+    def _notify(waiters, exception=None):
+        """ Wake any coroutines awaiting :func:`reload` or :func:`wait_loaded` from their
+            event loops """
+        def resolve(future):
+            if future.done():
+                return
+            if exception is None:
+                future.set_result(True)
+            else:
+                future.set_exception(exception)
+
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(resolve, future)
 
     def scrape_website(self):
-        """ Scrape the website for latest faqs """
+        """ Scrape the website for latest faqs, parsing the page as it is read. Returns the
+            :class:`FAQParser` that the page was fed to or None if the FAQs have not changed
+            since the last scrape """
         logger.info("Getting HTML")
-        with urllib.request.urlopen(self.url) as rsp:
-            response = rsp.read()
+        if not self.loaded.is_set():
+            # Nothing has been loaded, so make a full fetch that records fresh validators
+            self.fetcher.validators.pop(self.url, None)
+        response = asyncio.run(self.fetcher.stream(self.url, FAQParser))
         logger.info("Returned HTML")
         return response
 
-    def set_contents(self, doc):
-        """ Parse the contents section to get the links to the
-            first item in each section """
-        contents = {}
-        index = [item for item in doc.xpath("//dl[@class='faq']") if not item[0].items()]
-        for item in index:
-            children = item.getchildren()
-            heading = children[0].text_content().replace("\t",
-                                                         "").lower().replace("ation",
-                                                                             "").replace("ing", "")
-            link = list(children[1].iterlinks())[0][2]
-            contents[heading] = link
-        with self.lock:
-            self._contents = contents
-        logger.info("Set contents: %s", self.contents)
-
-    def set_search_dict(self, doc):
-        """ Parse the FAQS section to build a search dict """
-        search_dict = {}
-        faqs = [item for item in doc.xpath("//dl[@class='faq']") if item[0].items()]
-        for item in faqs:
-            tag = f"#{item[0].items()[0][1]}"
-            faq = [child.text_content().replace("\t", "") for child in item.getchildren()]
-            search_dict[tag] = faq
+    def search(self, search_term, limit=None):
+        """ Search the FAQs for a term and return the tags with the questions, best match
+            first. Returns at most limit results if limit is not None """
+        return self._snapshot.search(search_term, limit=limit)
+
+    async def wait_loaded(self, timeout=None):
+        """ Wait without blocking the event loop until the first FAQs are available, for at
+            most timeout seconds if timeout is not None. Returns True if the FAQs are loaded """
+        if self.loaded.is_set():
+            return True
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (loop, future)
         with self.lock:
-            self._search_dict = search_dict
-        logger.info("Set search_dict")
-
-    def search(self, search_term):
-        """ Search the search dict for a term and return the tag with the question """
-        search_term = search_term.lower()
-        results = {}
-        for key, val in self.search_dict.items():
-            search_text = " ".join(val).lower()
-            if search_text.count(search_term) > 0:
-                results[key] = val[0]
-        return results
-
-    def refresh_cache(self):
-        """ Refresh the cache """
-        self.loaded.clear()
-        self.refresh.set()
-        while True:
-            # Wait for FAQ Cache
             if self.loaded.is_set():
-                break
-            sleep(1)
+                return True
+            self._loaded_waiters.append(waiter)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self.lock:
+                if waiter in self._loaded_waiters:
+                    self._loaded_waiters.remove(waiter)
         return True
 
+    async def reload(self):
+        """ Request an immediate re-scrape of the FAQs and wait for it to complete without
+            blocking the event loop. The current FAQs continue to be served until the new ones
+            are swapped in. Raises the scraper's exception if the re-scrape fails. A process that
+            follows another process's snapshots loads the latest snapshot instead """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.lock:
+            self._waiters.append((loop, future))
+            self.refresh.set()
+        await future
+
 
 faq_cache = FAQs()  # pylint: disable=invalid-name
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+""" Inverted index with BM25 ranking for searching the faceswap FAQs """
+from __future__ import annotations
+import heapq
+import logging
+import math
+import re
+import typing as T
+
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+_TOKEN = re.compile(r"\w+")
+_QUERY = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def tokenize(text: str) -> T.List[str]:
+    """ Split the given text into lower case word tokens """
+    return _TOKEN.findall(text.lower())
+
+
+class SearchIndex():
+    """ Token level inverted index over the FAQ entries, ranked with BM25. The first field of each
+    document is the question, whose terms are weighted higher. Bare query terms must all match and
+    also match the indexed terms they prefix. "Quoted phrases" must match as consecutive terms """
+    def __init__(self,
+                 k1: float = 1.2,
+                 b: float = 0.75,
+                 title_weight: int = 2,
+                 max_expansions: int = 50) -> None:
+        self._k1 = k1
+        self._b = b
+        self._title_weight = title_weight
+        self._max_expansions = max_expansions
+
+        self._keys: T.List[str] = []
+        self._postings: T.Dict[str, T.Dict[int, T.Tuple[int, ...]]] = {}
+        self._impacts: T.Dict[str, T.Dict[int, float]] = {}
+        self._title_lengths: T.List[int] = []
+        self._doc_lengths: T.List[int] = []
+        self._vocab: T.List[str] = []
+        self._avg_length = 0.0
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, key: str, fields: T.Sequence[str]) -> None:
+        """ Add a document's text fields to the index under the key to return in search results.
+        The first field is treated as the title. :func:`finalize` must be called once all documents
+        have been added """
+        doc_id = len(self._keys)
+        self._keys.append(key)
+        title = tokenize(fields[0]) if fields else []
+        tokens = title + [tok for field in fields[1:] for tok in tokenize(field)]
+        positions: T.Dict[str, T.List[int]] = {}
+        for pos, token in enumerate(tokens):
+            positions.setdefault(token, []).append(pos)
+        postings = self._postings
+        for token, token_positions in positions.items():
+            postings.setdefault(token, {})[doc_id] = tuple(token_positions)
+        self._title_lengths.append(len(title))
+        self._doc_lengths.append(len(tokens) + len(title) * (self._title_weight - 1))
+
+    def finalize(self) -> None:
+        """ Build the sorted vocabulary and pre-compute the BM25 score of every posting once all
+        documents have been added """
+        self._vocab = sorted(self._postings)
+        self._avg_length = (sum(self._doc_lengths) / len(self._doc_lengths)
+                            if self._doc_lengths else 0.0)
+        avg_length = self._avg_length or 1.0
+        norms = [1.0 - self._b + self._b * length / avg_length for length in self._doc_lengths]
+        self._impacts = {term: self._term_scores(term, norms) for term in self._vocab}
+        logger.debug("Finalized search index (documents: %s, terms: %s)",
+                     len(self._keys), len(self._vocab))
+
+    @classmethod
+    def from_documents(cls, documents: T.Mapping[str, T.Sequence[str]],
+                       **kwargs) -> SearchIndex:
+        """ Build a finalized index from a dictionary of key to document fields """
+        index = cls(**kwargs)
+        for key, fields in documents.items():
+            index.add(key, fields)
+        index.finalize()
+        return index
+
+    def _expand(self, term: str) -> T.List[T.Tuple[str, float]]:
+        """ Obtain the indexed terms that match a query term, with their weighting """
+        terms = [(term, 1.0)] if term in self._postings else []
+        idx = bisect_left(self._vocab, term)
+        while idx < len(self._vocab) and len(terms) < self._max_expansions:
+            candidate = self._vocab[idx]
+            if not candidate.startswith(term):
+                break
+            if candidate != term:
+                terms.append((candidate, 0.5))
+            idx += 1
+        return terms
+
+    def _term_scores(self, term: str, norms: T.List[float]) -> T.Dict[int, float]:
+        """ BM25 score of a single indexed term for every document containing it, given each
+        document's length normalization """
+        postings = self._postings[term]
+        num_docs = len(self._keys)
+        idf = math.log(1.0 + (num_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+        k1 = self._k1
+        extra = self._title_weight - 1
+        title_lengths = self._title_lengths
+        retval = {}
+        for doc_id, positions in postings.items():
+            # Positions are ascending, so the title occurrences are those before the title end
+            freq = len(positions) + extra * bisect_left(positions, title_lengths[doc_id])
+            retval[doc_id] = idf * freq * (k1 + 1.0) / (freq + k1 * norms[doc_id])
+        return retval
+
+    def _match_term(self, term: str) -> T.Dict[int, float]:
+        """ Score all documents matching a bare query term, including prefix matches """
+        expansions = self._expand(term)
+        if len(expansions) == 1 and expansions[0][1] == 1.0:
+            return self._impacts[term]
+        scores: T.Dict[int, float] = {}
+        for candidate, weight in expansions:
+            for doc_id, score in self._impacts[candidate].items():
+                scores[doc_id] = scores.get(doc_id, 0.0) + score * weight
+        return scores
+
+    def _match_phrase(self, terms: T.List[str]) -> T.Dict[int, float]:
+        """ Score all documents containing the given terms as consecutive tokens """
+        if any(term not in self._postings for term in terms):
+            return {}
+        postings = [self._postings[term] for term in terms]
+        candidates = set.intersection(*(set(posting) for posting in postings))
+        matches = []
+        for doc_id in candidates:
+            following = [set(posting[doc_id]) for posting in postings[1:]]
+            if any(all(start + idx + 1 in positions for idx, positions in enumerate(following))
+                   for start in postings[0][doc_id]):
+                matches.append(doc_id)
+        return {doc_id: sum(self._impacts[term][doc_id] for term in terms) for doc_id in matches}
+
+    def search(self, query: str, limit: T.Optional[int] = None) -> T.List[T.Tuple[str, float]]:
+        """ Search the index, returning at most limit (key, score) tuples, best match first. Double
+        quoted sections of the query are matched as phrases """
+        groups: T.List[T.Dict[int, float]] = []
+        for phrase, word in _QUERY.findall(query):
+            tokens = tokenize(phrase if phrase else word)
+            if not tokens:
+                continue
+            if phrase and len(tokens) > 1:
+                groups.append(self._match_phrase(tokens))
+            else:
+                groups.extend(self._match_term(token) for token in tokens)
+        if not groups or not all(groups):
+            return []
+
+        groups.sort(key=len)
+        scores = groups[0]
+        for group in groups[1:]:
+            scores = {doc_id: score + group[doc_id]
+                      for doc_id, score in scores.items() if doc_id in group}
+            if not scores:
+                return []
+
+        if limit is None or limit >= len(scores):
+            ranked = sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+        else:
+            ranked = heapq.nsmallest(limit, scores.items(), key=lambda x: (-x[1], x[0]))
+        return [(self._keys[doc_id], score) for doc_id, score in ranked]
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+""" Slash commands for faceswap Discord bot
+
+The lookup driven commands (donate, faqs, search, tag and the commands generated from the
+lookups) are also exposed as slash commands, and nobot as a message context menu command. Task
+and FAQ autocomplete is served from the compiled lookups and the FAQ cache held in memory. A
+slash command replies through its interaction response, so an invocation is a single request to
+Discord, with no command message to delete or replied to message to fetch.
+
+The command tree is only synced with Discord when the commands that it holds change, as syncing
+is rate limited.
+"""
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import typing as T
+
+from contextlib import contextmanager
+from time import perf_counter
+
+import discord
+from discord import app_commands
+
+from commands import (donate_reply, faqs_reply, faqs_search_reply, search_reply, tag_reply,
+                      NOBOT_MESSAGE)
+from deletions import DELETIONS
+from instance import get_data_path
+from log_tools import set_log_context
+from metrics import METRICS
+from outbound import Reply
+from responses import get_responses
+from scraper import faq_cache
+from throttle import THROTTLE
+from utils import format_message, get_def, get_lookups, get_roles
+
+if T.TYPE_CHECKING:
+    from commands import FSBot
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+_MAX_CHOICES = 25
+_MAX_NAME = 100
+
+
+@contextmanager
+def _invoked(interaction: discord.Interaction) -> T.Generator[str, None, None]:
+    """ Set the log context for an invoked slash command, log the call and record its latency
+    and outcome in the metrics and the log. Yields the command name """
+    assert interaction.command is not None
+    name = interaction.command.name
+    set_log_context(command=name,
+                    channel_id=interaction.channel_id,
+                    user_id=interaction.user.id,
+                    interaction_id=interaction.id)
+    logger.info("command: %s", name)
+    start = perf_counter()
+    status = "error"
+    try:
+        yield name
+        status = "ok"
+    finally:
+        elapsed = perf_counter() - start
+        METRICS.observe("command_seconds", elapsed, command=name)
+        METRICS.increment("commands_total", command=name, status=status)
+        set_log_context(status=status, seconds=round(elapsed, 6))
+        logger.info("Command complete (status: %s, seconds: %.3f)", status, elapsed)
+
+
+async def _send(interaction: discord.Interaction,
+                reply: T.Union[Reply, str],
+                ephemeral: bool = False) -> T.Optional[int]:
+    """ Send a reply through the interaction response, or as follow ups if the response has
+    been deferred or the reply needs more than one message. Returns the id of the response
+    message, if known """
+    messages = (Reply(reply) if isinstance(reply, str) else reply).messages()
+    message_id = None
+    if not interaction.response.is_done():
+        response = await interaction.response.send_message(**messages.pop(0),
+                                                           ephemeral=ephemeral)
+        message_id = response.message_id
+    elif (ephemeral
+          and interaction.response.type is discord.InteractionResponseType.deferred_channel_message
+          and not interaction.extras.get("followed_up")):
+        # The first follow up to a public deferral replaces its placeholder and ignores
+        # ephemeral, so the placeholder is removed to keep the reply private
+        await interaction.delete_original_response()
+    for kwargs in messages:
+        await interaction.followup.send(**kwargs, ephemeral=ephemeral)
+        interaction.extras["followed_up"] = True
+    return message_id
+
+
+async def _allowed(interaction: discord.Interaction,
+                   task: T.Optional[T.Hashable],
+                   at_users: T.List[str]) -> bool:
+    """ Check the throttle, telling the user privately if the reply has been dropped """
+    if THROTTLE.allow(interaction, task, at_users):
+        return True
+    await _send(interaction,
+                "That has just been answered, or has been asked too often. Please try again "
+                "later", ephemeral=True)
+    return False
+
+
+def _at_users(user: T.Optional[discord.abc.User]) -> T.List[str]:
+    """ The mention of the user that a reply is addressed to """
+    return [] if user is None else [user.mention]
+
+
+def _choices(names: T.Iterable[str], current: str) -> T.List[app_commands.Choice[str]]:
+    """ Autocomplete choices for the names that contain the text typed so far, names that start
+    with the text first """
+    current = current.lower().strip()
+    matches = sorted((name for name in names if current in name.lower()),
+                     key=lambda name: (not name.lower().startswith(current), name))
+    return [app_commands.Choice(name=name[:_MAX_NAME], value=name)
+            for name in matches[:_MAX_CHOICES]]
+
+
+# AUTOCOMPLETE
+async def _task_autocomplete(interaction: discord.Interaction,
+                             current: str) -> T.List[app_commands.Choice[str]]:
+    """ The tasks of the invoked command from the lookups """
+    assert interaction.command is not None
+    lookup = get_lookups(interaction.guild_id)[1].get(interaction.command.name, {})
+    return _choices(lookup.get("tasks", {}), current)
+
+
+async def _faqs_autocomplete(interaction: discord.Interaction,
+                             current: str) -> T.List[app_commands.Choice[str]]:
+    """ The FAQ sections starting with the text typed so far, followed by the FAQ questions
+    found by searching the FAQs for it """
+    snapshot = faq_cache.snapshot
+    choices = _choices(snapshot.contents, current)
+    if len(current.strip()) >= 3 and len(choices) < _MAX_CHOICES:
+        results = snapshot.search(current, limit=_MAX_CHOICES - len(choices))
+        choices.extend(app_commands.Choice(name=question[:_MAX_NAME], value=tag)
+                       for tag, question in results.items())
+    return choices
+
+
+# CALLBACKS
+@app_commands.describe(task="The task to reply about", user="The user to address the reply to")
+async def _generated(interaction: discord.Interaction,
+                     task: T.Optional[str] = None,
+                     user: T.Optional[discord.Member] = None) -> None:
+    """ Reply with the compiled response for a generated command and the requested task """
+    with _invoked(interaction) as name:
+        responses = get_responses(interaction.guild_id)
+        matcher = responses.matchers.get(name)
+        resolved = None if task is None or matcher is None else matcher.match(task)
+        set_log_context(task=resolved)
+        # The command may have been removed from the lookups before the slash commands synced
+        template = responses.commands.get(name, {}).get(resolved)
+        if template is None:
+            await _send(interaction, "Please choose one of the tasks", ephemeral=True)
+            return
+        if await _allowed(interaction, resolved, _at_users(user)):
+            await _send(interaction, template.format(_at_users(user)))
+
+
+@app_commands.describe(dev="The dev to donate to", user="The user to address the reply to")
+async def _donate(interaction: discord.Interaction,
+                  dev: T.Optional[str] = None,
+                  user: T.Optional[discord.Member] = None) -> None:
+    """ Display donation messages """
+    with _invoked(interaction):
+        responses = get_responses(interaction.guild_id)
+        donatee = None if dev is None else responses.matchers["donate"].match(dev)
+        set_log_context(task=donatee)
+        if await _allowed(interaction, donatee, _at_users(user)):
+            await _send(interaction, donate_reply(responses, donatee, _at_users(user)))
+
+
+async def _donate_autocomplete(interaction: discord.Interaction,
+                               current: str) -> T.List[app_commands.Choice[str]]:
+    """ The donation tasks from the compiled lookups """
+    return _choices(get_responses(interaction.guild_id).embeds, current)
+
+
+@app_commands.describe(query="A FAQ section, or words to search the FAQs for",
+                       user="The user to address the reply to")
+async def _faqs(interaction: discord.Interaction,
+                query: T.Optional[str] = None,
+                user: T.Optional[discord.Member] = None) -> None:
+    """ Link to FAQs. The response is deferred while the first FAQs are loading """
+    with _invoked(interaction):
+        lookup = get_lookups(interaction.guild_id)[1]["faqs"]
+        if not faq_cache.loaded.is_set():
+            await interaction.response.defer()
+            if not await faq_cache.wait_loaded(timeout=lookup.get("ready_timeout", 10)):
+                await _send(interaction, "The FAQs are still loading. Please try again in a "
+                            "moment", ephemeral=True)
+                return
+        at_users = _at_users(user)
+        snapshot = faq_cache.snapshot
+        task = None if query is None else get_responses(
+            interaction.guild_id).faq_matcher(snapshot.contents).match(query)
+        if query is None or task is not None:
+            set_log_context(task=task)
+            if await _allowed(interaction, task, at_users):
+                await _send(interaction, faqs_reply(lookup, task, at_users))
+            return
+
+        entry = snapshot.entries.get(query)
+        if entry is not None:  # A question picked from autocomplete
+            results, term = {entry.tag: entry.question}, entry.question
+        else:
+            with METRICS.timer("phase_seconds", phase="faq_search"):
+                results, term = snapshot.search(query, limit=lookup["results"]), query
+        set_log_context(search_term=term)
+        if not await _allowed(interaction, ("search", term) if results else None, at_users):
+            return
+        await _send(interaction, (faqs_search_reply(lookup, results, term, at_users) if results
+                                  else faqs_reply(lookup, None, at_users)))
+
+
+@app_commands.describe(terms="The words to search the forum for",
+                       user="The user to address the reply to")
+async def _search(interaction: discord.Interaction,
+                  terms: str,
+                  user: T.Optional[discord.Member] = None) -> None:
+    """ Search the forum """
+    with _invoked(interaction):
+        lookup = get_lookups(interaction.guild_id)[1]["search"]
+        words = terms.split()
+        if await _allowed(interaction, " ".join(words).lower(), _at_users(user)):
+            await _send(interaction, search_reply(lookup, words, _at_users(user)))
+
+
+@app_commands.describe(tag="The forum tag", user="The user to address the reply to")
+async def _tag(interaction: discord.Interaction,
+               tag: str,
+               user: T.Optional[discord.Member] = None) -> None:
+    """ Link to the forum threads with a tag """
+    with _invoked(interaction):
+        lookup = get_lookups(interaction.guild_id)[1]["tag"]
+        m_tag = tag.strip().split()[0] if tag.strip() else tag
+        set_log_context(task=m_tag.lower())
+        if await _allowed(interaction, m_tag.lower(), _at_users(user)):
+            await _send(interaction, tag_reply(lookup, m_tag, _at_users(user)))
+
+
+async def _nobot(interaction: discord.Interaction, message: discord.Message) -> None:
+    """ Delete the selected message and notify its author that we are not a bot """
+    with _invoked(interaction):
+        logger.info("Original Message: %s", message.id)
+        DELETIONS.delete(message)
+        message_id = await _send(interaction,
+                                 format_message(NOBOT_MESSAGE, [message.author.mention]))
+        if message_id is not None and interaction.channel_id is not None:
+            DELETIONS.schedule(interaction.channel_id, message_id, delay=300)
+
+
+class SlashCommands():
+    """ Adds the slash commands to a bot's command tree and syncs the tree with Discord when the
+    commands change. The last synced commands are recorded at path, by default `app_commands.json`
+    next to the lookups """
+    def __init__(self, bot: FSBot, path: T.Optional[str] = None) -> None:
+        self._bot = bot
+        self._path = get_data_path("app_commands.json") if path is None else path
+        bot.tree.error(self._on_error)
+        bot.slash = self
+
+    @staticmethod
+    def _description(definition: T.Dict[str, T.Any], name: str) -> str:
+        """ The description of a slash command, from the help in its definition """
+        text = definition.get("help") or definition.get("brief") or f"The {name} command"
+        return text[:_MAX_NAME]
+
+    def build(self) -> None:
+        """ Replace the commands in the tree with the slash commands for the current lookups """
+        tree = self._bot.tree
+        tree.clear_commands(guild=None)
+        roles = get_roles()
+        commands: T.List[T.Union[app_commands.Command, app_commands.ContextMenu]] = []
+
+        for name, callback, autocomplete in (("donate", _donate, ("dev", _donate_autocomplete)),
+                                             ("faqs", _faqs, ("query", _faqs_autocomplete)),
+                                             ("search", _search, None),
+                                             ("tag", _tag, None)):
+            command = app_commands.Command(name=name,
+                                           description=self._description(get_def(name), name),
+                                           callback=callback)
+            if autocomplete is not None:
+                command.autocomplete(autocomplete[0])(autocomplete[1])
+            commands.append(command)
+
+        for name, schema in get_responses().schemas.items():
+            command = app_commands.Command(name=name,
+                                           description=self._description(schema.get("def", {}),
+                                                                         name),
+                                           callback=_generated)
+            command.autocomplete("task")(_task_autocomplete)
+            commands.append(command)
+
+        commands.append(app_commands.ContextMenu(name="Not a bot server", callback=_nobot))
+        for command in commands:
+            app_commands.checks.has_any_role(*roles)(command)
+            tree.add_command(command)
+
+    def _digest(self) -> str:
+        """ A digest of the commands in the tree, as they are sent to Discord """
+        tree = self._bot.tree
+        payload = [command.to_dict(tree) for command in tree.get_commands()]
+        return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    async def sync(self) -> None:
+        """ Rebuild the slash commands from the current lookups, and sync them with Discord if
+        they have changed since they were last synced """
+        self.build()
+        digest = self._digest()
+        try:
+            with open(self._path, "r", encoding="utf-8") as synced:
+                previous = json.load(synced).get("digest")
+        except (OSError, ValueError):
+            previous = None
+        if digest == previous:
+            logger.info("Slash commands unchanged")
+            return
+        synced_commands = await self._bot.tree.sync()
+        with open(self._path, "w", encoding="utf-8") as synced:
+            json.dump({"digest": digest}, synced)
+        logger.info("Synced slash commands: %s", [command.name for command in synced_commands])
+
+    @staticmethod
+    async def _on_error(interaction: discord.Interaction,
+                        error: app_commands.AppCommandError) -> None:
+        """ Tell the user privately when they may not use a command, and log any other error """
+        if isinstance(error, app_commands.CheckFailure):
+            logger.info("Slash command check failed: %s", error)
+            msg = "You do not have permission to use this command"
+        else:
+            logger.error("Slash command failed", exc_info=error)
+            msg = "Something went wrong. Please try again later"
+        if not interaction.response.is_done():
+            await interaction.response.send_message(msg, ephemeral=True)
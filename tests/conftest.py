@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+""" Shared fixtures for the faceswap Discord bot tests """
+from __future__ import annotations
+import asyncio
+import typing as T
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+_Handler = T.Callable[[web.Request], T.Awaitable[web.Response]]
+
+
+async def _serve(routes: T.Dict[str, _Handler],
+                 test: T.Callable[[TestServer], T.Awaitable[T.Any]]) -> T.Any:
+    """ Run a test coroutine against a server with the given handlers for each path """
+    app = web.Application()
+    for path, handler in routes.items():
+        app.router.add_get(path, handler)
+    async with TestServer(app) as server:
+        return await test(server)
+
+
+@pytest.fixture(name="serve")
+def fixture_serve() -> T.Callable[..., T.Any]:
+    """ Run a test coroutine against a local aiohttp server and return its result """
+    return lambda routes, test: asyncio.run(_serve(routes, test))
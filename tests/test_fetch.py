@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+""" Tests for the fetcher against a local aiohttp test server """
+from __future__ import annotations
+import typing as T
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from fetcher import Fetcher, FetchError
+
+
+def test_retry_after_server_error(serve) -> None:
+    """ 5xx responses are retried until the page is returned, or all retries have failed """
+    hits = []
+
+    async def page(request: web.Request) -> web.Response:
+        hits.append(request.path)
+        if len(hits) < 3:
+            return web.Response(status=503)
+        return web.Response(body=b"faqs")
+
+    async def test(server: TestServer) -> None:
+        assert await Fetcher(retries=2, backoff=0).fetch(str(server.make_url("/"))) == b"faqs"
+        hits.clear()
+        with pytest.raises(FetchError):
+            await Fetcher(retries=1, backoff=0).fetch(str(server.make_url("/")))
+
+    serve({"/": page}, test)
+    assert len(hits) == 2
+
+
+def test_not_modified(serve) -> None:
+    """ A repeat fetch sends the stored ETag and returns nothing on 304 """
+    etags = []
+
+    async def page(request: web.Request) -> web.Response:
+        etags.append(request.headers.get("If-None-Match"))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return web.Response(status=304)
+        return web.Response(body=b"faqs", headers={"ETag": '"v1"'})
+
+    async def test(server: TestServer) -> T.List[T.Optional[bytes]]:
+        fetcher = Fetcher(backoff=0)
+        url = str(server.make_url("/"))
+        return [await fetcher.fetch(url), await fetcher.fetch(url)]
+
+    assert serve({"/": page}, test) == [b"faqs", None]
+    assert etags == [None, '"v1"']
+
+
+def test_unchanged_digest(serve) -> None:
+    """ Content identical to the last conditional fetch is skipped. Unconditional fetches always
+    return the content and store no validators """
+    body = [b"faqs"]
+
+    async def page(_: web.Request) -> web.Response:
+        return web.Response(body=body[0])
+
+    async def test(server: TestServer) -> None:
+        fetcher = Fetcher(backoff=0)
+        url = str(server.make_url("/"))
+        assert await fetcher.fetch(url) == b"faqs"
+        assert await fetcher.fetch(url) is None
+        body[0] = b"new faqs"
+        assert await fetcher.fetch(url) == b"new faqs"
+
+        other = Fetcher(backoff=0)
+        assert await other.fetch(url, conditional=False) == b"new faqs"
+        assert await other.fetch(url, conditional=False) == b"new faqs"
+        assert not other.validators
+
+    serve({"/": page}, test)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+""" Tests for the forum crawler and index against a local aiohttp test server """
+from __future__ import annotations
+import typing as T
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import commands
+from fetcher import Fetcher
+from forum import ForumCrawler, ForumIndex
+
+_INDEX = ("<html><body><a class='forumtitle' href='./viewforum.php?f=1'>Support</a>"
+          "</body></html>")
+
+
+def _page(text: str) -> web.Response:
+    """ An HTML response """
+    return web.Response(text=f"<html><body>{text}</body></html>", content_type="text/html")
+
+
+def _row(topic_id: int, posts: int) -> str:
+    """ A topic's row in a forum's topic listing """
+    return (f"<li class='row'><dl><dt><a class='topictitle' href='./viewtopic.php?t={topic_id}'>"
+            f"Topic {topic_id}</a></dt><dd class='posts'>{posts}</dd><dd class='lastpost'>"
+            f"<a href='./viewtopic.php?p={topic_id}{posts}'>last</a></dd></dl></li>")
+
+
+def _topic(title: str, body: str, tags: T.Iterable[str] = ()) -> str:
+    """ The first page of a topic """
+    links = "".join(f"<a href='./app.php/tag/{tag}'>{tag}</a>" for tag in tags)
+    return (f"<h2 class='topic-title'>{title}</h2><div class='postbody'><div class='content'>"
+            f"{body}</div></div>{links}")
+
+
+def _crawler(server: TestServer, index: ForumIndex) -> ForumCrawler:
+    """ A crawler of the test server that does not retry """
+    crawler = ForumCrawler(index, url=str(server.make_url("/")))
+    crawler.fetcher = Fetcher(retries=0)
+    return crawler
+
+
+def test_crawl_resumes_pending(serve, tmp_path) -> None:
+    """ Topics left in the pending table by an earlier crawl are indexed on the next crawl """
+    available = {7}
+
+    async def index(_: web.Request) -> web.Response:
+        return _page("")
+
+    async def topic(request: web.Request) -> web.Response:
+        topic_id = int(request.query["t"])
+        if topic_id not in available:
+            return web.Response(status=404)
+        return _page(_topic(f"Topic {topic_id} GPU", "cuda error"))
+
+    forum_index = ForumIndex(str(tmp_path / "forum_index.sqlite"))
+    conn = forum_index.connect()
+    with conn:
+        conn.executemany("INSERT INTO pending VALUES (?, ?, ?)", [(7, 1, "a"), (8, 1, "b")])
+    conn.close()
+
+    async def test(server: TestServer) -> T.List[int]:
+        crawler = _crawler(server, forum_index)
+        first = await crawler.crawl()
+        available.add(8)
+        return [first, await crawler.crawl()]
+
+    assert serve({"/index.php": index, "/viewtopic.php": topic}, test) == [1, 1]
+    assert sorted(topic_id for topic_id, _ in forum_index.search("gpu")) == [7, 8]
+    conn = forum_index.connect()
+    assert conn.execute("SELECT COUNT(*) FROM pending").fetchone() == (0, )
+    conn.close()
+
+
+def test_crawl_stops_at_unchanged_page(serve, tmp_path) -> None:
+    """ An incremental crawl stops paging through a forum at the first page with no new or
+    updated topics """
+    posts = {1: 1, 2: 1, 3: 1, 4: 1}
+    activity = dict(zip(posts, posts))
+    listed = []
+
+    async def index(_: web.Request) -> web.Response:
+        return web.Response(text=_INDEX, content_type="text/html")
+
+    async def forum(request: web.Request) -> web.Response:
+        start = int(request.query.get("start", 0))
+        listed.append(start)
+        # Listed by the latest post, as the forum does
+        topics = sorted(posts, key=activity.get, reverse=True)[start:start + 2]
+        following = ("<li class='next'><a href='./viewforum.php?f=1&amp;start="
+                     f"{start + 2}'>Next</a></li>" if start + 2 < len(posts) else "")
+        rows = "".join(_row(idx, posts[idx]) for idx in topics)
+        return _page(f"<ul class='topiclist topics'>{rows}</ul><ul>{following}</ul>")
+
+    async def topic(request: web.Request) -> web.Response:
+        return _page(_topic(f"Topic {request.query['t']}", "text"))
+
+    forum_index = ForumIndex(str(tmp_path / "forum_index.sqlite"))
+
+    async def test(server: TestServer) -> T.List[T.Tuple[int, T.List[int]]]:
+        crawler = _crawler(server, forum_index)
+        retval = []
+        for update in (None, None, 4, 2):
+            if update is not None:
+                posts[update] += 1
+                activity[update] = max(activity.values()) + 1
+            listed.clear()
+            retval.append((await crawler.crawl(), list(listed)))
+        return retval
+
+    routes = {"/index.php": index, "/viewforum.php": forum, "/viewtopic.php": topic}
+    assert serve(routes, test) == [(4, [0, 2]),  # First crawl reads every page
+                                   (0, [0]),  # Nothing changed
+                                   (1, [0, 2]),  # Stops at the unchanged second page
+                                   (1, [0, 2])]  # The updated topic moves to the first page
+
+
+def test_replies_rank_threads(serve, tmp_path, monkeypatch) -> None:
+    """ Search ranks title matches first and tag lists the newest tagged threads, and the search
+    and tag replies link the threads in that order """
+    topics = {1: _topic("Installing on Linux", "cuda drivers", ["install"]),
+              2: _topic("CUDA out of memory", "lower the batch size", ["cuda", "install"]),
+              3: _topic("Slow training", "check cuda is being used", ["cuda"])}
+
+    async def index(_: web.Request) -> web.Response:
+        return _page("")
+
+    async def topic(request: web.Request) -> web.Response:
+        return _page(topics[int(request.query["t"])])
+
+    forum_index = ForumIndex(str(tmp_path / "forum_index.sqlite"))
+    conn = forum_index.connect()
+    with conn:
+        conn.executemany("INSERT INTO pending VALUES (?, 1, 'a')", [(idx, ) for idx in topics])
+    conn.close()
+
+    async def test(server: TestServer) -> int:
+        return await _crawler(server, forum_index).crawl()
+
+    assert serve({"/index.php": index, "/viewtopic.php": topic}, test) == 3
+    assert forum_index.search("cuda")[0] == (2, "CUDA out of memory")
+    assert forum_index.search("cuda", limit=2) == forum_index.search("cuda")[:2]
+    assert [idx for idx, _ in forum_index.search("linux cuda")] == [1]
+    assert forum_index.search("!!") == []
+    assert forum_index.tagged("CUDA") == [(3, "Slow training"), (2, "CUDA out of memory")]
+    assert forum_index.tagged("install", limit=1) == [(2, "CUDA out of memory")]
+
+    monkeypatch.setattr(commands, "FORUM_INDEX", forum_index)
+    monkeypatch.setattr(commands, "get_config", lambda key, default=None, guild_id=None: default)
+    reply = commands.tag_reply({"url": "https://forum/tag/"}, "cuda", [])
+    assert reply.index("?t=3") < reply.index("?t=2")
+    reply = commands.search_reply({"url": "https://forum/search.php"}, ["cuda"], [])
+    assert "?t=2" in reply.split("\n")[1]
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+""" Tests for the command usage report of the logs """
+from __future__ import annotations
+import gzip
+import json
+import os
+import shutil
+import sys
+import typing as T
+
+import log_report
+from log_report import TopCounter, fingerprint, log_files, read_new_entries
+
+
+def _line(idx: int, command: str = "faqs") -> str:
+    """ A log line of a command being called """
+    return json.dumps({"time": f"2026-10-16 10:00:{idx:02d}",
+                       "level": "INFO",
+                       "message": f"command: {command}",
+                       "command": command}) + "\n"
+
+
+def _write(path: str, text: str) -> None:
+    """ Append text to a log file """
+    with open(path, "a", encoding="utf-8") as log_file:
+        log_file.write(text)
+
+
+def _rotate(path: str, date: str) -> str:
+    """ Rotate a log file to its dated name and gzip it, returning the gzipped file """
+    rotated = f"{path}.{date}"
+    os.rename(path, rotated)
+    with open(rotated, "rb") as source, gzip.open(f"{rotated}.gz", "wb") as dest:
+        shutil.copyfileobj(source, dest)
+    os.remove(rotated)
+    return f"{rotated}.gz"
+
+
+def _report(path: str, monkeypatch, capsys) -> T.Dict[str, T.Any]:
+    """ Run the report on a log file with its default checkpoint and return the JSON report """
+    monkeypatch.setattr(sys, "argv", ["log_report.py", path, "--json"])
+    log_report.main()
+    return json.loads(capsys.readouterr().out)
+
+
+def _calls(report: T.Dict[str, T.Any]) -> T.Dict[str, int]:
+    """ The calls of each command in a report """
+    return {key: val["calls"] for key, val in report["commands"].items()}
+
+
+def test_fingerprint_survives_rotation(tmp_path) -> None:
+    """ A file is identified by its complete first line, before and after it is rotated and
+    gzipped """
+    path = str(tmp_path / "fs_bot.log")
+    _write(path, _line(0).rstrip("\n"))
+    assert fingerprint(path) is None
+    _write(path, "\n" + _line(1))
+    key = fingerprint(path)
+    assert key is not None
+    rotated = _rotate(path, "2026-10-16")
+    assert fingerprint(rotated) == key
+    _write(path, _line(2))
+    assert fingerprint(path) != key
+    assert log_files(path) == [rotated, path]
+
+
+def test_partial_line_is_read_once_complete(tmp_path) -> None:
+    """ A partly written last line is left for the next read, which resumes from the saved
+    offset """
+    path = str(tmp_path / "fs_bot.log")
+    offsets: T.Dict[str, int] = {}
+    last = _line(2, "tag")
+    _write(path, _line(0) + _line(1) + last[:10])
+    assert len(list(read_new_entries(path, offsets))) == 2
+    assert offsets == {fingerprint(path): len(_line(0) + _line(1))}
+    _write(path, last[10:])
+    assert [entry["command"] for entry in read_new_entries(path, offsets)] == ["tag"]
+    assert not list(read_new_entries(path, offsets))
+
+
+def test_top_counter_prunes() -> None:
+    """ Holding more than twice capacity keys keeps only the most frequent capacity keys """
+    counter = TopCounter(capacity=2)
+    for key in "aaabbcd":
+        counter.add(key)
+    assert len(counter.counts) == 4
+    counter.add("e")
+    assert counter.counts == {"a": 3, "b": 2}
+    counter.add("f")
+    assert counter.most_common(2) == [("a", 3), ("b", 2)]
+
+
+def test_runs_resume_from_checkpoint(tmp_path, monkeypatch, capsys) -> None:
+    """ A second run only counts the lines logged since the first, including those of a file
+    that has since been rotated and gzipped """
+    path = str(tmp_path / "fs_bot.log")
+    partial = _line(3, "tag")
+    _write(path, _line(0) + _line(1) + _line(2, "tag") + partial[:20])
+    report = _report(path, monkeypatch, capsys)
+    assert report["lines"] == 3
+    assert _calls(report) == {"faqs": 2, "tag": 1}
+
+    _write(path, partial[20:] + _line(4))
+    _rotate(path, "2026-10-16")
+    _write(path, _line(5, "tag"))
+    report = _report(path, monkeypatch, capsys)
+    assert report["lines"] == 6
+    assert _calls(report) == {"faqs": 3, "tag": 3}
+
+    assert _report(path, monkeypatch, capsys) == report
+    with open(f"{path}.stats.json", "r", encoding="utf-8") as checkpoint:
+        assert len(json.load(checkpoint)["offsets"]) == 2
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+""" Tests for the logging helpers """
+from __future__ import annotations
+import logging
+import queue
+
+from log_tools import _REDACT_FILTER, _RedactingListener
+
+
+def test_records_are_redacted_once(monkeypatch) -> None:
+    """ Every handler receives the record redacted once, even where a secret occurs inside the
+    replacement text """
+    monkeypatch.setattr(_REDACT_FILTER, "secrets", {"dac", "token"})
+    handled = []
+
+    class Handler(logging.Handler):
+        """ Collects the messages of the handled records """
+        def emit(self, record: logging.LogRecord) -> None:
+            handled.append(record.getMessage())
+
+    listener = _RedactingListener(queue.SimpleQueue(), Handler(), Handler())
+    record = logging.makeLogRecord({"msg": "a token and dac"})
+    listener.handle(record)
+    assert handled == ["a <redacted> and <redacted>"] * 2
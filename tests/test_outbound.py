@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+""" Tests for packing replies into messages and the channel send queues """
+from __future__ import annotations
+import asyncio
+
+from discord import Embed
+
+from log_tools import _CONTEXT, set_log_context
+from outbound import MAX_CONTENT, MAX_EMBEDS, Outbox, Reply
+
+
+def test_texts_are_joined_up_to_the_limit() -> None:
+    """ Paragraphs share a message until the next would take it over the character limit """
+    first, second = "a" * 1000, "b" * 997
+    messages = Reply(first).add_text(second).add_text("c").messages()
+    assert messages == [{"content": f"{first}\n\n{second}"}, {"content": "c"}]
+    assert len(messages[0]["content"]) == MAX_CONTENT - 1
+
+
+def test_long_text_is_split() -> None:
+    """ A paragraph over the character limit is split across messages """
+    lengths = [len(msg["content"]) for msg in Reply("x" * (MAX_CONTENT * 2 + 1)).messages()]
+    assert lengths == [MAX_CONTENT, MAX_CONTENT, 1]
+
+
+def test_embeds_are_batched() -> None:
+    """ Embeds are attached to the text messages in batches of the per message limit """
+    embeds = [Embed(title=str(idx)) for idx in range(MAX_EMBEDS + 1)]
+    reply = Reply("text")
+    for embed in embeds:
+        reply.add_embed(embed)
+    assert reply.messages() == [{"content": "text", "embeds": embeds[:MAX_EMBEDS]},
+                                {"embeds": embeds[MAX_EMBEDS:]}]
+
+
+def test_new_message_keeps_order() -> None:
+    """ Text and embeds added after starting a new message are sent after everything before """
+    patreon, dev = Embed(title="patreon"), Embed(title="dev")
+    reply = Reply("donate").add_embed(patreon).new_message().add_text("alternatively")
+    reply.add_embed(dev)
+    assert reply.messages() == [{"content": "donate", "embeds": [patreon]},
+                                {"content": "alternatively", "embeds": [dev]}]
+    assert Reply().messages() == []
+
+
+def test_queue_has_empty_log_context() -> None:
+    """ Send jobs run without the log context of the command that created the channel queue """
+    async def run() -> list:
+        outbox = Outbox()
+        set_log_context(command="faqs")
+
+        async def job() -> dict:
+            return _CONTEXT.get()
+
+        return [await outbox.submit(1, job), _CONTEXT.get()]
+
+    queued, command = asyncio.run(run())
+    assert queued == {} and command["command"] == "faqs"
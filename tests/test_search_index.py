@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+""" Tests for the FAQ search index """
+from __future__ import annotations
+import pickle
+import typing as T
+
+import pytest
+
+from search_index import SearchIndex
+
+_DOCUMENTS = {"#train": ["How do I train a model?", "Run the train command on your faces"],
+              "#trainer": ["Which trainer should I use?", "Original is the fastest of them"],
+              "#memory": ["Out of memory errors", "Lower the batch size to use less memory"],
+              "#cuda": ["CUDA errors", "Check that the memory of the GPU is not used up"],
+              "#order": ["Memory out of order", "The words are in another order"]}
+
+
+@pytest.fixture(name="index")
+def fixture_index() -> SearchIndex:
+    """ A finalized index of the test documents """
+    return SearchIndex.from_documents(_DOCUMENTS)
+
+
+def _keys(index: SearchIndex, query: str, limit: T.Optional[int] = None) -> T.List[str]:
+    """ The keys of the search results """
+    return [key for key, _ in index.search(query, limit=limit)]
+
+
+def test_exact_before_prefix(index) -> None:
+    """ Documents containing the exact term rank above those only matching it as a prefix """
+    results = _keys(index, "train")
+    assert set(results) == {"#train", "#trainer"}
+    assert results[0] == "#train"
+    assert _keys(index, "traine") == ["#trainer"]
+
+
+def test_terms_must_all_match(index) -> None:
+    """ Every bare term in a query must appear in a result """
+    assert set(_keys(index, "memory")) == {"#memory", "#cuda", "#order"}
+    assert _keys(index, "cuda memory") == ["#cuda"]
+    assert _keys(index, "cuda nothing") == []
+
+
+def test_phrase_needs_adjacent_terms(index) -> None:
+    """ A quoted phrase only matches consecutive terms """
+    assert _keys(index, '"out of memory"') == ["#memory"]
+    assert _keys(index, '"memory out of"') == ["#order"]
+    assert _keys(index, '"batch memory"') == []
+    assert _keys(index, '"lower the" memory') == ["#memory"]
+
+
+def test_limit_is_top_k(index) -> None:
+    """ A limit returns the best results of the full ranking """
+    ranked = index.search("memory")
+    assert index.search("memory", limit=2) == ranked[:2]
+    assert index.search("memory", limit=10) == ranked
+    assert [score for _, score in ranked] == sorted((score for _, score in ranked), reverse=True)
+
+
+@pytest.mark.parametrize("query", ["", "   ", "?!", '""', "..."])
+def test_empty_query(index, query) -> None:
+    """ Queries without any words return nothing """
+    assert index.search(query) == []
+
+
+def test_pickle_round_trip(index) -> None:
+    """ An index restored from a pickle returns the same results """
+    restored = pickle.loads(pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL))
+    assert len(restored) == len(index)
+    for query in ("train", "memory", "cuda memory", '"out of memory"', "tra"):
+        assert restored.search(query) == index.search(query)
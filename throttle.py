@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+""" Duplicate reply suppression and command cooldowns for faceswap Discord bot
+
+When several helpers answer the same user with the same command at the same time, only the first
+reply is sent. Replies are identified by channel, command, resolved task and the users that the
+reply is addressed to, and a reply that is identical to one sent within the dedup window is
+dropped. Replies are also limited by optional per channel and per user cooldowns.
+
+Settings are read from a "throttle" section in the global lookups, which a command's own
+"throttle" section overrides, for example::
+
+    "throttle": {"dedup_window": 10,
+                 "channel": {"rate": 5, "per": 30},
+                 "user": {"rate": 3, "per": 15}}
+
+allows at most 5 replies every 30 seconds in a channel and 3 replies every 15 seconds to the
+commands of a single user. A "channel" or "user" of ``null`` (the default) disables that
+cooldown, and a "dedup_window" of `0` disables duplicate suppression.
+"""
+from __future__ import annotations
+import logging
+import typing as T
+
+import discord
+from discord.ext.commands import CooldownMapping
+
+from guild_cache import Debouncer
+from metrics import METRICS
+from utils import get_lookups
+
+if T.TYPE_CHECKING:
+    from discord.ext.commands.context import Context
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+_DEFAULTS: T.Dict[str, T.Any] = {"dedup_window": 10., "channel": None, "user": None}
+_BUCKETS = ("channel", "user")
+
+
+def _bucket_key(key: T.Hashable) -> T.Hashable:
+    """ Cooldown buckets are keyed directly by the channel or user id """
+    return key
+
+
+class ResponseThrottle():
+    """ Decides whether a command's reply should be sent, dropping duplicate replies and replies
+    over the cooldowns configured in the lookups """
+    def __init__(self) -> None:
+        self._dedup = Debouncer(window=_DEFAULTS["dedup_window"])
+        self._cooldowns: T.Dict[T.Tuple[str, str, T.Optional[int]],
+                                T.Tuple[T.Tuple[int, float], CooldownMapping]] = {}
+
+    @staticmethod
+    def get_config(command: str, guild_id: T.Optional[int] = None) -> T.Dict[str, T.Any]:
+        """ Return the throttle settings for a command from the lookups, falling back to the
+        defaults """
+        lookup = get_lookups(guild_id)[1]
+        command_config = lookup.get(command, {})
+        return {**_DEFAULTS,
+                **lookup["global"].get("throttle", {}),
+                **(command_config.get("throttle", {}) if isinstance(command_config, dict)
+                   else {})}
+
+    def _cooldown(self,
+                  command: str,
+                  bucket: str,
+                  guild_id: T.Optional[int],
+                  setting: T.Optional[T.Dict[str, float]]) -> T.Optional[CooldownMapping]:
+        """ The cooldown mapping for a command's bucket, replaced if its setting has changed """
+        if not setting:
+            return None
+        rate = (int(setting["rate"]), float(setting["per"]))
+        key = (command, bucket, guild_id)
+        cached = self._cooldowns.get(key)
+        if cached is None or cached[0] != rate:
+            cached = self._cooldowns[key] = (rate,
+                                             CooldownMapping.from_cooldown(*rate, _bucket_key))
+        return cached[1]
+
+    def allow(self,
+              context: T.Union[Context, discord.Interaction],
+              task: T.Optional[T.Hashable],
+              at_users: T.Iterable[str]) -> bool:
+        """ Return whether a command's reply should be sent, counting it against the cooldowns and
+        the dedup window if it should. The reply is identified by the command, the task it resolved
+        to and the mentions it is addressed to """
+        assert context.command is not None
+        command = context.command.name
+        guild_id = getattr(context.guild, "id", None)
+        config = self.get_config(command, guild_id)
+        if isinstance(context, discord.Interaction):
+            keys = {"channel": context.channel_id, "user": context.user.id}
+        else:
+            keys = {"channel": context.channel.id, "user": context.message.author.id}
+
+        for bucket in _BUCKETS:
+            mapping = self._cooldown(command, bucket, guild_id, config[bucket])
+            if mapping is not None and mapping.update_rate_limit(keys[bucket]):
+                logger.info("Dropping '%s' reply (%s cooldown)", command, bucket)
+                METRICS.increment("replies_dropped_total", command=command, reason=bucket)
+                return False
+
+        if config["dedup_window"] <= 0:
+            return True
+        self._dedup.window = config["dedup_window"]
+        users = frozenset(user.replace("!", "") for user in at_users)
+        if not self._dedup.first((keys["channel"], command, task, users)):
+            logger.info("Dropping duplicate '%s' reply (task: %s)", command, task)
+            METRICS.increment("replies_dropped_total", command=command, reason="duplicate")
+            return False
+        return True
+
+
+THROTTLE = ResponseThrottle()
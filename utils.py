@@ -3,85 +3,141 @@
 from __future__ import annotations
 import json
 import logging
-import os
 import sys
 import typing as T
 
-from log_tools import log_setup
+from arguments import parse_arguments
+from deletions import DELETIONS
+from instance import get_data_path
+from log_tools import configure_logging, set_log_context
 
 if T.TYPE_CHECKING:
     from discord.ext.commands.context import Context
+    from arguments import Arguments, TaskMatcher
 
-log_setup()
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 _LOOKUP: T.Optional[T.Dict[str, T.Dict[str, T.Any]]] = None
+_GENERATION = 0
+_GUILD_LOOKUPS: T.Dict[int, T.Tuple[int, T.Dict[str, T.Dict[str, T.Any]]]] = {}
 
 
-def load_lookups() -> None:
-    """ Load the lookups """
-    global _LOOKUP  # pylint: disable=global-statement
-    pypath = os.path.dirname(os.path.realpath(sys.argv[0]))
-    f_name = os.path.join(pypath, "lookup.json")
-    logger.info("Loading lookups from: %s", f_name)
-    with open(f_name, "r", encoding="utf-8") as conf:
-        _LOOKUP = json.load(conf)
-    logger.info("Loaded lookups: %s", _LOOKUP)
+def get_lookup_path() -> str:
+    """ Return the full path to the lookups file """
+    return get_data_path("lookup.json")
 
 
-load_lookups()
+def load_lookups(validate: T.Optional[T.Callable[[T.Dict[str, T.Any]], None]] = None) -> None:
+    """ Load the lookups. If a validate function is given, it is called with the new lookups
+    and should raise an exception if they are invalid, in which case the currently loaded
+    lookups are kept """
+    global _LOOKUP, _GENERATION  # pylint: disable=global-statement
+    f_name = get_lookup_path()
+    logger.info("Loading lookups from: %s", f_name)
+    with open(f_name, "r", encoding="utf-8") as conf:
+        lookup = json.load(conf)
+    if validate is not None:
+        validate(lookup)
+    _LOOKUP = lookup
+    _GENERATION += 1
+    configure_logging(lookup["global"].get("logging", {}), secrets=[lookup["global"]["token"]])
+    logger.info("Loaded lookups (generation: %s, keys: %s)", _GENERATION, list(lookup))
+
+
+def merge_lookups(base: T.Dict[str, T.Any], overlay: T.Dict[str, T.Any]) -> T.Dict[str, T.Any]:
+    """ Return a copy of base with the values in overlay recursively merged in """
+    retval = dict(base)
+    for key, val in overlay.items():
+        if isinstance(val, dict) and isinstance(base.get(key), dict):
+            retval[key] = merge_lookups(base[key], val)
+        else:
+            retval[key] = val
+    return retval
+
+
+def get_lookups(guild_id: T.Optional[int] = None) -> T.Tuple[int, T.Dict[str, T.Dict[str, T.Any]]]:
+    """ Return the generation of the currently loaded lookups and the lookups. The generation
+    increments every time the lookups are loaded. If a guild id is given and the lookups contain
+    an overlay for that guild in their "guilds" section, the lookups are returned with the
+    overlay merged in. The lookups are loaded on first use if they have not been loaded """
+    if _LOOKUP is None:
+        load_lookups()
+    assert _LOOKUP is not None
+    overlay = None if guild_id is None else _LOOKUP.get("guilds", {}).get(str(guild_id))
+    if not overlay:
+        return _GENERATION, _LOOKUP
+    cached = _GUILD_LOOKUPS.get(guild_id)
+    if cached is None or cached[0] != _GENERATION:
+        cached = _GUILD_LOOKUPS[guild_id] = (_GENERATION, merge_lookups(_LOOKUP, overlay))
+    return cached
 
 
 def get_token() -> str:
     """ Return the API Token """
-    assert _LOOKUP is not None
-    return _LOOKUP["global"]["token"]
+    return get_lookups()[1]["global"]["token"]
 
 
 def get_roles() -> T.Tuple[str, ...]:
     """ Return the groups permitted to call the command """
-    assert _LOOKUP is not None
-    return tuple(_LOOKUP["global"]["roles"])
+    return tuple(get_lookups()[1]["global"]["roles"])
 
 
-def get_def(command: str) -> T.Dict[str, T.Any]:
-    """ Return the command definition for given command name """
-    assert _LOOKUP is not None
-    return _LOOKUP[command]["def"]
+def get_config(key: str, default: T.Any = None, guild_id: T.Optional[int] = None) -> T.Any:
+    """ Return an optional setting from the global section of the lookups, with the given
+    guild's overlay applied """
+    return get_lookups(guild_id)[1]["global"].get(key, default)
 
 
-async def init_command(context: Context) -> T.Tuple[T.Dict[str, T.Any], T.List[str], T.List[str]]:
+def get_def(command: str) -> T.Dict[str, T.Any]:
+    """ Return the command definition for given command name """
+    return get_lookups()[1][command]["def"]
+
+
+def log_command(context: Context) -> str:
+    """ Set the log context for the invoked command and log the call. Return the command name """
+    if context.command is not None:
+        command = context.command.name
+    else:
+        command = sys._getframe(2).f_code.co_name  # pylint: disable=protected-access
+    set_log_context(command=command,
+                    channel_id=getattr(context.channel, "id", None),
+                    user_id=getattr(context.message.author, "id", None),
+                    message_id=context.message.id)
+    logger.info("command: %s", command)
+    logger.debug("call: %s", context.message)
+    return command
+
+
+async def init_command(context: Context, matcher: T.Optional[TaskMatcher] = None
+                       ) -> T.Tuple[T.Dict[str, T.Any], Arguments]:
     """ Init the command
     Log the call
-    Delete the command message
-    return lookup, at_users and split message
+    Schedule the command message for deletion
+    return lookup and the parsed message arguments, resolving the task with matcher if given
     """
-    assert _LOOKUP is not None
-    command = sys._getframe(1).f_code.co_name  # pylint: disable=protected-access
-    logger.info("command: %s, call: %s", command, context.message)
-    await context.message.delete()
-    lookup = _LOOKUP[command]
-    at_users, message = get_at_users(context.message.content.split())
-    return lookup, at_users, message
-
-
-def get_at_users(message: T.List[str]) -> T.Tuple[T.List[str], T.List[str]]:
-    """ Pop the users from the message list into their own list """
-    at_users = [msg for msg in message if msg.startswith("<@")]
-    message = [msg for msg in message if not msg.startswith("<@")]
-    logger.info("at_users: '%s', message: %s", at_users, message)
-    return at_users, message
-
-
-def get_task(message: T.List[str], tasks: T.List[str]) -> T.Tuple[T.Optional[str], T.List[str]]:
-    """ Pop the task from the message list and return as string """
-    tasks = [task.lower() for task in tasks]
-    task = None
-    for idx, msg in enumerate(message):
-        if msg.lower() in tasks:
-            task = message.pop(idx).lower()
-            break
-    logger.info("task: '%s', message: %s", task, message)
-    return task, message
+    command = log_command(context)
+    DELETIONS.delete(context.message)
+    lookup = get_lookups(getattr(context.guild, "id", None))[1][command]
+    args = parse_arguments(context.message, matcher)
+    if args.task is not None:
+        set_log_context(task=args.task)
+    return lookup, args
+
+
+def try_lock_file(path: str) -> T.Optional[T.IO]:
+    """ Try to take an exclusive lock on the given file without blocking, so that only one process
+    performs a task. Returns the open lock file, or ``None`` if another process holds the lock.
+    File locking is not available on Windows, where the lock is always taken """
+    handle = open(path, "a", encoding="utf-8")  # pylint: disable=consider-using-with
+    try:
+        import fcntl  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return handle
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
 
 
 def format_message(message: str, at_users: T.Optional[T.List[str]] = None) -> str:
@@ -89,5 +145,5 @@ def format_message(message: str, at_users: T.Optional[T.List[str]] = None) -> st
     first, rest = message[:1], message[1:]
     first = f"Hey {', '.join(at_users)}, {first.lower()}" if at_users else first.upper()
     msg = first + rest
-    logger.info("formatted message: '%s'", msg)
+    logger.debug("formatted message: '%s'", msg)
     return msg